@@ -1,17 +1,38 @@
 import os
-from uuid import UUID
-from flask import Flask, request, jsonify, make_response
-from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity, jwt_required, JWTManager, set_access_cookies
-from sqlalchemy import select
+from uuid import UUID, uuid4
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity, jwt_required, verify_jwt_in_request, JWTManager, set_access_cookies
+from sqlalchemy import select, insert, literal, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session 
+from sqlalchemy.orm import Session, contains_eager
 from datetime import date, datetime, time, timedelta
 import logging, traceback
-from werkzeug.security import check_password_hash, generate_password_hash
+import threading
+from functools import wraps
+import base64, binascii
+import io
+from itertools import dropwhile, islice
 import re
 from flask_cors import CORS
-from database import engine, OperatorsAvailability, Operator, Laboratory, SlotBooking, LaboratoryClosure, OperatorAbsence, ExamType, Account
-from operators_availability import generate_availabile_slots
+from database import get_engine, get_read_engine, get_autocommit_engine, DATA_VERSIONED_TABLES, SLOT_CHANGES_TRIGGERS, OperatorsAvailability, Operator, Laboratory, SlotBooking, LaboratoryClosure, OperatorAbsence, ExamType, Account
+from operators_availability import iter_availabile_slots, slot_sort_key, slots_to_compact
+from operators_availability_numpy import NUMPY_AVAILABLE, iter_availabile_slots_numpy
+from operators_availability_sql import iter_availabile_slots_sql
+from operators_availability_parallel import iter_availabile_slots_parallel
+from concurrent_queries import run_queries
+from slot_changes import SLOT_CHANGES_DEFAULT_LIMIT, SLOT_CHANGES_MAX_LIMIT, SlotChangesResyncRequired, query_current_version, query_slot_changes, slot_change_to_dict, start_compaction as start_slot_changes_compaction
+from slot_events import events_available, subscribe, unsubscribe as unsubscribe_slot_events, iter_subscriber_events
+from slots_summary import SUMMARY_GROUP_BY, summarize_availabile_slots
+from data_versions import compute_etag, invalidate_data_versions
+from json_serialization import get_json_provider_class
+from compression import compress_response, etag_variants
+from metrics import METRICS_ENABLED, start_request, finish_request, count_query, phase_timer, increment, render_metrics, metrics_token_matches
+from validation import USERNAME_REGEX, PASSWORD_REGEX, EMAIL_REGEX, TEL_NUMBER_REGEX
+from password_hashing import PasswordHashingBusy, hash_password, verify_password, needs_rehash
+from token_blocklist import is_token_revoked, revoke_token
+from bulk_import import IMPORT_KINDS, IMPORT_FORMATS, IMPORT_CHUNK_SIZE, import_rows, read_rows
+from slots_cache import SLOTS_CACHE_ENABLED, SLOTS_CACHE_WARMUP, iter_cached_slots, invalidate_booking, sync_slots_cache, warm_up as warm_up_slots_cache
 from dotenv import load_dotenv
 
 #https://flask.palletsprojects.com/en/stable/quickstart/
@@ -29,6 +50,8 @@ FRONTEND_URL = os.getenv("FRONTEND_URL")
 BACKEND_URL = os.getenv("BACKEND_URL")
 
 app = Flask(__name__)
+# provider JSON configurato con JSON_SERIALIZER (orjson se installato)
+app.json = get_json_provider_class()(app)
 app.config["JWT_SECRET_KEY"] = JWT_SECRET_KEY
 
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=30)
@@ -75,12 +98,39 @@ CORS(
   supports_credentials=True
 )
 
-# Block list per i token JWT invalidi (/logout)
-BLOCKLIST = set()
+# metriche per route: latenza, status e numero di query della richiesta (esposte su /metrics)
+# registrato prima della compressione in modo che la latenza la comprenda (gli after_request sono eseguiti in ordine inverso)
+if METRICS_ENABLED:
+    event.listen(Engine, "before_cursor_execute", count_query)
+
+@app.before_request
+def start_request_metrics():
+    if METRICS_ENABLED:
+        start_request()
+
+@app.after_request
+def finish_request_metrics(response):
+    if METRICS_ENABLED:
+        finish_request(request.endpoint or "unmatched", request.method, response.status_code)
+    return response
+
+# compressione delle risposte grandi negoziata con Accept-Encoding
+@app.after_request
+def compress_response_body(response):
+    return compress_response(response, request.accept_encodings)
+
+# con il pool di hashing delle password saturo le route di login e registrazione rispondono 503
+@app.errorhandler(PasswordHashingBusy)
+def handle_password_hashing_busy(e):
+    response = jsonify({"error": "Service busy, retry later"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+# Block list per i token JWT invalidi (/logout), condivisa tra i worker e mantenuta fino alla scadenza dei token
 @jwt.token_in_blocklist_loader
 def check_if_token_in_blocklist(jwt_header, jwt_payload):
     jti = jwt_payload["jti"]
-    is_blocked = jti in BLOCKLIST
+    is_blocked = is_token_revoked(jti, jwt_payload["exp"])
     logging.info(f"Verifica blocklist per JTI {jti}: {'Bloccato' if is_blocked else 'Non bloccato'}")
     return is_blocked
 
@@ -92,34 +142,25 @@ def register():
     if not new_account:
         return jsonify({"Request invalid":"missing JSON body"}), 400
 
-    #Caratteri e numeri da 6 a 30 caratteri
-    username_regex = r'^[0-9A-Za-z]{6,30}$'
-    #Almeno una lettera maiuscola, una minuscola, un numero e un simbolo lunghezza da 8 a 32 caratteri
-    password_regex = r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[^a-zA-Z0-9]).{8,32}$'
-    #Email valida
-    email_regex    = r'^[a-zA-Z0-9._%+\-]+@[a-zA-Z0-9.\-]+\.[a-zA-Z]{2,}$'
-    #Numero di telefono internazionale
-    tel_number_regex = r'^\+?\d{10,13}$'
-
-    if not re.match(username_regex, new_account.get("username", "")):
+    if not re.match(USERNAME_REGEX, new_account.get("username", "")):
         return jsonify({"error": "Invalid username"}), 400
-    if not re.match(password_regex, new_account.get("password", "")):
+    if not re.match(PASSWORD_REGEX, new_account.get("password", "")):
         return jsonify({"error": "Invalid password"}), 400
-    if not re.match(email_regex, new_account.get("email", "")):
+    if not re.match(EMAIL_REGEX, new_account.get("email", "")):
         return jsonify({"error": "Invalid email"}), 400
-    if not re.match(tel_number_regex, new_account.get("tel_number", "")):
+    if not re.match(TEL_NUMBER_REGEX, new_account.get("tel_number", "")):
         return jsonify({"error": "Invalid tel_number"}), 400
     
     new_account = Account(
         username=new_account.get("username"),
-        password_hash = generate_password_hash(new_account.get("password")),
+        password_hash = hash_password(new_account.get("password")),
         email=new_account.get("email"),
         tel_number=new_account.get("tel_number"),
         first_name=new_account.get("first_name"),
         last_name=new_account.get("last_name")
     )
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         
         # verifica eventuali username o email già presenti nel database
         username_query = select(Account).where(Account.username == new_account.username)
@@ -147,9 +188,11 @@ def login():
     if not account_data:
         return jsonify({"error":"missing JSON body"}), 400
     
-    with Session(engine) as session:
+    with Session(get_engine(), expire_on_commit=False) as session:
         account_query = select(Account).where(Account.username == account_data.get("username"))
         account = session.execute(account_query).scalars().first()
+        # chiude la transazione di lettura in modo che la connessione torni al pool durante il calcolo dell'hash
+        session.commit()
 
         if not account:
             return jsonify({"error": "Invalid username or password"}), 401
@@ -160,10 +203,14 @@ def login():
         if (account.failed_login_count >= 5) and ((datetime.now() - account.last_failed_login) < timedelta(minutes=5)):
             return jsonify({"error": "Too many login attempts"}), 401
 
-        if  check_password_hash(account.password_hash, account_data.get("password")):
+        if  verify_password(account.password_hash, account_data.get("password")):
         
             account.failed_login_count = 0
             account.last_failed_login = None
+            # se l'hash è stato calcolato con parametri diversi da quelli configurati viene ricalcolato con la password appena verificata
+            if needs_rehash(account.password_hash):
+                account.password_hash = hash_password(account_data.get("password"))
+                logging.info("Hash della password aggiornato per l'account %s", account.account_id)
             session.commit()
 
             access_token = create_access_token(identity=account.account_id)
@@ -183,7 +230,7 @@ def login():
 def mylogin():
 
     current_user = UUID(get_jwt_identity())
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
 
         account_query = select(Account).where(Account.account_id == current_user)
         account = session.execute(account_query).scalars().first()
@@ -203,141 +250,543 @@ def mylogin():
 @jwt_required()
 def logout():
     try:
-        jti = get_jwt()["jti"]
-        BLOCKLIST.add(jti)
+        jwt_payload = get_jwt()
+        jti = jwt_payload["jti"]
+        revoke_token(jti, jwt_payload["exp"])
         logging.info(f"Token {jti} aggiunto alla blocklist con successo")
         return jsonify({"Success": "Logged out"}), 200
     except Exception as e:
         logging.error(f"Errore durante il logout: {e}")
         return jsonify({"error": "Errore durante il logout"}), 500
 
-@app.get('/slots_availability')
-@jwt_required()
-def get_slots_availability():
-   
-    # Imposta i valori di default per i filtri dalla data di oggi a 60 giorni avanti
-    
+#decoratore per le GET di consultazione: calcola l'ETag dalle versioni delle tabelle da cui dipende la risposta
+#e risponde 304 se la richiesta contiene lo stesso ETag in If-None-Match, senza eseguire la route
+#la data corrente fa parte dell'ETag perché i filtri di default sugli slot partono da domani
+#la cache degli slot viene allineata alle stesse versioni prima di essere letta (sync_slots_cache): il contenuto di una risposta
+#servita dalla cache è aggiornato almeno quanto le versioni da cui è calcolato il suo ETag
+def conditional_get(*tables):
+    def decorator(route):
+        @wraps(route)
+        def wrapper(*args, **kwargs):
+            etag = compute_etag(tables, request.path, request.query_string, request.headers.get("Accept"), date.today())
+            # il client può avere una qualsiasi delle rappresentazioni (compressa o meno) della risposta
+            matching_etag = next((variant for variant in etag_variants(etag) if request.if_none_match.contains(variant)), None) if etag else None
+            if matching_etag:
+                response = make_response("", 304)
+                response.set_etag(matching_etag)
+                response.vary.add("Accept-Encoding")
+                return response
+            response = make_response(route(*args, **kwargs))
+            if etag and response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+# motori di generazione degli slot, selezionabili con SLOTS_ENGINE o per richiesta con il parametro engine
+SLOTS_ENGINES = {"python": iter_availabile_slots}
+if NUMPY_AVAILABLE:
+    SLOTS_ENGINES["numpy"] = iter_availabile_slots_numpy
+# generazione su un pool di processi per le finestre ampie, sotto soglia equivale al motore python
+SLOTS_ENGINES["parallel"] = iter_availabile_slots_parallel
+# il motore sql calcola gli slot sul database e riceve anche cursore e limite della pagina
+SLOTS_ENGINE_NAMES = (*SLOTS_ENGINES, "sql")
+SLOTS_ENGINE = os.getenv("SLOTS_ENGINE", "python")
+
+# formati di risposta di /slots_availability, selezionabili con il parametro format o con l'header Accept
+# il formato compact invia le disponibilità una sola volta e gli slot come righe [indice, giorno, minuto inizio, minuto fine]
+SLOTS_COMPACT_MIMETYPE = "application/vnd.prenotazione.slots.compact+json"
+SLOTS_FORMATS_BY_MIMETYPE = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    SLOTS_COMPACT_MIMETYPE: "compact"
+}
+
+# valori di default e massimi per la paginazione degli slot (parametri limit e cursor)
+SLOTS_PAGE_DEFAULT_LIMIT = 100
+SLOTS_PAGE_MAX_LIMIT = 1000
+
+# numero massimo di slot restituiti dalla ricerca dei primi slot liberi (/slots_availability/next)
+SLOTS_NEXT_MAX_COUNT = 50
+
+#funzione per leggere i filtri delle route sugli slot, solleva ValueError se i filtri non sono in un formato valido
+def parse_slots_filters():
+
+    # Imposta i valori di default per i filtri dalla data di domani a 365 giorni avanti
     first_reservation_datetime = datetime.combine((datetime.now() + timedelta(days=1)).date(), time(0, 0))
     last_reservation_datetime = datetime.combine((datetime.now() + timedelta(days=365)).date(), time(0, 0))
 
     # se i filtri sono presenti, sovrascrivi i valori di default se all'interno del range dei filtri di default
+    if request.args.get('datetime_from_filter'):
+        datetime_from_filter = max(
+            datetime.fromisoformat(request.args.get('datetime_from_filter')), first_reservation_datetime)
+    else:
+        datetime_from_filter = first_reservation_datetime
+    if request.args.get('datetime_to_filter'):
+        datetime_to_filter = min(
+            datetime.fromisoformat(request.args.get('datetime_to_filter')),last_reservation_datetime)
+    else:
+        datetime_to_filter = last_reservation_datetime 
+
+    # i filtri opzionali sono UUID
+    exam_type_id = request.args.get('exam_type_id')
+    if exam_type_id:
+        exam_type_id = UUID(exam_type_id)
+    operator_id = request.args.get('operator_id')
+    if operator_id:
+        operator_id = UUID(operator_id)
+    laboratory_id = request.args.get('laboratory_id')
+    if laboratory_id:
+        laboratory_id = UUID(laboratory_id)
+
+    return slots_filters(datetime_from_filter, datetime_to_filter, exam_type_id, operator_id, laboratory_id)
+
+#funzione per creare il dizionario dei filtri usato dalle query sugli slot
+def slots_filters(datetime_from_filter, datetime_to_filter, exam_type_id = None, operator_id = None, laboratory_id = None):
+    return {
+        "datetime_from_filter": datetime_from_filter,
+        "datetime_to_filter": datetime_to_filter,
+        "exam_type_id": exam_type_id,
+        "operator_id": operator_id,
+        "laboratory_id": laboratory_id
+    }
+
+#funzione per codificare la chiave di uno slot (data, ora di inizio, availability_id) in un cursore opaco
+def encode_slots_cursor(slot):
+    slot_date, slot_start, availability_id = slot_sort_key(slot)
+    return base64.urlsafe_b64encode(f"{slot_date.isoformat()}|{slot_start.isoformat()}|{availability_id}".encode()).decode()
+
+#funzione per decodificare un cursore nella chiave di ordinamento degli slot, solleva ValueError se il cursore non è valido
+def decode_slots_cursor(cursor):
     try:
-        if request.args.get('datetime_from_filter'):
-            datetime_from_filter = max(
-                datetime.fromisoformat(request.args.get('datetime_from_filter')), first_reservation_datetime)
-        else:
-            datetime_from_filter = first_reservation_datetime
-        if request.args.get('datetime_to_filter'):
-            datetime_to_filter = min(
-                datetime.fromisoformat(request.args.get('datetime_to_filter')),last_reservation_datetime)
-        else:
-            datetime_to_filter = last_reservation_datetime 
+        cursor_date, cursor_start, cursor_availability_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    return (date.fromisoformat(cursor_date), time.fromisoformat(cursor_start), UUID(cursor_availability_id))
+
+#funzione per caricare le prenotazioni attive che escludono slot dalla generazione
+def query_booked_slots(session, filters):
+
+    datetime_from_filter = filters["datetime_from_filter"]
+    exam_type_id = filters["exam_type_id"]
+    operator_id = filters["operator_id"]
+    laboratory_id = filters["laboratory_id"]
+
+    booked_slots_query = (
+        select(SlotBooking)
+        .join(OperatorsAvailability, SlotBooking.availability_id == OperatorsAvailability.availability_id)
+        .where(SlotBooking.rejected == False)
+    )
 
-    # se i filtri opzionali vengono passati in un formato non valido, restituisci un errore    
+    if datetime_from_filter:
+        booked_slots_query = booked_slots_query.where(SlotBooking.appointment_date >= datetime_from_filter.date())
+    if exam_type_id:
+        booked_slots_query = booked_slots_query.where(OperatorsAvailability.exam_type_id == exam_type_id)
+    if operator_id:
+        booked_slots_query = booked_slots_query.where(OperatorsAvailability.operator_id == operator_id)
+    if laboratory_id:
+        booked_slots_query = booked_slots_query.where(OperatorsAvailability.laboratory_id == laboratory_id)
 
-        exam_type_id = request.args.get('exam_type_id', type=int)
-        if exam_type_id:
-            exam_type_id = UUID(exam_type_id)
-        operator_id = request.args.get('operator_id', type=int)
-        if operator_id:
-            operator_id = UUID(operator_id)
-        laboratory_id = request.args.get('laboratory_id', type=int)
-        if laboratory_id:
-            laboratory_id = UUID(laboratory_id)
+    with phase_timer("conflicts_query"):
+        return session.execute(booked_slots_query).scalars().all()
 
-    except (ValueError):
-        return jsonify({"error": "Missing key or invalid value format"}), 400
+#funzione per caricare i periodi di chiusura dei laboratori
+def query_laboratory_closures(session, filters):
 
-    logging.info("data inizio generazione slot: %s", datetime_from_filter)
-    logging.info("data fine generazione slot: %s", datetime_to_filter)
+    datetime_from_filter = filters["datetime_from_filter"]
+    laboratory_id = filters["laboratory_id"]
 
-    # tramite la sessione crea la availability_query
-    with Session(engine) as session:
+    laboratory_closures_query = select(LaboratoryClosure)
+    
+    if datetime_from_filter:
+        laboratory_closures_query = laboratory_closures_query.where(LaboratoryClosure.end_datetime >= datetime_from_filter)
+    if laboratory_id:
+        laboratory_closures_query = laboratory_closures_query.where(LaboratoryClosure.laboratory_id == laboratory_id)
 
-        # Crea la query per gli slot prenotabili
-        logging.info("Esecuzione Query")
-        logging.info(
-        "Parametri: exam_type_id=%s, operator_id=%s, laboratory_id=%s, datetime_from_filter=%s",
-             exam_type_id, operator_id, laboratory_id, datetime_from_filter
-        )
+    with phase_timer("conflicts_query"):
+        return session.execute(laboratory_closures_query).scalars().all()
 
-        # Query per gli slot già prenotati
+#funzione per caricare i periodi di assenza degli operatori
+def query_operator_absences(session, filters):
 
-        booked_slots_query = (
-            select(SlotBooking)
-            .join(OperatorsAvailability, SlotBooking.availability_id == OperatorsAvailability.availability_id)
-            .where(SlotBooking.rejected == False)
+    datetime_from_filter = filters["datetime_from_filter"]
+    operator_id = filters["operator_id"]
+
+    operator_absences_query  = select(OperatorAbsence)
+
+    if datetime_from_filter:
+        operator_absences_query = operator_absences_query.where(OperatorAbsence.end_datetime >= datetime_from_filter)
+    if operator_id:
+        operator_absences_query = operator_absences_query.where(OperatorAbsence.operator_id == operator_id)
+
+    with phase_timer("conflicts_query"):
+        return session.execute(operator_absences_query).scalars().all()
+
+#funzione che registra nel log i filtri delle query degli slot
+def log_slots_filters(filters):
+    logging.info("Esecuzione Query")
+    logging.info(
+    "Parametri: exam_type_id=%s, operator_id=%s, laboratory_id=%s, datetime_from_filter=%s",
+         filters["exam_type_id"], filters["operator_id"], filters["laboratory_id"], filters["datetime_from_filter"]
+    )
+
+#funzione per caricare chiusure, assenze e prenotazioni che escludono slot dalla generazione, con query concorrenti come query_slots_inputs
+#usata dalla cache per le settimane mancanti: la fase "queries" misura la durata complessiva, le singole query restano conflicts_query
+def query_slots_conflicts(session, filters):
+    log_slots_filters(filters)
+    with phase_timer("queries"):
+        return tuple(run_queries(session, lambda: Session(get_read_engine()), [
+            lambda query_session: query_laboratory_closures(query_session, filters),
+            lambda query_session: query_operator_absences(query_session, filters),
+            lambda query_session: query_booked_slots(query_session, filters)
+        ]))
+
+#funzione per caricare disponibilità, chiusure, assenze e prenotazioni con query concorrenti su connessioni separate
+#la fase "queries" misura la durata complessiva, le fasi delle singole query restano availability_query e conflicts_query
+def query_slots_inputs(session, filters):
+    log_slots_filters(filters)
+    with phase_timer("queries"):
+        return run_queries(session, lambda: Session(get_read_engine()), [
+            lambda query_session: query_availability(query_session, filters),
+            lambda query_session: query_laboratory_closures(query_session, filters),
+            lambda query_session: query_operator_absences(query_session, filters),
+            lambda query_session: query_booked_slots(query_session, filters)
+        ])
+
+#funzione per caricare le disponibilità abilitate degli operatori che soddisfano i filtri
+def query_availability(session, filters):
+
+    datetime_from_filter = filters["datetime_from_filter"]
+    exam_type_id = filters["exam_type_id"]
+    operator_id = filters["operator_id"]
+    laboratory_id = filters["laboratory_id"]
+    
+    availability_query = (
+        select(OperatorsAvailability)
+        .join(Operator, OperatorsAvailability.operator_id == Operator.operator_id)
+        .join(Laboratory, OperatorsAvailability.laboratory_id == Laboratory.laboratory_id)
+        .join(ExamType, OperatorsAvailability.exam_type_id == ExamType.exam_type_id)
+        # popola le relazioni dalle join per evitare una query per ciascuno slot generato
+        .options(
+            contains_eager(OperatorsAvailability.operator),
+            contains_eager(OperatorsAvailability.laboratory),
+            contains_eager(OperatorsAvailability.exam_type)
         )
+        .where(OperatorsAvailability.enabled == True)
+    )
 
-        if datetime_from_filter:
-            booked_slots_query = booked_slots_query.where(SlotBooking.appointment_date >= datetime_from_filter.date())
-        if exam_type_id:
-            booked_slots_query = booked_slots_query.where(OperatorsAvailability.exam_type_id == exam_type_id)
-        if operator_id:
-            booked_slots_query = booked_slots_query.where(OperatorsAvailability.operator_id == operator_id)
-        if laboratory_id:
-            booked_slots_query = booked_slots_query.where(OperatorsAvailability.laboratory_id == laboratory_id)
+    if datetime_from_filter:
+        availability_query = availability_query.where(OperatorsAvailability.available_to_date >= datetime_from_filter.date())
+    if exam_type_id:
+        availability_query = availability_query.where(OperatorsAvailability.exam_type_id == exam_type_id)
+    if operator_id:
+        availability_query = availability_query.where(OperatorsAvailability.operator_id == operator_id)
+    if laboratory_id:
+        availability_query = availability_query.where(OperatorsAvailability.laboratory_id == laboratory_id)
+
+    with phase_timer("availability_query"):
+        return session.execute(availability_query).scalars().all()
+
+#funzione per generare in modo lazy gli slot a partire dai filtri, la sessione deve restare aperta finché gli slot vengono consumati
+#after (chiave dell'ultimo slot già restituito) e limit sono usati solo dal motore sql, per gli altri motori li applica il chiamante
+def iter_slots(session, filters, slots_engine = SLOTS_ENGINE, after = None, limit = None):
+
+    # con la cache attiva chiusure, assenze e prenotazioni vengono caricate solo se manca almeno una settimana
+    # la cache contiene settimane generate dal motore python, gli altri motori calcolano sempre l'intera finestra
+    if slots_engine == "sql" or (SLOTS_CACHE_ENABLED and slots_engine == "python"):
+        availability = query_availability(session, filters)
+
+        if slots_engine == "sql":
+            return iter_availabile_slots_sql(session, availability, filters, after, limit)
+
+        # modifiche registrate da tutti i worker dopo l'ultima lettura della cache
+        sync_slots_cache(session)
+        return iter_cached_slots(
+            availability,
+            filters["datetime_from_filter"],
+            filters["datetime_to_filter"],
+            lambda datetime_from: query_slots_conflicts(session, {**filters, "datetime_from_filter": datetime_from})
+        )
 
-        booked_slots = session.execute(booked_slots_query).scalars().all()
+    availability, laboratory_closures, operator_absences, booked_slots = query_slots_inputs(session, filters)
 
-        # Crea la query per i periodi di chiusura dei laboratori
-        laboratory_closures_query = select(LaboratoryClosure)
-        
-        if datetime_from_filter:
-            laboratory_closures_query = laboratory_closures_query.where(LaboratoryClosure.end_datetime >= datetime_from_filter)
-        if laboratory_id:
-            laboratory_closures_query = laboratory_closures_query.where(LaboratoryClosure.laboratory_id == laboratory_id)
+    return SLOTS_ENGINES[slots_engine](
+        availability, # disponibilità degli operatori
+        filters["datetime_from_filter"], # data di inizio filtro
+        filters["datetime_to_filter"], # data di fine filtro          
+        laboratory_closures, # periodi di chiusura dei laboratori
+        operator_absences, # periodi di assenza degli operatori
+        booked_slots # slot già prenotati 
+    )
 
-        laboratory_closures = session.execute(laboratory_closures_query).scalars().all()
+# il precalcolo della cache parte alla prima richiesta del worker e non all'import, che non deve accedere al database
+slots_cache_warm_up_started = threading.Event()
+slots_cache_warm_up_lock = threading.Lock()
 
-        # Crea la query per i periodi di assenza degli operatori
-        operator_absences_query  = select(OperatorAbsence)
+# precalcola in background le prime settimane di slot, una sola volta per worker
+@app.before_request
+def start_slots_cache_warm_up():
+    if slots_cache_warm_up_started.is_set() or not (SLOTS_CACHE_ENABLED and SLOTS_CACHE_WARMUP):
+        return
+    with slots_cache_warm_up_lock:
+        if slots_cache_warm_up_started.is_set():
+            return
+        slots_cache_warm_up_started.set()
+    warm_up_slots_cache(
+        lambda: Session(get_read_engine()),
+        lambda session, datetime_from: query_availability(session, slots_filters(datetime_from, None)),
+        lambda session, datetime_from: query_slots_conflicts(session, slots_filters(datetime_from, None))
+    )
 
-        if datetime_from_filter:
-            operator_absences_query = operator_absences_query.where(OperatorAbsence.end_datetime >= datetime_from_filter)
-        if operator_id:
-            operator_absences_query = operator_absences_query.where(OperatorAbsence.operator_id == operator_id)
+# compattazione del registro delle modifiche in background, fuori dal percorso delle scritture
+@app.before_request
+def start_slot_changes_compaction_thread():
+    start_slot_changes_compaction()
 
-        operator_absences = session.execute(operator_absences_query).scalars().all()
-        
-        availability_query = (
-            select(OperatorsAvailability)
-            .join(Operator, OperatorsAvailability.operator_id == Operator.operator_id)
-            .join(Laboratory, OperatorsAvailability.laboratory_id == Laboratory.laboratory_id)
-            .join(ExamType, OperatorsAvailability.exam_type_id == ExamType.exam_type_id)
-            .where(OperatorsAvailability.enabled == True)
+#funzione per creare la risposta in formato compatto con il relativo content type
+def compact_slots_response(body):
+    response = jsonify(body)
+    response.mimetype = SLOTS_COMPACT_MIMETYPE
+    return response, 200
+
+@app.get('/slots_availability')
+@jwt_required()
+@conditional_get(*DATA_VERSIONED_TABLES)
+def get_slots_availability():
+   
+    # se i filtri opzionali vengono passati in un formato non valido, restituisci un errore    
+    try:
+        filters = parse_slots_filters()
+
+        # paginazione keyset opzionale: cursor è la chiave dell'ultimo slot della pagina precedente
+        cursor = request.args.get('cursor')
+        if cursor:
+            cursor = decode_slots_cursor(cursor)
+        limit = request.args.get('limit')
+        if limit or cursor:
+            limit = int(limit) if limit else SLOTS_PAGE_DEFAULT_LIMIT
+            if limit < 1 or limit > SLOTS_PAGE_MAX_LIMIT:
+                raise ValueError("Invalid limit")
+
+        slots_engine = request.args.get('engine', SLOTS_ENGINE)
+        if slots_engine not in SLOTS_ENGINE_NAMES:
+            raise ValueError("Invalid engine")
+
+        response_format = request.args.get('format') or SLOTS_FORMATS_BY_MIMETYPE.get(request.accept_mimetypes.best, "json")
+        if response_format not in SLOTS_FORMATS_BY_MIMETYPE.values():
+            raise ValueError("Invalid format")
+
+    except (ValueError):
+        return jsonify({"error": "Missing key or invalid value format"}), 400
+
+    # gli slot precedenti al cursore non vengono generati
+    if cursor:
+        filters["datetime_from_filter"] = max(
+            filters["datetime_from_filter"],
+            datetime.combine(cursor[0], cursor[1])
         )
 
-        if datetime_from_filter:
-            availability_query = availability_query.where(OperatorsAvailability.available_to_date >= datetime_from_filter.date())
-        if exam_type_id:
-            availability_query = availability_query.where(OperatorsAvailability.exam_type_id == exam_type_id)
-        if operator_id:
-            availability_query = availability_query.where(OperatorsAvailability.operator_id == operator_id)
-        if laboratory_id:
-            availability_query = availability_query.where(OperatorsAvailability.laboratory_id == laboratory_id)
+    logging.info("data inizio generazione slot: %s", filters["datetime_from_filter"])
+    logging.info("data fine generazione slot: %s", filters["datetime_to_filter"])
+
+    # modalità streaming NDJSON: uno slot per riga, inviato man mano che viene generato
+    if response_format == "ndjson":
+
+        def generate_ndjson():
+            with Session(get_read_engine()) as session:
+                slots_count = 0
+                try:
+                    for slot in iter_slots(session, filters, slots_engine, cursor, limit):
+                        if cursor and slot_sort_key(slot) <= cursor:
+                            continue
+                        slots_count += 1
+                        yield app.json.dumps(slot.to_dict(app.json.native_types)) + "\n"
+                        if limit and slots_count >= limit:
+                            break
+                except Exception as e:
+                    # a risposta già iniziata non è possibile cambiare lo status code
+                    logging.error("Error in slot streaming:\n%s", traceback.format_exc())
+                    raise
+                logging.info("Slots streamed: %s", slots_count)
+                increment("slots_generated_total", (("engine", slots_engine),), slots_count)
+
+        return Response(stream_with_context(generate_ndjson()), status=200, mimetype='application/x-ndjson')
 
-        availability = session.execute(availability_query).scalars().all()
+    # tramite la sessione crea la availability_query
+    with Session(get_read_engine()) as session:
 
         try:
-            slots = generate_availabile_slots(
-                availability, # disponibilità degli operatori
-                datetime_from_filter, # data di inizio filtro
-                datetime_to_filter, # data di fine filtro          
-                laboratory_closures, # periodi di chiusura dei laboratori
-                operator_absences, # periodi di assenza degli operatori
-                booked_slots # slot già prenotati 
-            )
+            # con la paginazione viene richiesto un elemento in più della pagina per sapere se esiste una pagina successiva
+            slots = iter_slots(session, filters, slots_engine, cursor, limit + 1 if limit else None)
+
+            # senza paginazione restituisce la lista completa
+            # con la cache attiva la fase di generazione comprende il caricamento di chiusure, assenze e prenotazioni mancanti
+            if not limit:
+                with phase_timer("generation"):
+                    slots = list(slots)
+                logging.info("Slots generated: %s", len(slots))
+                increment("slots_generated_total", (("engine", slots_engine),), len(slots))
+                with phase_timer("serialization"):
+                    if response_format == "compact":
+                        return compact_slots_response(slots_to_compact(slots, filters["datetime_from_filter"].date()))
+                    return jsonify([slot.to_dict(app.json.native_types) for slot in slots]), 200
+
+            if cursor:
+                slots = dropwhile(lambda slot: slot_sort_key(slot) <= cursor, slots)
+            # genera un elemento in più della pagina per sapere se esiste una pagina successiva
+            with phase_timer("generation"):
+                page = list(islice(slots, limit + 1))
+            next_cursor = encode_slots_cursor(page[limit - 1]) if len(page) > limit else None
+            page = page[:limit]
+
+            logging.info("Slots generated: %s", len(page))
+            increment("slots_generated_total", (("engine", slots_engine),), len(page))
+
+            with phase_timer("serialization"):
+                if response_format == "compact":
+                    return compact_slots_response({**slots_to_compact(page, filters["datetime_from_filter"].date()), "next_cursor": next_cursor})
+                return jsonify({"slots": [slot.to_dict(app.json.native_types) for slot in page], "next_cursor": next_cursor}), 200
+        except Exception as e:
+            logging.error("Error in slot conversion:\n%s", traceback.format_exc())
+            return jsonify({"error": "Slot conversion Error"}), 500
 
-            logging.info("Slots generated: %s", len(slots))
+# primi slot liberi che corrispondono ai filtri (es. il primo slot disponibile per un esame in qualsiasi laboratorio)
+# gli slot delle disponibilità vengono fusi in ordine di data e la generazione si ferma appena trovati count slot
+@app.get('/slots_availability/next')
+@jwt_required()
+@conditional_get(*DATA_VERSIONED_TABLES)
+def get_next_slots_availability():
 
-            return jsonify(slots), 200
+    try:
+        filters = parse_slots_filters()
+        count = request.args.get('count', 1, type=int)
+        if count < 1 or count > SLOTS_NEXT_MAX_COUNT:
+            raise ValueError("Invalid count")
+        slots_engine = request.args.get('engine', SLOTS_ENGINE)
+        if slots_engine not in SLOTS_ENGINE_NAMES:
+            raise ValueError("Invalid engine")
+    except (ValueError):
+        return jsonify({"error": "Missing key or invalid value format"}), 400
+
+    with Session(get_read_engine()) as session:
+        try:
+            # con il motore sql il limite viene applicato direttamente nella query
+            slots = iter_slots(session, filters, slots_engine, None, count)
+            with phase_timer("generation"):
+                slots = list(islice(slots, count))
+            logging.info("Next slots found: %s", len(slots))
+            increment("slots_generated_total", (("engine", slots_engine),), len(slots))
+            return jsonify([slot.to_dict(app.json.native_types) for slot in slots]), 200
         except Exception as e:
             logging.error("Error in slot conversion:\n%s", traceback.format_exc())
             return jsonify({"error": "Slot conversion Error"}), 500
 
+# numero di slot liberi per giorno, per la vista calendario: gli slot non vengono generati ma contati aritmeticamente
+@app.get('/slots_availability/summary')
+@jwt_required()
+@conditional_get(*DATA_VERSIONED_TABLES)
+def get_slots_availability_summary():
+
+    try:
+        filters = parse_slots_filters()
+        group_by = request.args.get('group_by')
+        if group_by and group_by not in SUMMARY_GROUP_BY:
+            raise ValueError("Invalid group_by")
+    except (ValueError):
+        return jsonify({"error": "Missing key or invalid value format"}), 400
+
+    with Session(get_read_engine()) as session:
+        availability, laboratory_closures, operator_absences, booked_slots = query_slots_inputs(session, filters)
+
+    with phase_timer("summary"):
+        counts = summarize_availabile_slots(
+            availability,
+            filters["datetime_from_filter"],
+            filters["datetime_to_filter"],
+            laboratory_closures,
+            operator_absences,
+            booked_slots,
+            group_by
+        )
+
+    summary = []
+    for (slot_date, group_key), free_slots in sorted(counts.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        day = {"date": slot_date.isoformat(), "free_slots": free_slots}
+        if group_by:
+            day[SUMMARY_GROUP_BY[group_by]] = str(group_key)
+        summary.append(day)
+
+    return jsonify(summary), 200
+
+# modifiche agli slot successive alla versione since, con gli stessi filtri di /slots_availability
+# senza since restituisce solo la versione corrente, da leggere prima di scaricare la lista completa degli slot
+# se since non è più nel registro risponde 410 con la versione corrente: il client riscarica gli slot e riparte da quella versione
+@app.get('/slots_availability/changes')
+@jwt_required()
+@conditional_get(*SLOT_CHANGES_TRIGGERS)
+def get_slots_availability_changes():
+
+    try:
+        filters = parse_slots_filters()
+        since = request.args.get('since')
+        if since is not None:
+            since = int(since)
+            if since < 0:
+                raise ValueError("Invalid since")
+        limit = request.args.get('limit', SLOT_CHANGES_DEFAULT_LIMIT, type=int)
+        if limit < 1 or limit > SLOT_CHANGES_MAX_LIMIT:
+            raise ValueError("Invalid limit")
+    except (ValueError):
+        return jsonify({"error": "Missing key or invalid value format"}), 400
+
+    with Session(get_read_engine()) as session:
+        if since is None:
+            return jsonify({"version": query_current_version(session), "changes": [], "has_more": False}), 200
+        try:
+            version, changes, has_more = query_slot_changes(session, since, filters, limit)
+        except SlotChangesResyncRequired as e:
+            return jsonify({"error": "Resync required", "version": e.version}), 410
+
+    return jsonify({"version": version, "changes": [slot_change_to_dict(change) for change in changes], "has_more": has_more}), 200
+
+# notifiche in tempo reale delle modifiche agli slot (Server-Sent Events), con gli stessi filtri di /slots_availability
+# il primo evento (version) contiene la versione corrente, gli eventi successivi le modifiche con id uguale alla versione
+# alla riconnessione il browser invia Last-Event-ID (oppure il parametro last_event_id) e riceve le modifiche perse
+@app.get('/slots_availability/events')
+@jwt_required()
+def get_slots_availability_events():
+
+    try:
+        filters = parse_slots_filters()
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        if last_event_id is not None:
+            last_event_id = int(last_event_id)
+            if last_event_id < 0:
+                raise ValueError("Invalid last_event_id")
+    except (ValueError):
+        return jsonify({"error": "Missing key or invalid value format"}), 400
+
+    # gli stream restano aperti per tutta la sessione: sono serviti dal server con worker gevent (gunicorn_events.conf.py)
+    if not events_available():
+        return jsonify({"error": "Slot events are served by the events server"}), 503
+
+    # il client viene registrato prima della risposta: le modifiche successive restano nella sua coda
+    subscriber = subscribe(filters)
+    if subscriber is None:
+        return jsonify({"error": "Too many subscribers"}), 503
+
+    # senza stream_with_context: il flusso non usa la richiesta e resta aperto a lungo, il contesto non viene mantenuto
+    # no-transform esclude la compressione, che tratterrebbe gli eventi nel buffer del compressore
+    response = Response(iter_subscriber_events(subscriber, last_event_id), status=200, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache, no-transform"
+    response.headers["X-Accel-Buffering"] = "no"
+    # rimuove il client anche se la connessione viene chiusa prima dell'inizio del flusso
+    response.call_on_close(lambda: unsubscribe_slot_events(subscriber))
+    return response
+
 @app.get("/operators")
 @jwt_required()
+@conditional_get("operators", "operators_availability")
 def get_operators():
 
     try:
@@ -352,7 +801,7 @@ def get_operators():
     except (ValueError):
         return jsonify({"error": "Invalid UUID Format"}), 400
 
-    with Session(engine) as session:
+    with Session(get_read_engine()) as session:
         
         operators_query = select(Operator).join(OperatorsAvailability, OperatorsAvailability.operator_id == Operator.operator_id).distinct()
 
@@ -374,9 +823,10 @@ def get_operators():
 
 @app.get("/exam_types")
 @jwt_required()
+@conditional_get("exam_types")
 def get_exam_types():
 
-    with Session(engine) as session:
+    with Session(get_read_engine()) as session:
 
         exam_types_query = select(ExamType)
         exam_types = session.execute(exam_types_query).scalars().all()
@@ -393,6 +843,7 @@ def get_exam_types():
 
 @app.get("/laboratories")
 @jwt_required()
+@conditional_get("laboratories", "operators_availability")
 def get_laboratories():
     
     try:
@@ -407,7 +858,7 @@ def get_laboratories():
         return jsonify({"error": "Invalid UUID Format"}), 400
     
 
-    with Session(engine) as session:
+    with Session(get_read_engine()) as session:
         
         laboratories_query = select(Laboratory).join(OperatorsAvailability, Laboratory.laboratory_id == OperatorsAvailability.laboratory_id).distinct()
 
@@ -450,38 +901,46 @@ def book_slot():
     except (KeyError, ValueError):
         return jsonify({"error": "Missing key or invalid value format"}), 400
 
-    with Session(engine) as session:
-
-        # non è possibile prenotare lo stesso esame due volte
-        booked_slots_query = (
-            select(SlotBooking)
-            .join(OperatorsAvailability, SlotBooking.availability_id == OperatorsAvailability.availability_id)
-            .where(SlotBooking.rejected == False)
-            .where(SlotBooking.account_id == current_user)
+    # la prenotazione è un solo statement INSERT ... SELECT in autocommit: il tipo di esame viene letto dalla disponibilità
+    # e i vincoli (uno slot prenotato una sola volta, un esame attivo per account) sono verificati dagli indici univoci
+    new_booking_query = (
+        insert(SlotBooking)
+        .from_select(
+            ["appointment_id", "account_id", "availability_id", "exam_type_id", "appointment_date", "appointment_time_start", "appointment_time_end", "rejected"],
+            select(
+                literal(uuid4()),
+                literal(current_user),
+                OperatorsAvailability.availability_id,
+                OperatorsAvailability.exam_type_id,
+                literal(appointment_date),
+                literal(appointment_time_start),
+                literal(appointment_time_end),
+                literal(False)
+            )
+            .where(OperatorsAvailability.availability_id == availability_id)
             .where(OperatorsAvailability.exam_type_id == exam_type_id)
         )
-        # vincolo applicativo un utente non può prenotare più volte lo stesso esame
-        # viene utilizzato un codice specifico per utilizzare un messaggio specifico in forntend
-        same_exam_booked = session.execute(booked_slots_query).scalars().all()
-        if same_exam_booked:
-            return jsonify({"error": "exam type already booked"}), 409 
-
-        new_booking = SlotBooking(
-            account_id=current_user,
-            availability_id=availability_id,
-            appointment_time_start = appointment_time_start,
-            appointment_time_end = appointment_time_end,
-            appointment_date = appointment_date,
-            rejected=False
-        )
+        .returning(SlotBooking.appointment_id)
+    )
+
+    with Session(get_autocommit_engine()) as session:
 
         try:
-            session.add(new_booking)
-            session.commit()
+            new_booking = session.execute(new_booking_query).first()
         except IntegrityError as e:
-            session.rollback()
+            # vincolo applicativo un utente non può prenotare più volte lo stesso esame
+            # viene utilizzato un codice specifico per utilizzare un messaggio specifico in forntend
+            if getattr(e.orig.diag, "constraint_name", None) == "uq_active_exam_type_per_account":
+                return jsonify({"error": "exam type already booked"}), 409
             logging.error("Database Error: %s\n%s", str(e), traceback.format_exc())
             return jsonify({"error": "Integrity Error"}), 400
+
+        # disponibilità inesistente o di un altro tipo di esame
+        if not new_booking:
+            return jsonify({"error": "Integrity Error"}), 400
+
+        invalidate_booking(availability_id, appointment_date)
+        invalidate_data_versions()
         
         return jsonify({"message": "Booking Complete"}), 200
          
@@ -491,11 +950,20 @@ def get_booked_slots():
 
     current_user = UUID(get_jwt_identity())
 
-    with Session(engine) as session:
+    with Session(get_read_engine()) as session:
 
         booked_slots_query = (
             select(SlotBooking)
             .join(OperatorsAvailability, SlotBooking.availability_id == OperatorsAvailability.availability_id)
+            .join(Operator, OperatorsAvailability.operator_id == Operator.operator_id)
+            .join(Laboratory, OperatorsAvailability.laboratory_id == Laboratory.laboratory_id)
+            .join(ExamType, OperatorsAvailability.exam_type_id == ExamType.exam_type_id)
+            # popola le relazioni dalle join per evitare una query per ciascuna prenotazione
+            .options(
+                contains_eager(SlotBooking.operators_availability).contains_eager(OperatorsAvailability.operator),
+                contains_eager(SlotBooking.operators_availability).contains_eager(OperatorsAvailability.laboratory),
+                contains_eager(SlotBooking.operators_availability).contains_eager(OperatorsAvailability.exam_type)
+            )
             .where(SlotBooking.account_id == current_user)
         )
         
@@ -531,7 +999,7 @@ def reject_booked_slot(appointment_id):
     except (ValueError):
         return jsonify({"error": "Invalid UUID Format"}), 400
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         slot_query = select(SlotBooking).where(SlotBooking.appointment_id == appointment_id)
         slot = session.execute(slot_query).scalars().first()
 
@@ -542,6 +1010,8 @@ def reject_booked_slot(appointment_id):
             logging.error(f"Current user: {current_user}, Slot account_id: {slot.account_id}")
             return jsonify({"error": "Unauthorized"}), 401
 
+        # letti prima del commit, che scade gli attributi: dopo il commit richiederebbero una nuova SELECT
+        availability_id, appointment_date = slot.availability_id, slot.appointment_date
         try:
             slot.rejected = True
             session.commit()
@@ -550,4 +1020,61 @@ def reject_booked_slot(appointment_id):
             logging.error("Database Error: %s\n%s", str(e), traceback.format_exc())
             return jsonify({"error": "Integrity Error"}), 400
 
-        return jsonify({"Success": "Slot Rejected"}), 200
\ No newline at end of file
+        invalidate_booking(availability_id, appointment_date)
+        invalidate_data_versions()
+
+        return jsonify({"Success": "Slot Rejected"}), 200
+
+# formati di import accettati in base al Content-Type del corpo
+IMPORT_FORMATS_BY_MIMETYPE = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson"
+}
+
+@app.post("/admin/import/<string:kind>")
+@jwt_required()
+def admin_import(kind):
+
+    current_user = UUID(get_jwt_identity())
+
+    with Session(get_engine()) as session:
+        account = session.get(Account, current_user)
+        if not account or not account.is_admin:
+            return jsonify({"error": "Forbidden"}), 403
+
+    if kind not in IMPORT_KINDS:
+        return jsonify({"error": "Invalid import kind"}), 400
+
+    # formato da ?format= oppure dal Content-Type del corpo
+    input_format = request.args.get("format") or IMPORT_FORMATS_BY_MIMETYPE.get(request.mimetype)
+    if input_format not in IMPORT_FORMATS:
+        return jsonify({"error": "Invalid import format"}), 400
+
+    chunk_size = request.args.get("chunk_size", IMPORT_CHUNK_SIZE, type=int)
+    if chunk_size <= 0:
+        return jsonify({"error": "Invalid chunk_size"}), 400
+
+    # il corpo viene letto in streaming, senza caricarlo interamente in memoria
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    report = import_rows(kind, read_rows(stream, input_format), chunk_size)
+
+    return jsonify(report), 200
+
+# metriche del worker in formato Prometheus, da raccogliere per ciascun worker
+# accesso con il token dello scraper (METRICS_TOKEN, header Authorization: Bearer) oppure con il cookie JWT di un amministratore
+@app.get("/metrics")
+def get_metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics disabled"}), 404
+
+    if not metrics_token_matches(request.headers.get("Authorization")):
+        verify_jwt_in_request(optional=True)
+        current_user = get_jwt_identity()
+        if not current_user:
+            return jsonify({"error": "Unauthorized"}), 401
+        with Session(get_engine()) as session:
+            account = session.get(Account, UUID(current_user))
+            if not account or not account.is_admin:
+                return jsonify({"error": "Forbidden"}), 403
+
+    return Response(render_metrics(), status=200, mimetype="text/plain; version=0.0.4")
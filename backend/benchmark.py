@@ -0,0 +1,391 @@
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+import threading
+import time as clock
+import tracemalloc
+from datetime import date, datetime, time, timedelta
+
+# Benchmark della generazione degli slot e degli endpoint su dati sintetici
+# il risultato è un JSON (throughput, latenza p50/p99, picco di memoria) confrontabile tra commit diversi
+# l'equivalenza dei motori di generazione e i piani delle query sono verificati dai test in tests/
+#
+#   python benchmark.py generator --availabilities 500 --bookings 20000
+#   python benchmark.py conflicts --conflicts-slots 1000
+#   python benchmark.py endpoints --iterations 20 --output bench.json
+#   python benchmark.py logins --login-threads 32
+#   python benchmark.py startup --iterations 5
+#   python benchmark.py serialization --iterations 3
+#
+# ATTENZIONE: la parte endpoints cancella e ripopola il database configurato nel .env
+
+#funzione che restituisce il percentile (nearest-rank) di una lista di valori
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, -(-len(ordered) * percent // 100) - 1))]
+
+#funzione per misurare una funzione: latenze su più iterazioni e picco di memoria su un'esecuzione separata con tracemalloc
+def measure(function, iterations, warmup = 1):
+    for _ in range(warmup):
+        function()
+
+    latencies = []
+    result = None
+    started = clock.perf_counter()
+    for _ in range(iterations):
+        iteration_started = clock.perf_counter()
+        result = function()
+        latencies.append(clock.perf_counter() - iteration_started)
+    elapsed = clock.perf_counter() - started
+
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "throughput_per_s": round(iterations / elapsed, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "peak_memory_bytes": peak_memory,
+        "result_size": result
+    }
+
+#funzione che restituisce i parametri del generatore di dati sintetici a partire dagli argomenti
+def data_parameters(args):
+    return {
+        "laboratories": args.laboratories,
+        "operators": args.operators,
+        "exam_types": args.exam_types,
+        "availabilities": args.availabilities,
+        "closures": args.closures,
+        "absences": args.absences,
+        "bookings": args.bookings,
+        "horizon_days": args.horizon_days,
+        "seed": args.seed
+    }
+
+#benchmark della generazione degli slot senza database e senza Flask
+def benchmark_generator(args):
+    from synthetic_data import generate_synthetic_data
+    from operators_availability import iter_availabile_slots
+    from operators_availability_numpy import NUMPY_AVAILABLE, iter_availabile_slots_numpy
+    from slots_cache import iter_cached_slots, slots_cache
+    from operators_availability_parallel import iter_availabile_slots_parallel
+
+    data = generate_synthetic_data(**data_parameters(args))
+    datetime_from = datetime.combine(date.today() + timedelta(days=1), time(0, 0))
+    datetime_to = datetime_from + timedelta(days=args.horizon_days)
+    inputs = (data["availabilities"], datetime_from, datetime_to, data["closures"], data["absences"], data["bookings"])
+
+    engines = {"python": iter_availabile_slots}
+    if NUMPY_AVAILABLE:
+        engines["numpy"] = iter_availabile_slots_numpy
+    # pool e soglia secondo SLOTS_PARALLEL_WORKERS e SLOTS_PARALLEL_MIN_SLOTS
+    engines["parallel"] = iter_availabile_slots_parallel
+
+    results = {}
+    for name, iter_slots in engines.items():
+        results[f"generate_{name}"] = measure(lambda: sum(1 for slot in iter_slots(*inputs)), args.iterations)
+
+    def cached():
+        return sum(1 for slot in iter_cached_slots(
+            data["availabilities"], datetime_from, datetime_to,
+            lambda datetime_from: (data["closures"], data["absences"], data["bookings"])
+        ))
+    slots_cache.clear()
+    results["generate_cache_warm"] = measure(cached, args.iterations)
+
+    return results
+
+#benchmark delle verifiche di prenotazioni, chiusure e assenze: indici (index_booked_slots, index_periods) contro le scansioni
+#lineari di tutte le prenotazioni e di tutti i periodi per ogni slot eseguite prima dell'introduzione degli indici
+#gli slot verificati sono i primi --conflicts-slots slot della finestra, le due implementazioni devono escludere gli stessi slot
+def benchmark_conflicts(args):
+    from itertools import islice
+    from synthetic_data import generate_synthetic_data
+    from operators_availability import iter_availabile_slots, index_booked_slots, index_periods, slot_is_booked, lab_is_closed, operator_is_absent
+
+    data = generate_synthetic_data(**data_parameters(args))
+    datetime_from = datetime.combine(date.today() + timedelta(days=1), time(0, 0))
+    datetime_to = datetime_from + timedelta(days=args.horizon_days)
+    slots = [
+        (slot.operator_availability, slot.operator_availability_date, slot.operator_availability_slot_start, slot.operator_availability_slot_end)
+        for slot in islice(iter_availabile_slots(data["availabilities"], datetime_from, datetime_to), args.conflicts_slots)
+    ]
+
+    def linear_is_booked(availability_id, slot_date, slot_start):
+        for booked_slot in data["bookings"]:
+            if availability_id == booked_slot.availability_id and slot_date == booked_slot.appointment_date and slot_start == booked_slot.appointment_time_start:
+                return True
+        return False
+
+    def linear_overlaps(periods, key_attribute, key, slot_date, slot_start, slot_end):
+        for period in periods:
+            if key == getattr(period, key_attribute):
+                if datetime.combine(slot_date, slot_start) < period.end_datetime and datetime.combine(slot_date, slot_end) > period.start_datetime:
+                    return True
+        return False
+
+    def linear():
+        return [
+            linear_overlaps(data["closures"], "laboratory_id", availability.laboratory_id, slot_date, slot_start, slot_end)
+            or linear_overlaps(data["absences"], "operator_id", availability.operator_id, slot_date, slot_start, slot_end)
+            or linear_is_booked(availability.availability_id, slot_date, slot_start)
+            for availability, slot_date, slot_start, slot_end in slots
+        ]
+
+    # gli indici sono costruiti ad ogni iterazione, come per ciascuna richiesta
+    def indexed():
+        laboratory_closures_index = index_periods(data["closures"], "laboratory_id")
+        operator_absences_index = index_periods(data["absences"], "operator_id")
+        booked_slots_index = index_booked_slots(data["bookings"])
+        return [
+            lab_is_closed(availability.laboratory_id, slot_date, slot_start, slot_end, laboratory_closures_index)
+            or operator_is_absent(availability.operator_id, slot_date, slot_start, slot_end, operator_absences_index)
+            or slot_is_booked(availability.availability_id, slot_date, slot_start, slot_end, booked_slots_index)
+            for availability, slot_date, slot_start, slot_end in slots
+        ]
+
+    if linear() != indexed():
+        raise RuntimeError("Le verifiche indicizzate escludono slot diversi dalle scansioni lineari")
+
+    results = {"slots": len(slots), "excluded": sum(indexed())}
+    for name, check in (("linear", linear), ("indexed", indexed)):
+        results[name] = measure(lambda: sum(check()), args.iterations)
+    results["speedup"] = round(results["linear"]["p50_ms"] / results["indexed"]["p50_ms"], 1) if results["indexed"]["p50_ms"] else None
+    return results
+
+#benchmark della serializzazione degli slot di tutto l'orizzonte (un anno di default) senza database:
+#tempo di conversione e serializzazione per ciascun provider JSON, byte inviati e tempo di compressione per ciascuna codifica
+def benchmark_serialization(args):
+    from flask import Flask
+    from synthetic_data import generate_synthetic_data
+    from operators_availability import iter_availabile_slots
+    from json_serialization import ORJSON_AVAILABLE, IsoJSONProvider, OrjsonProvider
+    from compression import COMPRESSION_ENCODINGS, compress_bytes
+
+    data = generate_synthetic_data(**data_parameters(args))
+    datetime_from = datetime.combine(date.today() + timedelta(days=1), time(0, 0))
+    datetime_to = datetime_from + timedelta(days=args.horizon_days)
+    slots = list(iter_availabile_slots(data["availabilities"], datetime_from, datetime_to, data["closures"], data["absences"], data["bookings"]))
+
+    application = Flask(__name__)
+    providers = {"json": IsoJSONProvider(application)}
+    if ORJSON_AVAILABLE:
+        providers["orjson"] = OrjsonProvider(application)
+
+    results = {"slots": len(slots)}
+    bodies = {}
+    for name, provider in providers.items():
+        results[f"serialize_{name}"] = measure(lambda: len(provider.dumps([slot.to_dict(provider.native_types) for slot in slots])), args.iterations)
+        bodies[name] = provider.dumps([slot.to_dict(provider.native_types) for slot in slots]).encode()
+
+    # i provider devono produrre lo stesso documento (il modulo json usa escape per i caratteri non ASCII, orjson UTF-8)
+    documents = [json.loads(body) for body in bodies.values()]
+    if any(document != documents[0] for document in documents):
+        raise RuntimeError("I provider JSON producono risposte diverse")
+
+    for name, body in bodies.items():
+        results[f"bytes_{name}"] = len(body)
+    body = bodies[list(providers)[-1]]
+    for encoding in COMPRESSION_ENCODINGS:
+        results[f"compress_{encoding}"] = measure(lambda: len(compress_bytes(body, encoding)), args.iterations)
+        results[f"bytes_{encoding}"] = results[f"compress_{encoding}"]["result_size"]
+    return results
+
+#funzione per inserire i dati sintetici nel database e restituire un test client autenticato come paziente
+def prepare_client(args):
+    from sqlalchemy.orm import Session
+    from database import get_engine, migrate_schema, clear_existing_data
+    from synthetic_data import generate_synthetic_data, insert_synthetic_data, SYNTHETIC_PASSWORD
+    from slots_cache import slots_cache
+    import app as application
+
+    migrate_schema()
+    clear_existing_data()
+    data = generate_synthetic_data(**data_parameters(args))
+    with Session(get_engine(), expire_on_commit=False) as session:
+        insert_synthetic_data(session, data)
+    slots_cache.clear()
+
+    application.app.config["JWT_COOKIE_CSRF_PROTECT"] = False
+    client = application.app.test_client()
+    # il primo paziente ha prenotazioni, in modo che /slot_bookings restituisca dati
+    patient = next(account for account in data["accounts"] if not account.is_operator)
+    login = client.post("/login", json={"username": patient.username, "password": SYNTHETIC_PASSWORD})
+    if login.status_code != 200:
+        raise RuntimeError(f"Login fallito: {login.status_code} {login.get_data(as_text=True)}")
+    return application.app, client, patient
+
+#funzione che restituisce una richiesta GET da misurare, che fallisce se la risposta non ha lo status atteso
+def get_request(client, path, headers = None, expected_status = 200):
+    def request():
+        response = client.get(path, headers=headers)
+        if response.status_code != expected_status:
+            raise RuntimeError(f"{path}: {response.status_code}")
+        return len(response.get_data())
+    return request
+
+#benchmark degli endpoint Flask tramite il test client, su dati sintetici inseriti nel database
+def benchmark_endpoints(args):
+    app, client, patient = prepare_client(args)
+    get = lambda path: get_request(client, path)
+
+    endpoints = {
+        "slots_availability_json": "/slots_availability",
+        "slots_availability_compact": "/slots_availability?format=compact",
+        "slots_availability_ndjson": "/slots_availability?format=ndjson",
+        "slots_availability_first_page": "/slots_availability?limit=100",
+        "slots_availability_sql": "/slots_availability?engine=sql",
+        "slots_availability_sql_first_page": "/slots_availability?engine=sql&limit=100",
+        "slots_availability_summary": "/slots_availability/summary",
+        "slots_availability_next": "/slots_availability/next?count=5",
+        "exam_types": "/exam_types",
+        "laboratories": "/laboratories",
+        "operators": "/operators",
+        "slot_bookings": "/slot_bookings"
+    }
+    results = {name: measure(get(path), args.iterations) for name, path in endpoints.items()}
+
+    # stesse richieste con l'ETag della risposta precedente: 304 senza query né generazione
+    for name in ("slots_availability_json", "exam_types"):
+        etag = client.get(endpoints[name]).headers.get("ETag")
+        if etag:
+            results[f"{name}_not_modified"] = measure(get_request(client, endpoints[name], {"If-None-Match": etag}, 304), args.iterations)
+    return results
+
+#benchmark della latenza delle altre route mentre molti login calcolano hash delle password in parallelo
+def benchmark_logins(args):
+    from synthetic_data import SYNTHETIC_PASSWORD
+
+    app, client, patient = prepare_client(args)
+    catalogue_request = get_request(client, "/exam_types")
+    results = {"exam_types_idle": measure(catalogue_request, args.iterations)}
+
+    stop = threading.Event()
+    login_statuses = {}
+    login_latencies = []
+    lock = threading.Lock()
+
+    def login_loop():
+        login_client = app.test_client()
+        while not stop.is_set():
+            started = clock.perf_counter()
+            status = login_client.post("/login", json={"username": patient.username, "password": SYNTHETIC_PASSWORD}).status_code
+            with lock:
+                login_statuses[status] = login_statuses.get(status, 0) + 1
+                login_latencies.append(clock.perf_counter() - started)
+
+    threads = [threading.Thread(target=login_loop, daemon=True) for _ in range(args.login_threads)]
+    started = clock.perf_counter()
+    for thread in threads:
+        thread.start()
+    results["exam_types_during_logins"] = measure(catalogue_request, args.iterations)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = clock.perf_counter() - started
+
+    results["logins"] = {
+        "threads": args.login_threads,
+        "throughput_per_s": round(len(login_latencies) / elapsed, 3),
+        "p50_ms": round(percentile(login_latencies, 50) * 1000, 3) if login_latencies else None,
+        "p99_ms": round(percentile(login_latencies, 99) * 1000, 3) if login_latencies else None,
+        "status_counts": {str(status): count for status, count in sorted(login_statuses.items())}
+    }
+    return results
+
+#benchmark dell'avvio di un worker: import di app in un nuovo interprete, seguito dalla prima richiesta che crea gli engine
+def benchmark_startup(args):
+    script = (
+        "import time, logging; started = time.perf_counter(); logging.disable(logging.INFO)\n"
+        "import app\n"
+        "imported = time.perf_counter()\n"
+        "from database import engines\n"
+        "assert not engines, 'engine creati durante l import'\n"
+        "import uuid; from flask_jwt_extended import create_access_token\n"
+        "app.app.config['JWT_COOKIE_CSRF_PROTECT'] = False\n"
+        "client = app.app.test_client()\n"
+        "with app.app.app_context(): client.set_cookie('access_token_cookie', create_access_token(identity=str(uuid.uuid4())))\n"
+        "status = client.get('/laboratories').status_code\n"
+        "print(imported - started, time.perf_counter() - imported, status)\n"
+    )
+    import_latencies, first_request_latencies = [], []
+    for _ in range(args.iterations):
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout.split()
+        import_latencies.append(float(output[-3]))
+        first_request_latencies.append(float(output[-2]))
+        if output[-1] != "200":
+            raise RuntimeError(f"Prima richiesta fallita: {output[-1]}")
+
+    return {
+        "iterations": args.iterations,
+        "import_p50_ms": round(percentile(import_latencies, 50) * 1000, 3),
+        "import_p99_ms": round(percentile(import_latencies, 99) * 1000, 3),
+        "first_request_p50_ms": round(percentile(first_request_latencies, 50) * 1000, 3),
+        "first_request_p99_ms": round(percentile(first_request_latencies, 99) * 1000, 3)
+    }
+
+#funzione che restituisce il commit corrente, se disponibile
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark generazione slot ed endpoint su dati sintetici")
+    parser.add_argument("suite", choices=("generator", "conflicts", "endpoints", "logins", "startup", "serialization", "all"))
+    parser.add_argument("--laboratories", type=int, default=10)
+    parser.add_argument("--operators", type=int, default=50)
+    parser.add_argument("--exam-types", type=int, default=20)
+    parser.add_argument("--availabilities", type=int, default=500)
+    parser.add_argument("--closures", type=int, default=100)
+    parser.add_argument("--absences", type=int, default=200)
+    parser.add_argument("--bookings", type=int, default=20000)
+    parser.add_argument("--horizon-days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--login-threads", type=int, default=16, help="login concorrenti nella suite logins")
+    parser.add_argument("--conflicts-slots", type=int, default=1000, help="slot verificati nella suite conflicts")
+    parser.add_argument("--output", help="file JSON di output (default: stdout)")
+    args = parser.parse_args()
+
+    # i log per disponibilità falserebbero le misure
+    logging.disable(logging.INFO)
+
+    results = {}
+    if args.suite in ("generator", "all"):
+        results["generator"] = benchmark_generator(args)
+    if args.suite in ("conflicts", "all"):
+        results["conflicts"] = benchmark_conflicts(args)
+    if args.suite in ("endpoints", "all"):
+        results["endpoints"] = benchmark_endpoints(args)
+    if args.suite in ("logins", "all"):
+        results["logins"] = benchmark_logins(args)
+    if args.suite in ("startup", "all"):
+        results["startup"] = benchmark_startup(args)
+    if args.suite in ("serialization", "all"):
+        results["serialization"] = benchmark_serialization(args)
+
+    report = json.dumps({
+        "commit": current_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "parameters": {**data_parameters(args), "iterations": args.iterations},
+        "results": results
+    }, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
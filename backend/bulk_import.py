@@ -0,0 +1,265 @@
+import os
+import re
+import csv
+import io
+import sys
+import json
+import argparse
+import logging
+import time as clock
+from uuid import UUID
+from datetime import date, datetime, time
+from dotenv import load_dotenv
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError, DataError
+from sqlalchemy.orm import Session
+from database import get_engine, Account, OperatorsAvailability, LaboratoryClosure, OperatorAbsence
+from password_hashing import PasswordHashingBusy, hash_password
+from slots_cache import invalidate_availability, invalidate_laboratory_closure, invalidate_operator_absence
+from data_versions import invalidate_data_versions
+from validation import USERNAME_REGEX, PASSWORD_REGEX, EMAIL_REGEX, TEL_NUMBER_REGEX
+
+# Import massivo di account, disponibilità, chiusure e assenze da CSV o NDJSON
+# le righe vengono lette in streaming, validate e inserite a blocchi con INSERT multi-riga, un blocco per transazione
+# se un blocco viene rifiutato dal database le sue righe vengono reinserite una alla volta per individuare quelle errate
+#
+#   python bulk_import.py availabilities disponibilita.csv
+#   python bulk_import.py accounts pazienti.ndjson --chunk-size 5000
+
+load_dotenv()
+
+# righe inserite per transazione
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+# numero massimo di errori riportati nel resoconto (il conteggio comprende comunque tutte le righe scartate)
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "1000"))
+# attesa massima di un posto libero per l'hash della password di un account: l'import attende il proprio turno invece di
+# occupare il limite di concorrenza condiviso con login e registrazioni, oltre l'attesa la riga viene scartata
+IMPORT_PASSWORD_HASH_TIMEOUT_SECONDS = float(os.getenv("IMPORT_PASSWORD_HASH_TIMEOUT_SECONDS", "30"))
+
+IMPORT_FORMATS = ("csv", "ndjson")
+
+#funzione che restituisce un campo obbligatorio della riga
+def required(row, field):
+    value = row.get(field)
+    if value is None or value == "":
+        raise ValueError(f"missing {field}")
+    return value
+
+#funzione che restituisce un campo facoltativo della riga, None se assente o vuoto
+def optional(row, field):
+    value = row.get(field)
+    return None if value == "" else value
+
+#funzione per convertire un booleano da CSV ("true"/"false", "1"/"0") o da JSON
+def parse_bool(value, default):
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("true", "1", "yes"):
+        return True
+    if str(value).lower() in ("false", "0", "no"):
+        return False
+    raise ValueError(f"invalid boolean {value}")
+
+#funzione per leggere un identificativo facoltativo: se assente viene generato in Python dal default uuid4 della colonna,
+#valorizzato da SQLAlchemy per ogni riga prima dell'INSERT su più righe
+def optional_uuid(row, field):
+    value = optional(row, field)
+    return {field: UUID(str(value))} if value is not None else {}
+
+#funzione per validare un account, la password può essere in chiaro (password) o già calcolata (password_hash, migrazione)
+def validate_account(row):
+    username = required(row, "username")
+    email = required(row, "email")
+    tel_number = optional(row, "tel_number") or ""
+    if not re.match(USERNAME_REGEX, username):
+        raise ValueError("invalid username")
+    if not re.match(EMAIL_REGEX, email):
+        raise ValueError("invalid email")
+    if tel_number and not re.match(TEL_NUMBER_REGEX, tel_number):
+        raise ValueError("invalid tel_number")
+
+    password_hash = optional(row, "password_hash")
+    if password_hash is None:
+        password = required(row, "password")
+        if not re.match(PASSWORD_REGEX, password):
+            raise ValueError("invalid password")
+        try:
+            password_hash = hash_password(password, IMPORT_PASSWORD_HASH_TIMEOUT_SECONDS)
+        except PasswordHashingBusy:
+            raise ValueError("password hashing busy, retry the row")
+
+    return {
+        **optional_uuid(row, "account_id"),
+        "username": username,
+        "password_hash": password_hash,
+        "email": email,
+        "first_name": required(row, "first_name"),
+        "last_name": required(row, "last_name"),
+        "tel_number": tel_number,
+        "enabled": parse_bool(optional(row, "enabled"), True),
+        "failed_login_count": 0,
+        "is_operator": False,
+        "is_admin": False
+    }
+
+#funzione per validare una disponibilità
+def validate_availability(row):
+    values = {
+        **optional_uuid(row, "availability_id"),
+        "exam_type_id": UUID(str(required(row, "exam_type_id"))),
+        "laboratory_id": UUID(str(required(row, "laboratory_id"))),
+        "operator_id": UUID(str(required(row, "operator_id"))),
+        "available_from_date": date.fromisoformat(required(row, "available_from_date")),
+        "available_to_date": date.fromisoformat(required(row, "available_to_date")),
+        "available_from_time": time.fromisoformat(required(row, "available_from_time")),
+        "available_to_time": time.fromisoformat(required(row, "available_to_time")),
+        "available_weekday": int(required(row, "available_weekday")),
+        "slot_duration_minutes": int(required(row, "slot_duration_minutes")),
+        "pause_minutes": int(optional(row, "pause_minutes") or 0),
+        "enabled": parse_bool(optional(row, "enabled"), True)
+    }
+    if values["available_from_date"] > values["available_to_date"]:
+        raise ValueError("available_from_date after available_to_date")
+    if values["available_from_time"] >= values["available_to_time"]:
+        raise ValueError("available_from_time not before available_to_time")
+    if not 0 <= values["available_weekday"] <= 6:
+        raise ValueError("available_weekday must be between 0 and 6")
+    if values["slot_duration_minutes"] <= 0 or values["pause_minutes"] < 0:
+        raise ValueError("invalid slot_duration_minutes or pause_minutes")
+    return values
+
+#funzione per validare un periodo (chiusura o assenza) riferito alla chiave indicata
+def validate_period(row, key_field, id_field):
+    values = {
+        **optional_uuid(row, id_field),
+        key_field: UUID(str(required(row, key_field))),
+        "start_datetime": datetime.fromisoformat(required(row, "start_datetime")),
+        "end_datetime": datetime.fromisoformat(required(row, "end_datetime"))
+    }
+    if values["start_datetime"] > values["end_datetime"]:
+        raise ValueError("start_datetime after end_datetime")
+    return values
+
+#funzioni chiamate dopo ogni blocco importato per invalidare la cache degli slot del worker
+def after_availabilities_import(rows):
+    for values in rows:
+        if "availability_id" in values:
+            invalidate_availability(values["availability_id"])
+
+def after_closures_import(rows):
+    for values in rows:
+        invalidate_laboratory_closure(values["laboratory_id"], values["start_datetime"], values["end_datetime"])
+
+def after_absences_import(rows):
+    for values in rows:
+        invalidate_operator_absence(values["operator_id"], values["start_datetime"], values["end_datetime"])
+
+# tipi di import: tabella, validazione della riga, azioni dopo il commit di un blocco
+IMPORT_KINDS = {
+    "accounts": (Account, validate_account, None),
+    "availabilities": (OperatorsAvailability, validate_availability, after_availabilities_import),
+    "closures": (LaboratoryClosure, lambda row: validate_period(row, "laboratory_id", "closure_id"), after_closures_import),
+    "absences": (OperatorAbsence, lambda row: validate_period(row, "operator_id", "absence_id"), after_absences_import)
+}
+
+#funzione per leggere in streaming le righe di un file di testo CSV (con intestazione) o NDJSON
+#le righe non leggibili vengono restituite come eccezioni in modo da riportarle nel resoconto
+def read_rows(stream, input_format):
+    if input_format == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"invalid JSON: {e}")
+            continue
+        yield row if isinstance(row, dict) else ValueError("row is not a JSON object")
+
+#funzione per inserire un blocco di righe validate in una transazione
+#restituisce le righe inserite e la lista di (numero riga, errore) per le righe rifiutate dal database
+def load_chunk(model, chunk):
+    with Session(get_engine()) as session:
+        try:
+            session.execute(insert(model), [values for row_number, values in chunk])
+            session.commit()
+            return [values for row_number, values in chunk], []
+        except (IntegrityError, DataError):
+            session.rollback()
+
+        # il blocco contiene almeno una riga errata: reinserisce le righe una alla volta con un savepoint ciascuna
+        imported, errors = [], []
+        for row_number, values in chunk:
+            try:
+                with session.begin_nested():
+                    session.execute(insert(model), [values])
+                imported.append(values)
+            except (IntegrityError, DataError) as e:
+                errors.append((row_number, getattr(e.orig.diag, "message_primary", None) or str(e.orig)))
+        session.commit()
+        return imported, errors
+
+#funzione per importare le righe di un tipo, restituisce il resoconto con errori per riga e righe al secondo
+def import_rows(kind, rows, chunk_size = IMPORT_CHUNK_SIZE):
+    model, validate_row, after_import = IMPORT_KINDS[kind]
+    report = {"kind": kind, "rows_total": 0, "rows_imported": 0, "rows_failed": 0, "errors": []}
+    started = clock.perf_counter()
+
+    def add_error(row_number, error):
+        report["rows_failed"] += 1
+        if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": row_number, "error": str(error)})
+
+    def flush(chunk):
+        imported, errors = load_chunk(model, chunk)
+        report["rows_imported"] += len(imported)
+        for row_number, error in errors:
+            add_error(row_number, error)
+        if after_import and imported:
+            after_import(imported)
+        if imported:
+            invalidate_data_versions()
+        logging.info("Import %s: %s righe importate, %s scartate", kind, report["rows_imported"], report["rows_failed"])
+
+    chunk = []
+    for row_number, row in enumerate(rows, start=1):
+        report["rows_total"] += 1
+        if isinstance(row, Exception):
+            add_error(row_number, row)
+            continue
+        try:
+            chunk.append((row_number, validate_row(row)))
+        except (KeyError, ValueError, TypeError) as e:
+            add_error(row_number, e)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    elapsed = clock.perf_counter() - started
+    report["elapsed_seconds"] = round(elapsed, 3)
+    report["rows_per_second"] = round(report["rows_imported"] / elapsed, 1) if elapsed > 0 else None
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Import massivo da CSV o NDJSON")
+    parser.add_argument("kind", choices=tuple(IMPORT_KINDS))
+    parser.add_argument("path", help="file da importare, - per lo standard input")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="default: dedotto dall'estensione del file")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    input_format = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="") if args.path == "-" else open(args.path, encoding="utf-8", newline="")
+    with stream:
+        report = import_rows(args.kind, read_rows(stream, input_format), args.chunk_size)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["rows_failed"] else 0)
+
+if __name__ == "__main__":
+    main()
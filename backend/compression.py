@@ -0,0 +1,106 @@
+import os
+import zlib
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BROTLI_AVAILABLE = brotli is not None
+
+# Compressione delle risposte negoziata con Accept-Encoding (brotli se installato, altrimenti gzip)
+# sono compresse solo le risposte JSON e testuali oltre COMPRESSION_MIN_BYTES: per quelle piccole il costo supera il risparmio
+# le risposte in streaming (ndjson) vengono compresse man mano che gli slot sono generati: il compressore trattiene i dati
+# finché non ha un blocco pieno, quindi viene svuotato (flush) dopo la prima riga e poi ogni COMPRESSION_STREAM_FLUSH_BYTES
+# di dati non compressi, in modo che il client riceva subito i primi slot senza rinunciare alla compressione tra righe vicine
+# ogni codifica è una rappresentazione diversa della risorsa: l'ETag riceve il suffisso della codifica
+
+load_dotenv()
+
+COMPRESSION_ENABLED = bool(os.getenv("COMPRESSION_ENABLED", "True") == "True")
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+COMPRESSION_STREAM_FLUSH_BYTES = int(os.getenv("COMPRESSION_STREAM_FLUSH_BYTES", "16384"))
+
+# codifiche in ordine di preferenza a parità di qualità richiesta dal client
+COMPRESSION_ENCODINGS = ("br", "gzip") if BROTLI_AVAILABLE else ("gzip",)
+
+#funzione che indica se il tipo di contenuto è comprimibile (JSON, ndjson, formato compact e testo)
+def is_compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith("text/") or mimetype.endswith("json") or mimetype == "application/x-ndjson")
+
+#funzione che restituisce un compressore incrementale per la codifica, con i metodi compress, flush (dati inviati finora) e finish
+def new_compressor(encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        return compressor.process, compressor.flush, compressor.finish
+    # wbits 31: formato gzip con intestazione e checksum
+    compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+#funzione per comprimere un corpo completo
+def compress_bytes(data, encoding):
+    compress, _, finish = new_compressor(encoding)
+    return compress(data) + finish()
+
+#funzione per comprimere una risposta in streaming, svuotando il compressore dopo il primo blocco e ogni COMPRESSION_STREAM_FLUSH_BYTES
+def compress_stream(chunks, encoding):
+    compress, flush, finish = new_compressor(encoding)
+    # dati non compressi non ancora inviati, la prima riga viene inviata subito
+    pending_bytes = 0
+    first = True
+    try:
+        for chunk in chunks:
+            data = chunk.encode() if isinstance(chunk, str) else chunk
+            compressed = compress(data)
+            pending_bytes += len(data)
+            if first or pending_bytes >= COMPRESSION_STREAM_FLUSH_BYTES:
+                compressed += flush()
+                pending_bytes = 0
+                first = False
+            if compressed:
+                yield compressed
+        yield finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+#funzione che restituisce l'ETag di una rappresentazione compressa
+def encoded_etag(etag, encoding):
+    return f"{etag}-{encoding}"
+
+#funzione che restituisce gli ETag di tutte le rappresentazioni della risorsa, per il confronto con If-None-Match
+def etag_variants(etag):
+    return (etag, *(encoded_etag(etag, encoding) for encoding in COMPRESSION_ENCODINGS))
+
+#funzione per comprimere la risposta se il client accetta una delle codifiche disponibili
+#accept_encodings è l'header Accept-Encoding già interpretato da werkzeug (request.accept_encodings)
+def compress_response(response, accept_encodings):
+    if not COMPRESSION_ENABLED or response.status_code != 200 or response.direct_passthrough:
+        return response
+    if "Content-Encoding" in response.headers or not is_compressible(response.mimetype):
+        return response
+    if "no-transform" in (response.headers.get("Cache-Control") or ""):
+        return response
+    if not response.is_streamed and response.calculate_content_length() < COMPRESSION_MIN_BYTES:
+        return response
+
+    # la risposta dipende dall'header anche quando viene inviata senza compressione
+    response.vary.add("Accept-Encoding")
+    encoding = accept_encodings.best_match(COMPRESSION_ENCODINGS)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(compress_bytes(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding), weak)
+    return response
@@ -0,0 +1,53 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from metrics import call_counting_queries, add_queries
+
+# Esecuzione concorrente di query indipendenti su connessioni separate del pool di SQLAlchemy
+# la prima query viene eseguita nel thread della richiesta con la sua sessione, le altre in un pool di thread
+# ciascuna con una propria sessione: la durata complessiva si avvicina a quella della query più lenta
+# ogni thread occupa una connessione: con SLOTS_QUERY_THREADS thread per worker servono fino a SLOTS_QUERY_THREADS
+# connessioni oltre a quelle delle richieste, da considerare nel dimensionamento di POSTGRES_POOL_SIZE e POSTGRES_MAX_OVERFLOW
+# in READ COMMITTED (default di Postgres) ogni istruzione vede comunque la propria istantanea, come nell'esecuzione in sequenza
+
+load_dotenv()
+
+SLOTS_CONCURRENT_QUERIES = bool(os.getenv("SLOTS_CONCURRENT_QUERIES", "True") == "True")
+SLOTS_QUERY_THREADS = int(os.getenv("SLOTS_QUERY_THREADS", "4"))
+
+# pool di thread creato al primo utilizzo e condiviso tra le richieste del worker
+executors = []
+executors_lock = threading.Lock()
+
+#funzione che restituisce il pool di thread, creandolo se necessario
+def get_executor():
+    with executors_lock:
+        if not executors:
+            executors.append(ThreadPoolExecutor(max_workers=SLOTS_QUERY_THREADS, thread_name_prefix="slots-query"))
+        return executors[0]
+
+#funzione eseguita nel pool: apre una sessione dedicata, esegue la query e restituisce il risultato con il numero di query SQL
+def run_query(session_factory, query):
+    with session_factory() as session:
+        return call_counting_queries(query, session)
+
+#funzione per eseguire le query (funzioni che ricevono una sessione) e restituirne i risultati nello stesso ordine
+#gli oggetti caricati dalle sessioni del pool sono detached: vanno caricati con tutte le relazioni usate dal chiamante
+def run_queries(session, session_factory, queries):
+    if not SLOTS_CONCURRENT_QUERIES or SLOTS_QUERY_THREADS < 1 or len(queries) < 2:
+        return [query(session) for query in queries]
+
+    executor = get_executor()
+    futures = [executor.submit(run_query, session_factory, query) for query in queries[1:]]
+    try:
+        results = [queries[0](session)]
+    finally:
+        # attende sempre tutte le query, anche in caso di errore, per non lasciare connessioni in uso dopo la richiesta
+        for future in futures:
+            if future.exception() is None:
+                add_queries(future.result()[1])
+
+    for future in futures:
+        results.append(future.result()[0])
+    return results
@@ -0,0 +1,81 @@
+import os
+import hashlib
+import logging
+import threading
+import time as clock
+from dotenv import load_dotenv
+from sqlalchemy import select, literal
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from database import get_read_engine, DataVersion, SLOT_CHANGES_TRIGGERS
+from slot_changes import visible_txid_limit, last_visible_txid
+
+# Versioni dei dati per le GET condizionali (ETag / If-None-Match)
+# ogni scrittura sulle tabelle di consultazione incrementa la versione della tabella (trigger creato da manage.py migrate)
+# prenotazioni, disponibilità, chiusure e assenze hanno come versione l'ultima transazione visibile nel registro slot_changes,
+# letta insieme alla versione corrente del registro (chiave slot_changes) da cui la cache degli slot applica le modifiche
+# l'ETag di una risposta è l'hash della richiesta e delle versioni delle tabelle da cui dipende:
+# se coincide con If-None-Match la route risponde 304 senza interrogare il database né generare slot
+# le versioni sono lette una volta ogni DATA_VERSIONS_TTL_SECONDS per worker: una scrittura eseguita da un altro worker
+# viene vista al più dopo questo intervallo, le scritture del worker stesso invalidano subito la copia locale
+
+load_dotenv()
+
+DATA_VERSIONS_ENABLED = bool(os.getenv("DATA_VERSIONS_ENABLED", "True") == "True")
+DATA_VERSIONS_TTL_SECONDS = float(os.getenv("DATA_VERSIONS_TTL_SECONDS", "1"))
+
+# copia locale delle versioni: (istante di lettura, {tabella: versione})
+data_versions_snapshot = []
+data_versions_lock = threading.Lock()
+
+#funzione che restituisce le versioni di tutte le tabelle, rileggendole dal database se la copia locale è scaduta
+#restituisce None se le versioni non sono disponibili (tabella non creata o database non raggiungibile)
+def get_data_versions():
+    with data_versions_lock:
+        if data_versions_snapshot and clock.monotonic() - data_versions_snapshot[0] < DATA_VERSIONS_TTL_SECONDS:
+            return data_versions_snapshot[1]
+
+    try:
+        with Session(get_read_engine()) as session:
+            versions = dict(session.execute(
+                select(DataVersion.table_name, DataVersion.version)
+                .union_all(
+                    select(literal("slot_changes"), visible_txid_limit()),
+                    select(literal("slot_changes_visible"), last_visible_txid())
+                )
+            ).all())
+    except SQLAlchemyError:
+        logging.exception("Versioni dei dati non disponibili, ETag disattivati")
+        return None
+    changes_version = versions.pop("slot_changes_visible")
+    current_version = versions.pop("slot_changes")
+    # senza righe i trigger non sono stati installati: le versioni non rappresenterebbero le scritture
+    if not versions:
+        return None
+    for table_name in SLOT_CHANGES_TRIGGERS:
+        versions[table_name] = changes_version
+    versions["slot_changes"] = current_version
+
+    with data_versions_lock:
+        data_versions_snapshot[:] = [clock.monotonic(), versions]
+    return versions
+
+#funzione per scartare la copia locale delle versioni dopo una scrittura del worker
+def invalidate_data_versions():
+    with data_versions_lock:
+        data_versions_snapshot.clear()
+
+#funzione che calcola l'ETag di una risposta a partire dalle tabelle da cui dipende e dalle parti che identificano la richiesta
+#restituisce None se gli ETag sono disattivati o le versioni non sono disponibili
+def compute_etag(tables, *request_parts):
+    if not DATA_VERSIONS_ENABLED:
+        return None
+    versions = get_data_versions()
+    if versions is None:
+        return None
+    digest = hashlib.sha256()
+    for table_name in tables:
+        digest.update(f"{table_name}={versions.get(table_name, 0)};".encode())
+    for part in request_parts:
+        digest.update(repr(part).encode() + b";")
+    return digest.hexdigest()[:32]
@@ -1,7 +1,8 @@
 import os
 import uuid
+import threading
 from typing import List, Optional
-from sqlalchemy import ForeignKey, String, Date, Time, DateTime, Boolean, Integer, Index, text
+from sqlalchemy import ForeignKey, String, Date, Time, DateTime, Boolean, Integer, BigInteger, Index, CheckConstraint, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.dialects.postgresql import UUID, VARCHAR
 from sqlalchemy import create_engine
@@ -20,12 +21,63 @@ try:
     POSTGRES_HOST = os.getenv("POSTGRES_HOST")
     POSTGRES_DB = os.getenv("POSTGRES_DB")
     POSTGRES_ECHO = bool(os.getenv("POSTGRES_ECHO", "False") == "True")
+    # host di una replica in sola lettura, se impostato le route GET di consultazione leggono da questo host
+    POSTGRES_READ_HOST = os.getenv("POSTGRES_READ_HOST")
+
+    # configurazione del pool di connessioni (uno per worker)
+    POSTGRES_POOL_SIZE = int(os.getenv("POSTGRES_POOL_SIZE", "5"))
+    POSTGRES_MAX_OVERFLOW = int(os.getenv("POSTGRES_MAX_OVERFLOW", "10"))
+    POSTGRES_POOL_TIMEOUT = int(os.getenv("POSTGRES_POOL_TIMEOUT", "30"))
+    POSTGRES_POOL_RECYCLE = int(os.getenv("POSTGRES_POOL_RECYCLE", "-1"))
+    POSTGRES_POOL_PRE_PING = bool(os.getenv("POSTGRES_POOL_PRE_PING", "False") == "True")
+    # timeout delle query in millisecondi, 0 = nessun limite
+    POSTGRES_STATEMENT_TIMEOUT_MS = int(os.getenv("POSTGRES_STATEMENT_TIMEOUT_MS", "0"))
     
-except KeyError as e:
+except (KeyError, ValueError) as e:
     print(f"Errore: variabile d'ambiente necesaria per l'avvio del database: {e}")
     exit(1)
 
-engine = create_engine(f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}/{POSTGRES_DB}", echo=POSTGRES_ECHO)
+#funzione per creare un engine verso un host postgres con la configurazione del pool
+def create_database_engine(host):
+    connect_args = {}
+    if POSTGRES_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={POSTGRES_STATEMENT_TIMEOUT_MS}"
+    return create_engine(
+        f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{host}/{POSTGRES_DB}",
+        echo=POSTGRES_ECHO,
+        pool_size=POSTGRES_POOL_SIZE,
+        max_overflow=POSTGRES_MAX_OVERFLOW,
+        pool_timeout=POSTGRES_POOL_TIMEOUT,
+        pool_recycle=POSTGRES_POOL_RECYCLE,
+        pool_pre_ping=POSTGRES_POOL_PRE_PING,
+        connect_args=connect_args
+    )
+
+# gli engine vengono creati al primo utilizzo: importare il modulo (e quindi app) non apre connessioni
+engines = {}
+engines_lock = threading.RLock()
+
+#funzione che restituisce l'engine con il nome indicato, creandolo con factory alla prima richiesta
+def lazy_engine(name, factory):
+    engine = engines.get(name)
+    if engine is None:
+        with engines_lock:
+            engine = engines.get(name)
+            if engine is None:
+                engine = engines[name] = factory()
+    return engine
+
+#funzione che restituisce l'engine principale per scritture e letture che devono vedere subito le scritture (login, prenotazioni, blocklist)
+def get_engine():
+    return lazy_engine("main", lambda: create_database_engine(POSTGRES_HOST))
+
+#funzione che restituisce l'engine per le letture di consultazione, coincide con quello principale se non è configurata una replica
+def get_read_engine():
+    return lazy_engine("read", lambda: create_database_engine(POSTGRES_READ_HOST) if POSTGRES_READ_HOST else get_engine())
+
+#funzione che restituisce l'engine senza transazioni esplicite: ogni statement viene confermato da solo, in un solo round trip
+def get_autocommit_engine():
+    return lazy_engine("autocommit", lambda: get_engine().execution_options(isolation_level="AUTOCOMMIT"))
 
 from sqlalchemy.dialects.postgresql import VARCHAR
 
@@ -76,6 +128,14 @@ class LaboratoryClosure(Base):
     start_datetime: Mapped[datetime] = mapped_column(DateTime, nullable=False)
     end_datetime: Mapped[datetime] = mapped_column(DateTime, nullable=False)
 
+    __table_args__ = (
+        # chiusure non ancora terminate, per laboratorio o di tutti i laboratori (query_slots_conflicts)
+        Index("ix_laboratory_closures_laboratory_end", "laboratory_id", "end_datetime"),
+        Index("ix_laboratory_closures_end", "end_datetime"),
+        # un periodo con fine precedente all'inizio non è valido (la generazione degli slot lo ignora)
+        CheckConstraint("start_datetime <= end_datetime", name="ck_laboratory_closures_period"),
+    )
+
 # Tabella di gestione dei tipi di esame
 class ExamType(Base):
     __tablename__ = "exam_types"
@@ -111,6 +171,14 @@ class OperatorAbsence(Base):
     start_datetime: Mapped[datetime] = mapped_column(DateTime, nullable=False)
     end_datetime: Mapped[datetime] = mapped_column(DateTime, nullable=False)
 
+    __table_args__ = (
+        # assenze non ancora terminate, per operatore o di tutti gli operatori (query_slots_conflicts)
+        Index("ix_operator_absences_operator_end", "operator_id", "end_datetime"),
+        Index("ix_operator_absences_end", "end_datetime"),
+        # un periodo con fine precedente all'inizio non è valido (la generazione degli slot lo ignora)
+        CheckConstraint("start_datetime <= end_datetime", name="ck_operator_absences_period"),
+    )
+
 # Tabella Disponibilità
 class OperatorsAvailability(Base):
     __tablename__ = "operators_availability"
@@ -134,6 +202,14 @@ class OperatorsAvailability(Base):
     exam_type: Mapped["ExamType"] = relationship(back_populates="operators_availability")
     slot_bookings: Mapped[List["SlotBooking"]] = relationship(back_populates="operators_availability")
 
+    __table_args__ = (
+        # i filtri sugli slot e le route /operators e /laboratories usano uno solo o una combinazione qualsiasi dei tre identificativi:
+        # un indice per ciascuno, con la data di fine per escludere le disponibilità già terminate
+        Index("ix_operators_availability_exam_type_to_date", "exam_type_id", "available_to_date"),
+        Index("ix_operators_availability_laboratory_to_date", "laboratory_id", "available_to_date"),
+        Index("ix_operators_availability_operator_to_date", "operator_id", "available_to_date"),
+    )
+
 # Tabella per la gestione delle prenotazioni
 class SlotBooking(Base):
     __tablename__ = "slot_bookings"
@@ -141,6 +217,8 @@ class SlotBooking(Base):
     appointment_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True),primary_key=True,default=uuid.uuid4,unique=True,nullable=False)
     account_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("account.account_id"))
     availability_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("operators_availability.availability_id"), nullable=False)
+    # copia del tipo di esame della disponibilità, necessaria per il vincolo di una prenotazione attiva per esame
+    exam_type_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("exam_types.exam_type_id"), nullable=False)
     appointment_date: Mapped[date] = mapped_column(Date, nullable=False)
     appointment_time_start: Mapped[time] = mapped_column(Time, nullable=False)
     appointment_time_end: Mapped[time] = mapped_column(Time, nullable=False)
@@ -149,8 +227,17 @@ class SlotBooking(Base):
     # Relazioni
     operators_availability: Mapped["OperatorsAvailability"] = relationship(back_populates="slot_bookings")
 
-    # Vincolo necessario per evitare le duplicazioni di due prenotazioni attive
     __table_args__ = (
+        # Vincolo necessario per evitare che un account abbia due prenotazioni attive per lo stesso tipo di esame
+        # dichiarato per primo in modo che postgres lo verifichi prima di uq_active_appointments (risposta 409 in /book_slot)
+        Index(
+            "uq_active_exam_type_per_account",
+            "account_id",
+            "exam_type_id",
+            unique=True,
+            postgresql_where=text("NOT rejected"),
+        ),
+        # Vincolo necessario per evitare le duplicazioni di due prenotazioni attive
         Index(
             "uq_active_appointments",
             "availability_id",
@@ -159,12 +246,235 @@ class SlotBooking(Base):
             unique=True,
             postgresql_where=text("NOT rejected"),
         ),
+        # prenotazioni dell'account, comprese quelle rifiutate (/slot_bookings)
+        Index("ix_slot_bookings_account_id", "account_id"),
+        # prenotazioni attive a partire da una data, senza filtri sulla disponibilità (query_slots_conflicts)
+        Index(
+            "ix_slot_bookings_active_date",
+            "appointment_date",
+            postgresql_where=text("NOT rejected"),
+        ),
     )
 
-Base.metadata.create_all(engine)
+# Tabella dei token JWT revocati (/logout), ciascun jti viene mantenuto solo fino alla scadenza del token
+class TokenBlocklist(Base):
+    __tablename__ = "token_blocklist"
+
+    jti: Mapped[str] = mapped_column(String(64), primary_key=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+# Versione dei dati di ciascuna tabella di consultazione, incrementata da un trigger ad ogni scrittura
+# usata per calcolare gli ETag delle GET (data_versions.py)
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    table_name: Mapped[str] = mapped_column(String(63), primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+# Registro delle modifiche che liberano o occupano slot, scritto dai trigger creati da upgrade_schema (slot_changes.py)
+# la versione è txid, l'identificativo della transazione che ha scritto la riga: le transazioni scrivono senza attendersi
+# e i lettori restituiscono solo le righe delle transazioni già concluse (txid inferiore allo xmin dell'istantanea),
+# quindi una versione letta implica che le transazioni precedenti sono già visibili o annullate
+class SlotChange(Base):
+    __tablename__ = "slot_changes"
+    __table_args__ = (
+        # lettura delle modifiche successive a una versione, in ordine di transazione e di scrittura
+        Index("ix_slot_changes_txid", "txid", "change_id"),
+    )
+
+    change_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    txid: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default=text("pg_current_xact_id()::text::bigint"))
+    # booked/freed per le prenotazioni, <availability|closure|absence>_added/_removed per disponibilità, chiusure e assenze
+    change_type: Mapped[str] = mapped_column(String(30), nullable=False)
+    # identificativi valorizzati in base al tipo di modifica (senza chiavi esterne: le righe possono riferire dati eliminati)
+    availability_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True))
+    exam_type_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True))
+    laboratory_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True))
+    operator_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True))
+    # intervallo interessato: lo slot prenotato o liberato, il periodo di chiusura o assenza, le date della disponibilità
+    start_datetime: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    end_datetime: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    changed_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=text("LOCALTIMESTAMP"))
+
+# Ultima transazione rimossa dal registro dalla compattazione (una sola riga): le versioni fino a compacted_txid non sono più leggibili
+class SlotChangesCompaction(Base):
+    __tablename__ = "slot_changes_compaction"
+
+    compaction_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    compacted_txid: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+# tabelle le cui scritture sono registrate in slot_changes, con la funzione del trigger
+SLOT_CHANGES_TRIGGERS = {
+    "slot_bookings": "log_slot_booking_change",
+    "operators_availability": "log_availability_change",
+    "laboratory_closures": "log_laboratory_closure_change",
+    "operator_absences": "log_operator_absence_change"
+}
+
+# tabelle con una versione per gli ETag delle GET (data_versions.py)
+# le scritture sulle tabelle di consultazione incrementano la loro riga in data_versions, le tabelle registrate in slot_changes
+# hanno come versione l'ultima transazione visibile del registro: le prenotazioni non aggiornano una riga condivisa
+DATA_VERSIONED_TABLES = (
+    "exam_types",
+    "laboratories",
+    "operators",
+    *SLOT_CHANGES_TRIGGERS
+)
+
+#funzione per aggiornare le tabelle create con versioni precedenti dello schema (create_all non modifica le tabelle esistenti)
+def upgrade_schema():
+    with get_engine().begin() as connection:
+        # exam_type_id nelle prenotazioni, valorizzato dalla disponibilità prenotata
+        connection.execute(text("ALTER TABLE slot_bookings ADD COLUMN IF NOT EXISTS exam_type_id UUID REFERENCES exam_types(exam_type_id)"))
+        connection.execute(text(
+            "UPDATE slot_bookings SET exam_type_id = operators_availability.exam_type_id "
+            "FROM operators_availability "
+            "WHERE slot_bookings.availability_id = operators_availability.availability_id AND slot_bookings.exam_type_id IS NULL"
+        ))
+        connection.execute(text("ALTER TABLE slot_bookings ALTER COLUMN exam_type_id SET NOT NULL"))
+        connection.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_active_exam_type_per_account ON slot_bookings (account_id, exam_type_id) WHERE NOT rejected"
+        ))
+
+        # vincoli sui periodi di chiusura e assenza: aggiunti NOT VALID e poi verificati sulle righe esistenti con VALIDATE CONSTRAINT,
+        # che non blocca le scritture sulla tabella; la generazione degli slot (index_periods) si basa su periodi con inizio <= fine
+        # se la tabella contiene periodi invertiti la migrazione si interrompe: vanno corretti prima, ad esempio con
+        # SELECT * FROM laboratory_closures WHERE end_datetime < start_datetime (e lo stesso per operator_absences)
+        for table_name in ("laboratory_closures", "operator_absences"):
+            constraint_name = f"ck_{table_name}_period"
+            validated = connection.execute(text("SELECT convalidated FROM pg_constraint WHERE conname = :name"), {"name": constraint_name}).scalar()
+            if validated is None:
+                connection.execute(text(f"ALTER TABLE {table_name} ADD CONSTRAINT {constraint_name} CHECK (start_datetime <= end_datetime) NOT VALID"))
+            if not validated:
+                connection.execute(text(f"ALTER TABLE {table_name} VALIDATE CONSTRAINT {constraint_name}"))
+
+        # registro delle modifiche creato prima della colonna txid: le righe precedenti vengono rimosse come da una compattazione
+        # e i client con una versione precedente riscaricano gli slot
+        connection.execute(text("INSERT INTO slot_changes_compaction (compaction_id, compacted_txid) VALUES (1, 0) ON CONFLICT DO NOTHING"))
+        if not connection.execute(text("SELECT 1 FROM information_schema.columns WHERE table_name = 'slot_changes' AND column_name = 'txid'")).first():
+            connection.execute(text("DELETE FROM slot_changes"))
+            connection.execute(text("ALTER TABLE slot_changes ADD COLUMN txid BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint"))
+            connection.execute(text("UPDATE slot_changes_compaction SET compacted_txid = pg_snapshot_xmin(pg_current_snapshot())::text::bigint - 1"))
+
+        # indici dichiarati nei modelli e aggiunti dopo la creazione delle tabelle
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+        # trigger per statement: una sola riga aggiornata per ogni INSERT/UPDATE/DELETE/TRUNCATE, visibile al commit della scrittura
+        connection.execute(text(
+            "CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$ "
+            "BEGIN "
+            "INSERT INTO data_versions (table_name, version) VALUES (TG_TABLE_NAME, 1) "
+            "ON CONFLICT (table_name) DO UPDATE SET version = data_versions.version + 1; "
+            "RETURN NULL; "
+            "END $$ LANGUAGE plpgsql"
+        ))
+        for table_name in DATA_VERSIONED_TABLES:
+            connection.execute(text(f"DROP TRIGGER IF EXISTS data_version_{table_name} ON {table_name}"))
+            # la versione delle tabelle registrate è letta da slot_changes
+            if table_name in SLOT_CHANGES_TRIGGERS:
+                connection.execute(text(f"DELETE FROM data_versions WHERE table_name = '{table_name}'"))
+                continue
+            connection.execute(text(f"INSERT INTO data_versions (table_name, version) VALUES ('{table_name}', 1) ON CONFLICT DO NOTHING"))
+            connection.execute(text(
+                f"CREATE TRIGGER data_version_{table_name} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table_name} "
+                "FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()"
+            ))
+
+        # registro delle modifiche agli slot: trigger per riga, nella stessa transazione della scrittura
+        # txid (default della colonna) è l'identificativo della transazione: nessun lock tra le transazioni che scrivono nel registro,
+        # l'ordine di lettura è garantito dai lettori che si fermano alle transazioni ancora in corso (slot_changes.py)
+        # la notifica sul canale slot_changes (una per transazione, inviata al commit) risveglia i worker con client in ascolto (slot_events.py)
+        connection.execute(text(
+            "CREATE OR REPLACE FUNCTION record_slot_change(change_type VARCHAR, availability_id UUID, exam_type_id UUID, "
+            "laboratory_id UUID, operator_id UUID, start_datetime TIMESTAMP, end_datetime TIMESTAMP) RETURNS void AS $$ "
+            "BEGIN "
+            "INSERT INTO slot_changes (change_type, availability_id, exam_type_id, laboratory_id, operator_id, start_datetime, end_datetime) "
+            "VALUES (change_type, availability_id, exam_type_id, laboratory_id, operator_id, start_datetime, end_datetime); "
+            "PERFORM pg_notify('slot_changes', ''); "
+            "END $$ LANGUAGE plpgsql"
+        ))
+        # prenotazioni: una prenotazione attiva (rejected falso) occupa lo slot, il rifiuto o l'eliminazione lo libera
+        connection.execute(text(
+            "CREATE OR REPLACE FUNCTION record_booking_slot_change(change_type VARCHAR, booking slot_bookings) RETURNS void AS $$ "
+            "BEGIN "
+            "PERFORM record_slot_change(change_type, booking.availability_id, booking.exam_type_id, availability.laboratory_id, availability.operator_id, "
+            "booking.appointment_date + booking.appointment_time_start, booking.appointment_date + booking.appointment_time_end) "
+            "FROM operators_availability AS availability WHERE availability.availability_id = booking.availability_id; "
+            "END $$ LANGUAGE plpgsql"
+        ))
+        connection.execute(text(
+            "CREATE OR REPLACE FUNCTION log_slot_booking_change() RETURNS trigger AS $$ "
+            "BEGIN "
+            "IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN RETURN NULL; END IF; "
+            "IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.rejected IS FALSE AND (TG_OP = 'DELETE' OR NEW.rejected IS NOT FALSE "
+            "OR (OLD.availability_id, OLD.appointment_date, OLD.appointment_time_start) IS DISTINCT FROM (NEW.availability_id, NEW.appointment_date, NEW.appointment_time_start)) THEN "
+            "PERFORM record_booking_slot_change('freed', OLD); "
+            "END IF; "
+            "IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.rejected IS FALSE AND (TG_OP = 'INSERT' OR OLD.rejected IS NOT FALSE "
+            "OR (OLD.availability_id, OLD.appointment_date, OLD.appointment_time_start) IS DISTINCT FROM (NEW.availability_id, NEW.appointment_date, NEW.appointment_time_start)) THEN "
+            "PERFORM record_booking_slot_change('booked', NEW); "
+            "END IF; "
+            "RETURN NULL; "
+            "END $$ LANGUAGE plpgsql"
+        ))
+        # disponibilità, chiusure e assenze: una modifica viene registrata come rimozione dei valori precedenti e aggiunta dei nuovi
+        connection.execute(text(
+            "CREATE OR REPLACE FUNCTION log_availability_change() RETURNS trigger AS $$ "
+            "BEGIN "
+            "IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN RETURN NULL; END IF; "
+            "IF TG_OP IN ('UPDATE', 'DELETE') THEN "
+            "PERFORM record_slot_change('availability_removed', OLD.availability_id, OLD.exam_type_id, OLD.laboratory_id, OLD.operator_id, "
+            "OLD.available_from_date::timestamp, (OLD.available_to_date + 1)::timestamp); "
+            "END IF; "
+            "IF TG_OP IN ('INSERT', 'UPDATE') THEN "
+            "PERFORM record_slot_change('availability_added', NEW.availability_id, NEW.exam_type_id, NEW.laboratory_id, NEW.operator_id, "
+            "NEW.available_from_date::timestamp, (NEW.available_to_date + 1)::timestamp); "
+            "END IF; "
+            "RETURN NULL; "
+            "END $$ LANGUAGE plpgsql"
+        ))
+        connection.execute(text(
+            "CREATE OR REPLACE FUNCTION log_laboratory_closure_change() RETURNS trigger AS $$ "
+            "BEGIN "
+            "IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN RETURN NULL; END IF; "
+            "IF TG_OP IN ('UPDATE', 'DELETE') THEN "
+            "PERFORM record_slot_change('closure_removed', NULL, NULL, OLD.laboratory_id, NULL, OLD.start_datetime, OLD.end_datetime); "
+            "END IF; "
+            "IF TG_OP IN ('INSERT', 'UPDATE') THEN "
+            "PERFORM record_slot_change('closure_added', NULL, NULL, NEW.laboratory_id, NULL, NEW.start_datetime, NEW.end_datetime); "
+            "END IF; "
+            "RETURN NULL; "
+            "END $$ LANGUAGE plpgsql"
+        ))
+        connection.execute(text(
+            "CREATE OR REPLACE FUNCTION log_operator_absence_change() RETURNS trigger AS $$ "
+            "BEGIN "
+            "IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN RETURN NULL; END IF; "
+            "IF TG_OP IN ('UPDATE', 'DELETE') THEN "
+            "PERFORM record_slot_change('absence_removed', NULL, NULL, NULL, OLD.operator_id, OLD.start_datetime, OLD.end_datetime); "
+            "END IF; "
+            "IF TG_OP IN ('INSERT', 'UPDATE') THEN "
+            "PERFORM record_slot_change('absence_added', NULL, NULL, NULL, NEW.operator_id, NEW.start_datetime, NEW.end_datetime); "
+            "END IF; "
+            "RETURN NULL; "
+            "END $$ LANGUAGE plpgsql"
+        ))
+        for table_name, function_name in SLOT_CHANGES_TRIGGERS.items():
+            connection.execute(text(f"DROP TRIGGER IF EXISTS slot_changes_{table_name} ON {table_name}"))
+            connection.execute(text(
+                f"CREATE TRIGGER slot_changes_{table_name} AFTER INSERT OR UPDATE OR DELETE ON {table_name} "
+                f"FOR EACH ROW EXECUTE FUNCTION {function_name}()"
+            ))
+
+#funzione per creare le tabelle mancanti e aggiornare quelle esistenti, eseguita dal comando migrate di manage.py
+def migrate_schema():
+    Base.metadata.create_all(get_engine())
+    upgrade_schema()
 
 def clear_existing_data():
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         # Cancella tutte le tabelle correlate
         session.query(SlotBooking).delete()
         session.query(OperatorsAvailability).delete()
@@ -179,7 +489,7 @@ def clear_existing_data():
 
 def populate_demo_data():
     try:
-        with Session(engine) as session:
+        with Session(get_engine()) as session:
             # === 1. Creazione Account ===
             account_uuids = {
                 "marco_rossi": uuid.uuid4(),
@@ -317,6 +627,3 @@ def populate_demo_data():
 
     except Exception as e:
         print(f"Errore durante l'inserimento dei dati: {e}")
-
-clear_existing_data()
-populate_demo_data()
@@ -0,0 +1,21 @@
+import os
+from dotenv import load_dotenv
+
+# Configurazione di gunicorn per il backend
+#
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# dimensionamento dei processi: ciascun worker gunicorn avvia alla prima richiesta che lo usa un pool di
+# SLOTS_PARALLEL_WORKERS processi per il motore parallel (operators_availability_parallel.py, default 2),
+# quindi con GUNICORN_WORKERS worker possono generare slot fino a GUNICORN_WORKERS x (1 + SLOTS_PARALLEL_WORKERS) processi:
+# il prodotto va tenuto vicino al numero di core della macchina (es. 8 core: 2 worker con 3 processi di generazione ciascuno,
+# oppure 4 worker e SLOTS_PARALLEL_WORKERS=1 per non usare il pool)
+# /slots_availability/events non è servito da questi worker (risponde 503): gli stream restano aperti per tutta la sessione
+# e sono serviti dal processo con worker gevent di gunicorn_events.conf.py, a cui il proxy inoltra quel percorso
+
+load_dotenv()
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+# thread per worker: le richieste attendono soprattutto il database, gli hash delle password sono limitati da PASSWORD_HASH_WORKERS
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
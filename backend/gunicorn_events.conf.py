@@ -0,0 +1,25 @@
+import os
+from dotenv import load_dotenv
+
+# Configurazione di gunicorn per le notifiche in tempo reale degli slot (/slots_availability/events, slot_events.py)
+#
+#   gunicorn -c gunicorn_events.conf.py app:app
+#
+# ogni client resta collegato per tutta la sessione: con i worker a thread di gunicorn.conf.py occuperebbe un thread
+# per tutta la durata della connessione, quindi gli eventi sono serviti da un processo separato con worker gevent,
+# in cui ogni client è un greenlet in attesa sulla propria coda e il server principale non riserva thread agli stream
+# il proxy inoltra a GUNICORN_EVENTS_BIND solo il percorso /slots_availability/events, il resto a gunicorn.conf.py
+# richiede gevent e psycogreen (requirements.txt): psycopg2 attende il database senza bloccare gli altri greenlet
+
+load_dotenv()
+
+bind = os.getenv("GUNICORN_EVENTS_BIND", "0.0.0.0:5001")
+worker_class = "gevent"
+workers = int(os.getenv("GUNICORN_EVENTS_WORKERS", "1"))
+# connessioni per worker: i client collegati (SLOT_EVENTS_MAX_SUBSCRIBERS) e le richieste in corso di apertura
+worker_connections = int(os.getenv("SLOT_EVENTS_MAX_SUBSCRIBERS", "1000")) + 100
+
+#funzione eseguita in ciascun worker: le query di psycopg2 cedono il controllo agli altri greenlet durante l'attesa
+def post_fork(server, worker):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
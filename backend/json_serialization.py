@@ -0,0 +1,57 @@
+import os
+from datetime import date, time
+from uuid import UUID
+from dotenv import load_dotenv
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ORJSON_AVAILABLE = orjson is not None
+
+# Serializzazione JSON delle risposte
+# UUID, date, orari e datetime vengono scritti come stringa (str e isoformat) da entrambi i provider, con lo stesso risultato
+# con orjson installato la serializzazione avviene in C e UUID e date sono convertiti direttamente dal serializzatore:
+# le route che restituiscono molti oggetti (gli slot) possono evitare la conversione se native_types del provider è vero
+
+load_dotenv()
+
+# provider JSON: "orjson" (default se installato) oppure "default" (modulo json della libreria standard)
+JSON_SERIALIZER = os.getenv("JSON_SERIALIZER", "orjson" if ORJSON_AVAILABLE else "default")
+
+#funzione di conversione dei tipi non JSON, usata dal modulo json per UUID e date e da orjson per i restanti tipi
+def json_default(value):
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return DefaultJSONProvider.default(value)
+
+# provider della libreria standard, con date e orari in formato ISO al posto del formato HTTP di Flask
+class IsoJSONProvider(DefaultJSONProvider):
+    default = staticmethod(json_default)
+    # la conversione tramite default è più lenta di str e isoformat eseguiti prima della serializzazione
+    native_types = False
+
+# provider basato su orjson: stesse chiavi ordinate del provider di default, output compatto anche in debug
+class OrjsonProvider(IsoJSONProvider):
+    native_types = True
+    options = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS) if ORJSON_AVAILABLE else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=json_default, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=json_default, option=self.options | orjson.OPT_APPEND_NEWLINE), mimetype=self.mimetype)
+
+#funzione che restituisce la classe del provider JSON configurato, quello di default se orjson non è installato
+def get_json_provider_class(serializer = JSON_SERIALIZER):
+    if serializer == "orjson" and ORJSON_AVAILABLE:
+        return OrjsonProvider
+    return IsoJSONProvider
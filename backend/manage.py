@@ -0,0 +1,34 @@
+import argparse
+from database import migrate_schema, clear_existing_data, populate_demo_data
+from slot_changes import compact_slot_changes
+
+# Comandi di gestione del database, da eseguire una volta prima di avviare (o aggiornare) i worker
+# l'import di app non crea tabelle e non modifica dati: i worker possono essere avviati e scalati senza effetti sul database
+#
+#   python manage.py migrate          crea le tabelle mancanti e aggiorna quelle esistenti
+#   python manage.py seed             inserisce i dati demo
+#   python manage.py seed --reset     cancella i dati esistenti e inserisce i dati demo
+#   python manage.py compact-changes  rimuove dal registro le modifiche agli slot oltre il periodo di conservazione
+
+def main():
+    parser = argparse.ArgumentParser(description="Gestione schema e dati del database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="crea e aggiorna lo schema")
+    seed = commands.add_parser("seed", help="inserisce i dati demo")
+    seed.add_argument("--reset", action="store_true", help="cancella i dati esistenti prima dell'inserimento")
+    commands.add_parser("compact-changes", help="compatta il registro delle modifiche agli slot")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate_schema()
+        print("Schema aggiornato.")
+    elif args.command == "seed":
+        if args.reset:
+            clear_existing_data()
+        populate_demo_data()
+    elif args.command == "compact-changes":
+        compact_slot_changes()
+        print("Registro delle modifiche compattato.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import os
+import hmac
+import threading
+import time as clock
+from bisect import bisect_left
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Metriche del worker esposte in formato testo Prometheus su /metrics
+# contatori e istogrammi sono mantenuti in memoria nel processo: con più worker ciascuno espone le proprie metriche
+# le etichette sono valori già disponibili sul percorso della richiesta (route, metodo, status, motore, fase, motivo):
+# mai identificativi, parametri o altri valori con cardinalità non limitata
+
+load_dotenv()
+
+METRICS_ENABLED = bool(os.getenv("METRICS_ENABLED", "True") == "True")
+# token dello scraper Prometheus (Authorization: Bearer <token>), senza token /metrics è riservato agli account amministratori
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# limiti superiori dei bucket degli istogrammi di durata (secondi) e di numero di query per richiesta
+METRICS_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_QUERIES_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+# tipo e descrizione delle metriche esposte
+METRICS = {
+    "http_requests_total": ("counter", "Richieste HTTP per route, metodo e status"),
+    "http_request_duration_seconds": ("histogram", "Durata delle richieste HTTP per route (risposte in streaming: fino al primo byte)"),
+    "db_queries_total": ("counter", "Query SQL eseguite per route"),
+    "db_queries_per_request": ("histogram", "Query SQL eseguite da una singola richiesta per route"),
+    "slots_phase_duration_seconds": ("histogram", "Durata delle fasi del calcolo degli slot"),
+    "slots_generated_total": ("counter", "Slot liberi restituiti per motore di generazione"),
+    "slots_filtered_total": ("counter", "Slot esclusi durante la generazione per motivo (motori python e numpy)")
+}
+
+# valori correnti: {(nome, etichette): valore} per i contatori, {(nome, etichette): [conteggi per bucket, somma, conteggio, bucket]} per gli istogrammi
+counters = {}
+histograms = {}
+metrics_lock = threading.Lock()
+
+# stato della richiesta in corso nel thread: istante di inizio e query eseguite
+request_state = threading.local()
+
+#funzione per incrementare un contatore, labels è una tupla di coppie (nome, valore)
+def increment(name, labels = (), value = 1):
+    if not METRICS_ENABLED:
+        return
+    key = (name, labels)
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + value
+
+#funzione che restituisce e azzera i contatori con il nome indicato, come lista di (etichette, valore)
+#usata dai processi del pool di generazione per restituire al worker i conteggi registrati durante un intervallo
+def pop_counters(name):
+    with metrics_lock:
+        keys = [key for key in counters if key[0] == name]
+        return [(key[1], counters.pop(key)) for key in keys]
+
+#funzione per registrare un valore in un istogramma
+def observe(name, value, labels = (), buckets = METRICS_DURATION_BUCKETS):
+    if not METRICS_ENABLED:
+        return
+    key = (name, labels)
+    with metrics_lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * (len(buckets) + 1), 0, 0, buckets]
+        # il bucket è il primo con limite superiore maggiore o uguale al valore, l'ultimo è +Inf
+        histogram[0][bisect_left(buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+#context manager per misurare la durata di una fase del calcolo degli slot
+@contextmanager
+def phase_timer(phase):
+    started = clock.perf_counter()
+    try:
+        yield
+    finally:
+        observe("slots_phase_duration_seconds", clock.perf_counter() - started, (("phase", phase),))
+
+#funzione per registrare gli slot esclusi da un generatore, per motivo
+def count_filtered_slots(past, closed, absent, booked):
+    for reason, value in (("past", past), ("closed", closed), ("absent", absent), ("booked", booked)):
+        if value:
+            increment("slots_filtered_total", (("reason", reason),), value)
+
+#funzioni per iniziare e concludere la misura di una richiesta nel thread corrente
+def start_request():
+    request_state.started = clock.perf_counter()
+    request_state.queries = 0
+
+def finish_request(endpoint, method, status):
+    started = getattr(request_state, "started", None)
+    if started is None:
+        return
+    request_state.started = None
+    labels = (("endpoint", endpoint),)
+    increment("http_requests_total", (("endpoint", endpoint), ("method", method), ("status", str(status))))
+    observe("http_request_duration_seconds", clock.perf_counter() - started, labels)
+    increment("db_queries_total", labels, request_state.queries)
+    observe("db_queries_per_request", request_state.queries, labels, METRICS_QUERIES_BUCKETS)
+
+#listener degli eventi before_cursor_execute di SQLAlchemy: conta le query della richiesta in corso nel thread
+def count_query(*args, **kwargs):
+    if getattr(request_state, "started", None) is not None:
+        request_state.queries += 1
+
+#funzione per eseguire una funzione in un thread diverso da quello della richiesta contando le query SQL che esegue
+#restituisce il risultato e il numero di query, da sommare alla richiesta con add_queries
+def call_counting_queries(function, *args):
+    request_state.started = clock.perf_counter()
+    request_state.queries = 0
+    try:
+        return function(*args), request_state.queries
+    finally:
+        request_state.started = None
+
+#funzione per sommare alla richiesta in corso nel thread le query eseguite in altri thread
+def add_queries(queries):
+    if getattr(request_state, "started", None) is not None:
+        request_state.queries += queries
+
+#funzione che verifica l'header Authorization di una richiesta a /metrics rispetto a METRICS_TOKEN, con un confronto a tempo costante
+def metrics_token_matches(authorization):
+    if not METRICS_TOKEN or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+#funzione per l'escape dei valori delle etichette nel formato testo
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+#funzione che restituisce le etichette nel formato testo, con eventuali etichette aggiuntive (le del bucket)
+def format_labels(labels, *extra):
+    pairs = (*labels, *extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+#funzione che restituisce tutte le metriche nel formato testo di Prometheus (versione 0.0.4)
+def render_metrics():
+    with metrics_lock:
+        counters_snapshot = dict(counters)
+        histograms_snapshot = {key: (list(value[0]), value[1], value[2], value[3]) for key, value in histograms.items()}
+
+    lines = []
+    for name, (metric_type, description) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if metric_type == "counter":
+            for (metric_name, labels), value in sorted(counters_snapshot.items()):
+                if metric_name == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            continue
+        for (metric_name, labels), (bucket_counts, total, count, buckets) in sorted(histograms_snapshot.items()):
+            if metric_name != name:
+                continue
+            cumulative = 0
+            for upper_bound, bucket_count in zip((*buckets, "+Inf"), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels(labels, ('le', upper_bound))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
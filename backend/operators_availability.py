@@ -1,5 +1,10 @@
+from bisect import bisect_left
+import heapq
+import sys
+from functools import lru_cache
 from datetime import date, datetime, time, timedelta
 import logging
+from metrics import count_filtered_slots
 
 logging.basicConfig(level=logging.INFO)
 
@@ -9,101 +14,279 @@ def add_minutes_to_time(original_time, minutes_to_add):
     temp_datetime += timedelta(minutes=minutes_to_add)
     return temp_datetime.time()
 
+# numero massimo di modelli di giornata e di stringhe ISO di date e orari mantenuti in memoria dal worker
+DAY_TEMPLATES_CACHE_SIZE = 4096
+ISOFORMAT_CACHE_SIZE = 8192
+
+#funzione che restituisce la stringa ISO di un orario o di una data, la stessa stringa (internata) per tutti gli slot che la usano
+@lru_cache(maxsize=ISOFORMAT_CACHE_SIZE)
+def isoformat(value):
+    return sys.intern(value.isoformat())
+
+#funzione che restituisce il modello di giornata di una disponibilità: la tupla immutabile degli slot del giorno
+#come (inizio, fine, inizio ISO, fine ISO, inizio dalla mezzanotte, fine dalla mezzanotte)
+#dipende solo dagli orari, quindi viene calcolato una volta e condiviso tra le disponibilità e le richieste con gli stessi orari
+#le stringhe ISO vengono assegnate agli slot creati, gli scostamenti dalla mezzanotte (timedelta) permettono di confrontare
+#gli slot con filtri, chiusure e assenze a partire dalla mezzanotte del giorno, senza creare un datetime per ogni slot
+@lru_cache(maxsize=DAY_TEMPLATES_CACHE_SIZE)
+def day_template(available_from_time, available_to_time, slot_duration_minutes, pause_minutes):
+    template = []
+    # la partenza del primo slot è sempre l'orario di partenza della disponibilità (necessario per generare gli slot in modo univoco)
+    slot_start = available_from_time
+    while slot_start < available_to_time:
+        slot_end = add_minutes_to_time(slot_start, slot_duration_minutes)
+        # se lo slot supera l'orario di fine la giornata è completa
+        if slot_end > available_to_time:
+            break
+        template.append((
+            slot_start,
+            slot_end,
+            sys.intern(slot_start.isoformat()),
+            sys.intern(slot_end.isoformat()),
+            datetime.combine(date.min, slot_start) - datetime.min,
+            datetime.combine(date.min, slot_end) - datetime.min
+        ))
+        slot_start = add_minutes_to_time(slot_end, pause_minutes)
+    return tuple(template)
+
+#funzione che restituisce il modello di giornata di una disponibilità
+def availability_day_template(operator_availability):
+    return day_template(
+        operator_availability.available_from_time,
+        operator_availability.available_to_time,
+        operator_availability.slot_duration_minutes,
+        operator_availability.pause_minutes
+    )
+
+#funzione per indicizzare gli slot prenotati in un set (availability_id, data, ora di inizio) per una verifica in tempo costante
+def index_booked_slots(booked_slots):
+    return {
+        (booked_slot.availability_id, booked_slot.appointment_date, booked_slot.appointment_time_start)
+        for booked_slot in booked_slots
+    }
+
+#funzione per indicizzare periodi di chiusura o assenza per laboratorio/operatore
+#per ciascuna chiave restituisce due liste ordinate (inizi e fini) di intervalli già uniti tra loro in modo da poterle interrogare per bisezione
+def index_periods(periods, key_attribute):
+    grouped_periods = {}
+    for period in periods:
+        # i periodi con fine precedente all'inizio sono rifiutati dalla validazione dell'import e dai vincoli sulle tabelle,
+        # verificati anche sulle righe esistenti dalla migrazione (database.upgrade_schema): dal database non ne arrivano,
+        # vengono ignorati solo per gli oggetti creati in memoria, che l'indice ordinato non potrebbe rappresentare
+        if period.end_datetime < period.start_datetime:
+            continue
+        grouped_periods.setdefault(getattr(period, key_attribute), []).append((period.start_datetime, period.end_datetime))
+
+    periods_index = {}
+    for key, intervals in grouped_periods.items():
+        intervals.sort()
+        starts, ends = [], []
+        for start_datetime, end_datetime in intervals:
+            # unisce gli intervalli sovrapposti o adiacenti
+            if starts and start_datetime <= ends[-1]:
+                ends[-1] = max(ends[-1], end_datetime)
+            else:
+                starts.append(start_datetime)
+                ends.append(end_datetime)
+        periods_index[key] = (starts, ends)
+    return periods_index
+
+#funzione per verificare se un intervallo [slot_start, slot_end] si sovrappone ad uno dei periodi indicizzati per la chiave
+def period_overlaps(key, slot_start_datetime, slot_end_datetime, periods_index):
+    intervals = periods_index.get(key)
+    if not intervals:
+        return False
+    starts, ends = intervals
+    # ultimo periodo che inizia prima della fine dello slot: essendo gli intervalli disgiunti è l'unico candidato
+    position = bisect_left(starts, slot_end_datetime) - 1
+    return position >= 0 and ends[position] > slot_start_datetime
+
 #funzione per verificare se uno slot è già stato prenotato
-def slot_is_booked(operator_availability_id, operator_availability_date, operator_availability_slot_start, operator_availability_slot_end, booked_slots):
-    for booked_slot in booked_slots:
-        if (
-            operator_availability_id == booked_slot.availability_id and 
-            operator_availability_date == booked_slot.appointment_date and
-            operator_availability_slot_start == booked_slot.appointment_time_start
-        ):
-            return True
-    return False
+def slot_is_booked(operator_availability_id, operator_availability_date, operator_availability_slot_start, operator_availability_slot_end, booked_slots_index):
+    return (operator_availability_id, operator_availability_date, operator_availability_slot_start) in booked_slots_index
 
 #funzione per verificare se uno slot è in un periodo di chiusura di un laboratorio 
-def lab_is_closed(laboratory_id, operator_availability_date, operator_availability_slot_start, operator_availability_slot_end, laboratory_closures):
-    for laboratory_closure in laboratory_closures:
-        if laboratory_id == laboratory_closure.laboratory_id:
-            if datetime.combine(operator_availability_date, operator_availability_slot_start) < laboratory_closure.end_datetime and datetime.combine(operator_availability_date, operator_availability_slot_end) > laboratory_closure.start_datetime :
-                return True
-    return False
+def lab_is_closed(laboratory_id, operator_availability_date, operator_availability_slot_start, operator_availability_slot_end, laboratory_closures_index):
+    return period_overlaps(
+        laboratory_id,
+        datetime.combine(operator_availability_date, operator_availability_slot_start),
+        datetime.combine(operator_availability_date, operator_availability_slot_end),
+        laboratory_closures_index
+    )
 
 #funzione per verificare se uno slot è in un periodo di assenza di un operatore 
-def operator_is_absent(operator_id, operator_availability_date ,operator_availability_slot_start, operator_availability_slot_end, operator_absences):
-    for operator_absence in operator_absences:
-        if operator_id == operator_absence.operator_id:
-            if datetime.combine(operator_availability_date, operator_availability_slot_start) < operator_absence.end_datetime and datetime.combine(operator_availability_date, operator_availability_slot_end) > operator_absence.start_datetime :
-                return True
-    return False
-
-#funzione per generare slot prenotabili a partire dalle disponibilità degli operatori datetime_from_filter viene utilizzato come parametro nella route per non fornire date nel passato
-def generate_availabile_slots(operators_availability, datetime_from_filter = None, datetime_to_filter = None, laboratory_closures = None, operator_absences = None, booked_slots = None):
-    
-    operators_availability_slots = []
-    
-    for operator_availability in operators_availability:
-
-        logging.info(
-            "Processo availability_id=%s, dal %s al %s, weekday=%d",
-            operator_availability.availability_id,
-            operator_availability.available_from_date,
-            operator_availability.available_to_date,
-            operator_availability.available_weekday
-        )
-
-        # se datetime_from_filter è impostato filtra la disponibilià degli esami partendo da quella data (se maggiore)
-        if  isinstance(datetime_from_filter, datetime):
-            operator_availability_date = max(operator_availability.available_from_date, datetime_from_filter.date())
-        else:
-            operator_availability_date = operator_availability.available_from_date
-
-        # se datetime_to_filter è impostato filtra la disponibilità degli esami fino a quella data (se inferiore)
-        if  isinstance(datetime_to_filter, datetime):
-            operator_availability_maxdate = min(datetime_to_filter.date(), operator_availability.available_to_date)
-        else:
-            operator_availability_maxdate = operator_availability.available_from_date
-
-        # sposta operator_availability date al primo giorno della settimana indicato nella operator_availability
-        operator_availability_date += timedelta(days=((operator_availability.available_weekday - operator_availability_date.weekday()) % 7))
+def operator_is_absent(operator_id, operator_availability_date ,operator_availability_slot_start, operator_availability_slot_end, operator_absences_index):
+    return period_overlaps(
+        operator_id,
+        datetime.combine(operator_availability_date, operator_availability_slot_start),
+        datetime.combine(operator_availability_date, operator_availability_slot_end),
+        operator_absences_index
+    )
+
+# Slot prenotabile: record compatto che fa riferimento alla disponibilità invece di copiarne i campi
+# il dizionario restituito dalle API viene creato solo in fase di serializzazione
+# gli slot del motore python ricevono le stringhe ISO degli orari dal modello di giornata, per gli altri vengono calcolate alla serializzazione
+class Slot:
+    __slots__ = ("operator_availability", "operator_availability_date", "operator_availability_slot_start", "operator_availability_slot_end", "slot_start_iso", "slot_end_iso")
+
+    def __init__(self, operator_availability, operator_availability_date, operator_availability_slot_start, operator_availability_slot_end, slot_start_iso = None, slot_end_iso = None):
+        self.operator_availability = operator_availability
+        self.operator_availability_date = operator_availability_date
+        self.operator_availability_slot_start = operator_availability_slot_start
+        self.operator_availability_slot_end = operator_availability_slot_end
+        self.slot_start_iso = slot_start_iso
+        self.slot_end_iso = slot_end_iso
+
+    #con native_types UUID, data e orari non vengono convertiti in stringa: il provider JSON (orjson) li serializza direttamente
+    def to_dict(self, native_types = False):
+        operator_availability = self.operator_availability
+        if native_types:
+            return {
+                "operator_availability_id": operator_availability.availability_id,
+                "exam_type_id": operator_availability.exam_type_id,
+                "laboratory_id": operator_availability.laboratory_id,
+                "operator_id": operator_availability.operator_id,
+                "exam_type_name": operator_availability.exam_type.name,
+                "laboratory_name": operator_availability.laboratory.name,
+                "operator_name": operator_availability.operator.name,
+                "operator_availability_date": self.operator_availability_date,
+                "operator_availability_slot_start": self.operator_availability_slot_start,
+                "operator_availability_slot_end": self.operator_availability_slot_end
+            }
+        return {
+            "operator_availability_id": operator_availability.availability_id,
+            "exam_type_id": str(operator_availability.exam_type_id),
+            "laboratory_id": str(operator_availability.laboratory_id),
+            "operator_id": str(operator_availability.operator_id),
+            "exam_type_name": operator_availability.exam_type.name,
+            "laboratory_name": operator_availability.laboratory.name,
+            "operator_name": operator_availability.operator.name,
+            "operator_availability_date": isoformat(self.operator_availability_date),
+            "operator_availability_slot_start": self.slot_start_iso or isoformat(self.operator_availability_slot_start),
+            "operator_availability_slot_end": self.slot_end_iso or isoformat(self.operator_availability_slot_end)
+        }
+
+#funzione che restituisce la chiave di ordinamento di uno slot (data, ora di inizio, availability_id) usata anche come cursore per la paginazione
+def slot_sort_key(slot):
+    return (slot.operator_availability_date, slot.operator_availability_slot_start, slot.operator_availability.availability_id)
+
+#funzione che restituisce i dati di una disponibilità ripetuti in tutti i suoi slot
+def availability_to_dict(operator_availability):
+    return {
+        "operator_availability_id": operator_availability.availability_id,
+        "exam_type_id": str(operator_availability.exam_type_id),
+        "laboratory_id": str(operator_availability.laboratory_id),
+        "operator_id": str(operator_availability.operator_id),
+        "exam_type_name": operator_availability.exam_type.name,
+        "laboratory_name": operator_availability.laboratory.name,
+        "operator_name": operator_availability.operator.name
+    }
+
+#funzione per serializzare gli slot in formato compatto: le disponibilità sono inviate una sola volta
+#e ciascuno slot diventa [indice disponibilità, giorni da base_date, minuto di inizio, minuto di fine]
+def slots_to_compact(slots, base_date):
+    availabilities = []
+    availability_indexes = {}
+    rows = []
+    for slot in slots:
+        operator_availability = slot.operator_availability
+        availability_index = availability_indexes.get(operator_availability.availability_id)
+        if availability_index is None:
+            availability_index = availability_indexes[operator_availability.availability_id] = len(availabilities)
+            availabilities.append(availability_to_dict(operator_availability))
+        rows.append([
+            availability_index,
+            (slot.operator_availability_date - base_date).days,
+            slot.operator_availability_slot_start.hour * 60 + slot.operator_availability_slot_start.minute,
+            slot.operator_availability_slot_end.hour * 60 + slot.operator_availability_slot_end.minute
+        ])
+    return {"base_date": base_date.isoformat(), "availabilities": availabilities, "slots": rows}
+
+#funzione per generare in modo lazy gli slot prenotabili di una singola disponibilità, in ordine di data e ora di inizio
+def iter_operator_availability_slots(operator_availability, datetime_from_filter = None, datetime_to_filter = None, laboratory_closures_index = None, operator_absences_index = None, booked_slots_index = None):
+
+    logging.info(
+        "Processo availability_id=%s, dal %s al %s, weekday=%d",
+        operator_availability.availability_id,
+        operator_availability.available_from_date,
+        operator_availability.available_to_date,
+        operator_availability.available_weekday
+    )
+
+    # se datetime_from_filter è impostato filtra la disponibilià degli esami partendo da quella data (se maggiore)
+    if  isinstance(datetime_from_filter, datetime):
+        operator_availability_date = max(operator_availability.available_from_date, datetime_from_filter.date())
+    else:
+        operator_availability_date = operator_availability.available_from_date
+
+    # se datetime_to_filter è impostato filtra la disponibilità degli esami fino a quella data (se inferiore)
+    if  isinstance(datetime_to_filter, datetime):
+        operator_availability_maxdate = min(datetime_to_filter.date(), operator_availability.available_to_date)
+    else:
+        operator_availability_maxdate = operator_availability.available_from_date
+
+    # sposta operator_availability date al primo giorno della settimana indicato nella operator_availability
+    operator_availability_date += timedelta(days=((operator_availability.available_weekday - operator_availability_date.weekday()) % 7))
+    # gli orari degli slot sono gli stessi per ogni giorno: il ciclo sulle date applica solo i filtri al modello di giornata
+    template = availability_day_template(operator_availability)
+    filtered_past = filtered_closed = filtered_absent = filtered_booked = 0
+    try:
         # per ciascun giorno fino a fine disponibilià compresa 
         while operator_availability_date <= operator_availability_maxdate:
-            # imposta la partenza del primo slot sempre all'orario di partenza delle disponibiltà (necessario per generare gli slot in modo univoco)
-            operator_availability_slot_start = operator_availability.available_from_time
-            # per ciascun giorno crea gli slot in fino all'ora di di fine disponibilità
-            while operator_availability_slot_start < operator_availability.available_to_time:
-                # calcola la fine dello slot
-                operator_availability_slot_end = add_minutes_to_time(operator_availability_slot_start, operator_availability.slot_duration_minutes)
-                # se lo slot supera l'orario esci e passa alla settimana successiva
-                if operator_availability_slot_end > operator_availability.available_to_time:
-                   break
-                
-                # crea lo slot come oggetto dictonary
-                slot = {
-                    "operator_availability_id": operator_availability.availability_id,
-                    "exam_type_id": str(operator_availability.exam_type_id),
-                    "laboratory_id": str(operator_availability.laboratory_id),
-                    "operator_id": str(operator_availability.operator_id),
-                    "exam_type_name": operator_availability.exam_type.name,
-                    "laboratory_name": operator_availability.laboratory.name,
-                    "operator_name": operator_availability.operator.name,
-                    "operator_availability_date":  operator_availability_date.isoformat(),
-                    "operator_availability_slot_start": operator_availability_slot_start.isoformat(),
-                    "operator_availability_slot_end": operator_availability_slot_end.isoformat()
-                }
+            # datetime calcolati una volta per giorno: gli slot sono confrontati come scostamenti dalla mezzanotte
+            day_start = datetime.combine(operator_availability_date, time(0, 0))
+            day_end = day_start + timedelta(days=1)
+            past_offset = datetime_from_filter - day_start if datetime_from_filter != None else None
+            # chiusure e assenze vengono verificate per ogni slot solo nei giorni in cui un periodo si sovrappone alla giornata
+            lab_closed_today = laboratory_closures_index != None and period_overlaps(operator_availability.laboratory_id, day_start, day_end, laboratory_closures_index)
+            operator_absent_today = operator_absences_index != None and period_overlaps(operator_availability.operator_id, day_start, day_end, operator_absences_index)
 
-                # se lo slot è dopo l'orario del filtro e se è il laboratorio non è chiuso l'oepratore in ferie e lo slot non è già prenotato
-                if (
-                    ((datetime_from_filter == None) or (datetime.combine(operator_availability_date, operator_availability_slot_start) >= datetime_from_filter)) and
-                    ((laboratory_closures == None) or (not lab_is_closed(operator_availability.laboratory_id, operator_availability_date, operator_availability_slot_start, operator_availability_slot_end, laboratory_closures))) and 
-                    ((operator_absences == None) or (not operator_is_absent(operator_availability.operator_id, operator_availability_date ,operator_availability_slot_start, operator_availability_slot_end, operator_absences))) and 
-                    ((booked_slots == None) or (not slot_is_booked(operator_availability.availability_id, operator_availability_date, operator_availability_slot_start, operator_availability_slot_end, booked_slots)))):
+            for operator_availability_slot_start, operator_availability_slot_end, slot_start_iso, slot_end_iso, start_offset, end_offset in template:
 
-                    # aggiungi lo slot all'array
-                    operators_availability_slots.append(slot)
+                # se lo slot è dopo l'orario del filtro e se è il laboratorio non è chiuso l'oepratore in ferie e lo slot non è già prenotato
+                # gli slot esclusi sono contati per il primo motivo di esclusione
+                if (past_offset != None) and (start_offset < past_offset):
+                    filtered_past += 1
+                elif lab_closed_today and period_overlaps(operator_availability.laboratory_id, day_start + start_offset, day_start + end_offset, laboratory_closures_index):
+                    filtered_closed += 1
+                elif operator_absent_today and period_overlaps(operator_availability.operator_id, day_start + start_offset, day_start + end_offset, operator_absences_index):
+                    filtered_absent += 1
+                elif (booked_slots_index != None) and slot_is_booked(operator_availability.availability_id, operator_availability_date, operator_availability_slot_start, operator_availability_slot_end, booked_slots_index):
+                    filtered_booked += 1
+                else:
+                    # crea lo slot
+                    yield Slot(operator_availability, operator_availability_date, operator_availability_slot_start, operator_availability_slot_end, slot_start_iso, slot_end_iso)
 
-                #passa allo slot successivo
-                operator_availability_slot_start = add_minutes_to_time(operator_availability_slot_end, operator_availability.pause_minutes)
             # passa alla settimana successiva
             operator_availability_date += timedelta(days=7)
+    finally:
+        # contati anche se il generatore viene chiuso prima della fine (paginazione, /slots_availability/next)
+        count_filtered_slots(filtered_past, filtered_closed, filtered_absent, filtered_booked)
+
+#funzione per generare in modo lazy gli slot prenotabili a partire dalle disponibilità degli operatori datetime_from_filter viene utilizzato come parametro nella route per non fornire date nel passato
+#gli slot delle diverse disponibilità vengono fusi in ordine di (data, ora di inizio, availability_id) senza materializzare la lista completa
+def iter_availabile_slots(operators_availability, datetime_from_filter = None, datetime_to_filter = None, laboratory_closures = None, operator_absences = None, booked_slots = None):
 
-    return operators_availability_slots
\ No newline at end of file
+    # indicizza prenotazioni, chiusure e assenze una sola volta per richiesta invece di scorrerle per ogni slot
+    booked_slots_index = index_booked_slots(booked_slots) if booked_slots != None else None
+    laboratory_closures_index = index_periods(laboratory_closures, "laboratory_id") if laboratory_closures != None else None
+    operator_absences_index = index_periods(operator_absences, "operator_id") if operator_absences != None else None
+
+    return heapq.merge(
+        *(
+            iter_operator_availability_slots(
+                operator_availability,
+                datetime_from_filter,
+                datetime_to_filter,
+                laboratory_closures_index,
+                operator_absences_index,
+                booked_slots_index
+            )
+            for operator_availability in operators_availability
+        ),
+        key=slot_sort_key
+    )
+
+#funzione per generare la lista completa degli slot prenotabili, ordinata per data e ora di inizio
+def generate_availabile_slots(operators_availability, datetime_from_filter = None, datetime_to_filter = None, laboratory_closures = None, operator_absences = None, booked_slots = None):
+    return list(iter_availabile_slots(operators_availability, datetime_from_filter, datetime_to_filter, laboratory_closures, operator_absences, booked_slots))
@@ -0,0 +1,163 @@
+from datetime import date, datetime, time, timedelta
+import heapq
+import logging
+from metrics import count_filtered_slots
+from operators_availability import Slot, iter_operator_availability_slots, index_booked_slots, index_periods, slot_sort_key
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NUMPY_AVAILABLE = np is not None
+
+# Motore alternativo di generazione degli slot basato su numpy
+# gli slot di una disponibilità vengono calcolati come array di minuti interi (giorni x slot del giorno)
+# chiusure, assenze e prenotazioni sono applicate come maschere vettoriali, gli slot vengono creati solo per le posizioni restituite
+
+MICROSECONDS_PER_MINUTE = 60 * 1000000
+MICROSECONDS_PER_DAY = 24 * 60 * MICROSECONDS_PER_MINUTE
+
+#funzione per convertire un datetime in microsecondi assoluti (a partire dall'ordinale del giorno)
+def datetime_to_microseconds(value):
+    return (
+        value.toordinal() * MICROSECONDS_PER_DAY
+        + ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000
+        + value.microsecond
+    )
+
+#funzione che restituisce i minuti dalla mezzanotte di un orario
+def time_to_minutes(value):
+    return value.hour * 60 + value.minute
+
+#funzione per convertire l'indice dei periodi (liste di datetime) in array di microsecondi per la ricerca con searchsorted
+def periods_index_to_arrays(periods_index):
+    return {
+        key: (
+            np.array([datetime_to_microseconds(start) for start in starts], dtype=np.int64),
+            np.array([datetime_to_microseconds(end) for end in ends], dtype=np.int64)
+        )
+        for key, (starts, ends) in periods_index.items()
+    }
+
+#funzione per raggruppare gli slot prenotati per disponibilità come array ordinati di microsecondi di inizio
+def booked_slots_to_arrays(booked_slots_index):
+    grouped_booked_slots = {}
+    for availability_id, appointment_date, appointment_time_start in booked_slots_index:
+        grouped_booked_slots.setdefault(availability_id, []).append(
+            datetime_to_microseconds(datetime.combine(appointment_date, appointment_time_start))
+        )
+    return {availability_id: np.sort(np.array(starts, dtype=np.int64)) for availability_id, starts in grouped_booked_slots.items()}
+
+#funzione che restituisce la maschera degli slot che si sovrappongono ad uno dei periodi (intervalli già uniti e ordinati)
+def periods_overlap_mask(slot_starts, slot_ends, periods_arrays):
+    period_starts, period_ends = periods_arrays
+    # ultimo periodo che inizia prima della fine di ciascuno slot
+    positions = np.searchsorted(period_starts, slot_ends, side="left") - 1
+    return (positions >= 0) & (period_ends[np.maximum(positions, 0)] > slot_starts)
+
+#funzione che verifica se gli orari di una disponibilità sono esprimibili in minuti interi
+def has_minute_resolution(operator_availability):
+    return all(
+        value.second == 0 and value.microsecond == 0
+        for value in (operator_availability.available_from_time, operator_availability.available_to_time)
+    )
+
+#funzione per generare con numpy gli slot prenotabili di una singola disponibilità, in ordine di data e ora di inizio
+def iter_operator_availability_slots_numpy(operator_availability, datetime_from_filter = None, datetime_to_filter = None, laboratory_closures_arrays = None, operator_absences_arrays = None, booked_slots_arrays = None):
+
+    # stesso calcolo dell'intervallo di date del motore python
+    if isinstance(datetime_from_filter, datetime):
+        first_date = max(operator_availability.available_from_date, datetime_from_filter.date())
+    else:
+        first_date = operator_availability.available_from_date
+
+    if isinstance(datetime_to_filter, datetime):
+        last_date = min(datetime_to_filter.date(), operator_availability.available_to_date)
+    else:
+        last_date = operator_availability.available_from_date
+
+    first_date += timedelta(days=((operator_availability.available_weekday - first_date.weekday()) % 7))
+    if first_date > last_date:
+        return
+
+    # inizio degli slot del giorno in minuti: il passo è durata + pausa, lo slot deve terminare entro l'orario di fine
+    from_minutes = time_to_minutes(operator_availability.available_from_time)
+    to_minutes = time_to_minutes(operator_availability.available_to_time)
+    duration = operator_availability.slot_duration_minutes
+    day_starts = np.arange(from_minutes, to_minutes - duration + 1, duration + operator_availability.pause_minutes, dtype=np.int64)
+    if day_starts.size == 0:
+        return
+
+    # giorni della disponibilità come ordinali, uno a settimana
+    day_ordinals = np.arange(first_date.toordinal(), last_date.toordinal() + 1, 7, dtype=np.int64)
+
+    # matrice giorni x slot di inizio e fine in microsecondi assoluti, appiattita in ordine di data e ora
+    slot_starts = (day_ordinals[:, None] * MICROSECONDS_PER_DAY + day_starts[None, :] * MICROSECONDS_PER_MINUTE).ravel()
+    slot_ends = slot_starts + duration * MICROSECONDS_PER_MINUTE
+
+    # gli slot esclusi da ciascuna maschera sono contati per il primo motivo di esclusione come nel motore python
+    mask = np.ones(slot_starts.size, dtype=bool)
+    filtered = {"past": 0, "closed": 0, "absent": 0, "booked": 0}
+    remaining = slot_starts.size
+    def exclude(reason, excluded):
+        nonlocal remaining
+        mask[...] &= ~excluded
+        kept = int(np.count_nonzero(mask))
+        filtered[reason] = remaining - kept
+        remaining = kept
+
+    if isinstance(datetime_from_filter, datetime):
+        exclude("past", slot_starts < datetime_to_microseconds(datetime_from_filter))
+    if laboratory_closures_arrays and operator_availability.laboratory_id in laboratory_closures_arrays:
+        exclude("closed", periods_overlap_mask(slot_starts, slot_ends, laboratory_closures_arrays[operator_availability.laboratory_id]))
+    if operator_absences_arrays and operator_availability.operator_id in operator_absences_arrays:
+        exclude("absent", periods_overlap_mask(slot_starts, slot_ends, operator_absences_arrays[operator_availability.operator_id]))
+    if booked_slots_arrays and operator_availability.availability_id in booked_slots_arrays:
+        exclude("booked", np.isin(slot_starts, booked_slots_arrays[operator_availability.availability_id], assume_unique=False))
+    count_filtered_slots(**filtered)
+
+    # da qui in poi vengono creati gli slot, solo per le posizioni rimaste
+    start_times = [time(minutes // 60, minutes % 60) for minutes in day_starts.tolist()]
+    end_times = [time((minutes + duration) // 60, (minutes + duration) % 60) for minutes in day_starts.tolist()]
+    dates = {}
+    slots_per_day = day_starts.size
+
+    for position in np.flatnonzero(mask).tolist():
+        day_index, slot_index = divmod(position, slots_per_day)
+        slot_date = dates.get(day_index)
+        if slot_date is None:
+            slot_date = dates[day_index] = date.fromordinal(int(day_ordinals[day_index]))
+        yield Slot(operator_availability, slot_date, start_times[slot_index], end_times[slot_index])
+
+#funzione per generare in modo lazy gli slot prenotabili con numpy, stessi parametri e stesso risultato di iter_availabile_slots
+def iter_availabile_slots_numpy(operators_availability, datetime_from_filter = None, datetime_to_filter = None, laboratory_closures = None, operator_absences = None, booked_slots = None):
+
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError("numpy non installato: motore di generazione slot non disponibile")
+
+    booked_slots_index = index_booked_slots(booked_slots) if booked_slots != None else None
+    laboratory_closures_index = index_periods(laboratory_closures, "laboratory_id") if laboratory_closures != None else None
+    operator_absences_index = index_periods(operator_absences, "operator_id") if operator_absences != None else None
+
+    laboratory_closures_arrays = periods_index_to_arrays(laboratory_closures_index) if laboratory_closures_index != None else None
+    operator_absences_arrays = periods_index_to_arrays(operator_absences_index) if operator_absences_index != None else None
+    booked_slots_arrays = booked_slots_to_arrays(booked_slots_index) if booked_slots_index != None else None
+
+    def iter_operator_availability(operator_availability):
+        # gli orari con secondi non sono rappresentabili in minuti interi: usa il motore python per quella disponibilità
+        if not has_minute_resolution(operator_availability):
+            logging.info("availability_id=%s con orari non al minuto, uso il motore python", operator_availability.availability_id)
+            return iter_operator_availability_slots(
+                operator_availability, datetime_from_filter, datetime_to_filter,
+                laboratory_closures_index, operator_absences_index, booked_slots_index
+            )
+        return iter_operator_availability_slots_numpy(
+            operator_availability, datetime_from_filter, datetime_to_filter,
+            laboratory_closures_arrays, operator_absences_arrays, booked_slots_arrays
+        )
+
+    return heapq.merge(
+        *(iter_operator_availability(operator_availability) for operator_availability in operators_availability),
+        key=slot_sort_key
+    )
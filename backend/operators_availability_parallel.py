@@ -0,0 +1,194 @@
+import os
+import heapq
+import logging
+import multiprocessing
+import threading
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, time, timedelta
+from dotenv import load_dotenv
+from operators_availability import Slot, iter_availabile_slots, iter_operator_availability_slots, index_booked_slots, index_periods, slot_sort_key
+from metrics import increment, pop_counters
+
+# Motore di generazione degli slot parallelo, per le finestre ampie senza filtri (viste amministrative e call center)
+# la finestra viene divisa in intervalli di SLOTS_PARALLEL_CHUNK_DAYS giorni generati da un pool di processi:
+# ogni intervallo restituisce i propri slot già ordinati, quindi concatenando i risultati nell'ordine degli intervalli
+# si ottiene lo stesso ordinamento di iter_availabile_slots senza fondere i risultati nel processo principale
+# ai processi vengono inviati solo record semplici delle disponibilità e gli indici di prenotazioni, chiusure e assenze
+# limitati all'intervallo: ogni periodo e ogni prenotazione viene serializzato solo per gli intervalli che interessa
+# (gli indici cambiano ad ogni richiesta, non possono essere passati una volta sola all'avvio dei processi del pool)
+# i processi restituiscono anche gli slot esclusi per motivo, sommati alle metriche del worker
+# sotto la soglia SLOTS_PARALLEL_MIN_SLOTS (stima degli slot da esaminare) o con un solo processo gli slot sono generati in locale
+#
+# SLOTS_PARALLEL_WORKERS è il numero di processi del pool di ciascun worker del server: il default è basso e fisso
+# perché i pool dei diversi worker si sommano, vedi il dimensionamento in gunicorn.conf.py
+
+load_dotenv()
+
+SLOTS_PARALLEL_WORKERS = int(os.getenv("SLOTS_PARALLEL_WORKERS", "2"))
+SLOTS_PARALLEL_CHUNK_DAYS = int(os.getenv("SLOTS_PARALLEL_CHUNK_DAYS", "28"))
+SLOTS_PARALLEL_MIN_SLOTS = int(os.getenv("SLOTS_PARALLEL_MIN_SLOTS", "50000"))
+
+# campi della disponibilità usati dalla generazione degli slot
+AvailabilityRecord = namedtuple("AvailabilityRecord", (
+    "availability_id",
+    "laboratory_id",
+    "operator_id",
+    "available_from_date",
+    "available_to_date",
+    "available_from_time",
+    "available_to_time",
+    "available_weekday",
+    "slot_duration_minutes",
+    "pause_minutes"
+))
+
+# pool di processi creato alla prima richiesta che lo utilizza e condiviso tra le richieste del worker
+executors = []
+executors_lock = threading.Lock()
+
+#funzione eseguita all'avvio di ciascun processo del pool: i log per disponibilità sono già registrati dal processo principale
+def init_pool_process():
+    logging.disable(logging.INFO)
+
+#funzione che restituisce il pool di processi, creandolo se necessario
+#i processi sono avviati con spawn: un fork del worker copierebbe thread e connessioni al database
+def get_executor():
+    with executors_lock:
+        if not executors:
+            executors.append(ProcessPoolExecutor(
+                max_workers=SLOTS_PARALLEL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_pool_process
+            ))
+        return executors[0]
+
+#funzione per scartare un pool non più utilizzabile (processo terminato in modo anomalo), verrà ricreato alla richiesta successiva
+def discard_executor(executor):
+    with executors_lock:
+        if executors and executors[0] is executor:
+            executors.clear()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+#funzione per creare il record semplice di una disponibilità
+def availability_record(operator_availability):
+    return AvailabilityRecord(*(getattr(operator_availability, field) for field in AvailabilityRecord._fields))
+
+#funzione che stima il numero di slot da esaminare nella finestra (giorni della disponibilità x slot per giorno)
+def estimate_slots(operators_availability, datetime_from_filter, datetime_to_filter):
+    estimate = 0
+    for operator_availability in operators_availability:
+        days = (min(datetime_to_filter.date(), operator_availability.available_to_date) - max(datetime_from_filter.date(), operator_availability.available_from_date)).days
+        step = operator_availability.slot_duration_minutes + operator_availability.pause_minutes
+        if days < 0 or step <= 0:
+            continue
+        from_time, to_time = operator_availability.available_from_time, operator_availability.available_to_time
+        day_minutes = (to_time.hour * 60 + to_time.minute) - (from_time.hour * 60 + from_time.minute)
+        estimate += (days // 7 + 1) * max(0, (day_minutes - operator_availability.slot_duration_minutes) // step + 1)
+    return estimate
+
+#funzione che restituisce la parte di un indice dei periodi (index_periods) che si sovrappone all'intervallo [from, to)
+def slice_periods_index(periods_index, datetime_from, datetime_to):
+    sliced_index = {}
+    for key, (starts, ends) in periods_index.items():
+        # i periodi uniti sono disgiunti e ordinati: quelli che terminano dopo l'inizio e iniziano prima della fine
+        first, last = bisect_right(ends, datetime_from), bisect_left(starts, datetime_to)
+        if first < last:
+            sliced_index[key] = (starts[first:last], ends[first:last])
+    return sliced_index
+
+#funzione eseguita nei processi del pool: genera gli slot di un intervallo di date
+#records sono le coppie (posizione della disponibilità, record), il risultato è la lista ordinata di (posizione, data, inizio, fine)
+#con i contatori degli slot esclusi registrati nel processo durante la generazione
+def generate_chunk_slots(task):
+    records, datetime_from, datetime_to, laboratory_closures_index, operator_absences_index, booked_slots_index = task
+
+    def iter_record_slots(position, record):
+        for slot in iter_operator_availability_slots(record, datetime_from, datetime_to, laboratory_closures_index, operator_absences_index, booked_slots_index):
+            yield position, slot
+
+    chunk_slots = heapq.merge(
+        *(iter_record_slots(position, record) for position, record in records),
+        key=lambda item: slot_sort_key(item[1])
+    )
+    slots = [
+        (position, slot.operator_availability_date, slot.operator_availability_slot_start, slot.operator_availability_slot_end)
+        for position, slot in chunk_slots
+    ]
+    return slots, pop_counters("slots_filtered_total")
+
+#funzione che restituisce gli intervalli di date (primo giorno, ultimo giorno) in cui viene divisa la finestra
+def chunk_date_ranges(first_date, last_date):
+    ranges = []
+    while first_date <= last_date:
+        chunk_last_date = min(first_date + timedelta(days=SLOTS_PARALLEL_CHUNK_DAYS - 1), last_date)
+        ranges.append((first_date, chunk_last_date))
+        first_date = chunk_last_date + timedelta(days=1)
+    return ranges
+
+#funzione per ricostruire gli Slot dai risultati degli intervalli, nell'ordine degli intervalli
+def iter_chunk_results(executor, results, operators_availability):
+    try:
+        for chunk_slots, filtered_counters in results:
+            for labels, value in filtered_counters:
+                increment("slots_filtered_total", labels, value)
+            for position, slot_date, slot_start, slot_end in chunk_slots:
+                yield Slot(operators_availability[position], slot_date, slot_start, slot_end)
+    except BrokenProcessPool:
+        discard_executor(executor)
+        raise
+
+#funzione per generare in modo lazy gli slot prenotabili con il pool di processi, stessi parametri e stesso risultato di iter_availabile_slots
+def iter_availabile_slots_parallel(operators_availability, datetime_from_filter = None, datetime_to_filter = None, laboratory_closures = None, operator_absences = None, booked_slots = None):
+
+    # senza una finestra completa il motore python considera solo il primo giorno: non serve il pool
+    if (
+        SLOTS_PARALLEL_WORKERS <= 1
+        or not isinstance(datetime_from_filter, datetime)
+        or not isinstance(datetime_to_filter, datetime)
+        or datetime_from_filter.date() > datetime_to_filter.date()
+        or estimate_slots(operators_availability, datetime_from_filter, datetime_to_filter) < SLOTS_PARALLEL_MIN_SLOTS
+    ):
+        return iter_availabile_slots(operators_availability, datetime_from_filter, datetime_to_filter, laboratory_closures, operator_absences, booked_slots)
+
+    operators_availability = list(operators_availability)
+    laboratory_closures_index = index_periods(laboratory_closures, "laboratory_id") if laboratory_closures != None else None
+    operator_absences_index = index_periods(operator_absences, "operator_id") if operator_absences != None else None
+
+    # le prenotazioni sono suddivise per intervallo, in modo da inviare a ciascun processo solo quelle che gli servono
+    date_ranges = chunk_date_ranges(datetime_from_filter.date(), datetime_to_filter.date())
+    booked_slots_by_chunk = [[] for _ in date_ranges]
+    for booked_slot in booked_slots or ():
+        chunk = (booked_slot.appointment_date - date_ranges[0][0]).days // SLOTS_PARALLEL_CHUNK_DAYS
+        if 0 <= chunk < len(date_ranges):
+            booked_slots_by_chunk[chunk].append(booked_slot)
+
+    records = [(position, availability_record(operator_availability)) for position, operator_availability in enumerate(operators_availability)]
+    tasks = []
+    for chunk, (first_date, last_date) in enumerate(date_ranges):
+        chunk_records = [
+            (position, record) for position, record in records
+            if record.available_from_date <= last_date and record.available_to_date >= first_date
+        ]
+        if not chunk_records:
+            continue
+        chunk_start, chunk_end = datetime.combine(first_date, time(0, 0)), datetime.combine(last_date + timedelta(days=1), time(0, 0))
+        tasks.append((
+            chunk_records,
+            # il filtro di inizio con l'orario vale solo per il primo intervallo, la data di fine è compresa nell'intervallo
+            datetime_from_filter if chunk == 0 else chunk_start,
+            datetime.combine(last_date, time(0, 0)),
+            slice_periods_index(laboratory_closures_index, chunk_start, chunk_end) if laboratory_closures_index != None else None,
+            slice_periods_index(operator_absences_index, chunk_start, chunk_end) if operator_absences_index != None else None,
+            index_booked_slots(booked_slots_by_chunk[chunk]) if booked_slots != None else None
+        ))
+
+    executor = get_executor()
+    try:
+        results = executor.map(generate_chunk_slots, tasks)
+    except BrokenProcessPool:
+        discard_executor(executor)
+        raise
+    return iter_chunk_results(executor, results, operators_availability)
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, exists, cast, func, literal, true, tuple_, Date, DateTime, Integer, Time, Interval
+from database import OperatorsAvailability, LaboratoryClosure, OperatorAbsence, SlotBooking
+from operators_availability import Slot
+
+# Motore di generazione degli slot eseguito da postgres
+# i giorni e gli slot di ciascuna disponibilità vengono espansi con generate_series, le prenotazioni sono escluse
+# con una anti-join e chiusure/assenze con un predicato di sovrapposizione degli intervalli
+# il database restituisce solo gli slot liberi, già ordinati per (data, ora di inizio, availability_id) e paginati
+# il risultato coincide con generate_availabile_slots, che resta l'implementazione di riferimento
+
+# righe lette per volta dal cursore lato server
+SLOTS_SQL_FETCH_SIZE = 1000
+
+ONE_MINUTE = literal(timedelta(minutes=1), Interval)
+
+#funzione che costruisce la query degli slot liberi con gli stessi filtri di query_availability
+#after è la chiave (data, ora di inizio, availability_id) dell'ultimo slot già restituito, limit il numero massimo di slot
+def availabile_slots_query(datetime_from_filter = None, datetime_to_filter = None, exam_type_id = None, operator_id = None, laboratory_id = None, after = None, limit = None):
+
+    # gli slot precedenti al cursore non vengono espansi
+    if after:
+        after_datetime = datetime.combine(after[0], after[1])
+        datetime_from_filter = max(datetime_from_filter, after_datetime) if isinstance(datetime_from_filter, datetime) else after_datetime
+
+    # stesso intervallo di date del motore python: in assenza del filtro di fine viene considerata solo la data di inizio
+    if isinstance(datetime_from_filter, datetime):
+        first_date = func.greatest(OperatorsAvailability.available_from_date, literal(datetime_from_filter.date(), Date), type_=Date)
+    else:
+        first_date = OperatorsAvailability.available_from_date
+    if isinstance(datetime_to_filter, datetime):
+        last_date = func.least(literal(datetime_to_filter.date(), Date), OperatorsAvailability.available_to_date, type_=Date)
+    else:
+        last_date = OperatorsAvailability.available_from_date
+
+    # sposta la data di inizio al primo giorno della settimana della disponibilità (isodow: lunedì = 1, weekday python: lunedì = 0)
+    weekday_offset = (OperatorsAvailability.available_weekday - cast(func.extract("isodow", first_date), Integer) + 8) % 7
+    first_day = cast(first_date + weekday_offset, DateTime)
+
+    # un giorno per settimana fino alla data di fine compresa
+    days = func.generate_series(first_day, cast(last_date, DateTime), literal(timedelta(days=7), Interval)).table_valued("day").render_derived().lateral("days")
+
+    # indici degli slot del giorno: il passo è durata + pausa, l'ultimo slot deve terminare entro l'orario di fine
+    step = func.nullif(OperatorsAvailability.slot_duration_minutes + OperatorsAvailability.pause_minutes, 0)
+    day_minutes = func.extract("epoch", OperatorsAvailability.available_to_time - OperatorsAvailability.available_from_time) / 60
+    last_slot_index = cast(func.floor((day_minutes - OperatorsAvailability.slot_duration_minutes) / step), Integer)
+    slot_indexes = func.generate_series(0, last_slot_index).table_valued("slot_index").render_derived().lateral("slot_indexes")
+
+    slot_start_datetime = days.c.day + cast(OperatorsAvailability.available_from_time, Interval) + ONE_MINUTE * (slot_indexes.c.slot_index * step)
+    slot_end_datetime = slot_start_datetime + ONE_MINUTE * OperatorsAvailability.slot_duration_minutes
+
+    # espansione di tutti gli slot delle disponibilità filtrate, prima dell'esclusione di prenotazioni, chiusure e assenze
+    expanded_query = (
+        select(
+            OperatorsAvailability.availability_id,
+            OperatorsAvailability.laboratory_id,
+            OperatorsAvailability.operator_id,
+            cast(days.c.day, Date).label("slot_date"),
+            cast(slot_start_datetime, Time).label("slot_start"),
+            cast(slot_end_datetime, Time).label("slot_end"),
+            slot_start_datetime.label("slot_start_datetime"),
+            slot_end_datetime.label("slot_end_datetime")
+        )
+        .select_from(OperatorsAvailability)
+        .join(days, true())
+        .join(slot_indexes, true())
+        .where(OperatorsAvailability.enabled == True)
+    )
+
+    if isinstance(datetime_from_filter, datetime):
+        expanded_query = expanded_query.where(OperatorsAvailability.available_to_date >= datetime_from_filter.date())
+        expanded_query = expanded_query.where(slot_start_datetime >= datetime_from_filter)
+    if exam_type_id:
+        expanded_query = expanded_query.where(OperatorsAvailability.exam_type_id == exam_type_id)
+    if operator_id:
+        expanded_query = expanded_query.where(OperatorsAvailability.operator_id == operator_id)
+    if laboratory_id:
+        expanded_query = expanded_query.where(OperatorsAvailability.laboratory_id == laboratory_id)
+
+    slots = expanded_query.subquery("slots")
+
+    # periodi con fine precedente all'inizio (non validi, scritti prima del vincolo sulla tabella) ignorati come in index_periods
+    laboratory_closed = exists().where(
+        LaboratoryClosure.laboratory_id == slots.c.laboratory_id,
+        LaboratoryClosure.start_datetime < slots.c.slot_end_datetime,
+        LaboratoryClosure.end_datetime > slots.c.slot_start_datetime,
+        LaboratoryClosure.end_datetime >= LaboratoryClosure.start_datetime
+    )
+    operator_absent = exists().where(
+        OperatorAbsence.operator_id == slots.c.operator_id,
+        OperatorAbsence.start_datetime < slots.c.slot_end_datetime,
+        OperatorAbsence.end_datetime > slots.c.slot_start_datetime,
+        OperatorAbsence.end_datetime >= OperatorAbsence.start_datetime
+    )
+    # anti-join con le prenotazioni attive
+    slot_booked = exists().where(
+        SlotBooking.availability_id == slots.c.availability_id,
+        SlotBooking.appointment_date == slots.c.slot_date,
+        SlotBooking.appointment_time_start == slots.c.slot_start,
+        SlotBooking.rejected == False
+    )
+
+    slots_query = (
+        select(slots.c.availability_id, slots.c.slot_date, slots.c.slot_start, slots.c.slot_end)
+        .where(~laboratory_closed)
+        .where(~operator_absent)
+        .where(~slot_booked)
+        .order_by(slots.c.slot_date, slots.c.slot_start, slots.c.availability_id)
+    )
+
+    if after:
+        slots_query = slots_query.where(tuple_(slots.c.slot_date, slots.c.slot_start, slots.c.availability_id) > tuple_(*after))
+    if limit:
+        slots_query = slots_query.limit(limit)
+
+    return slots_query
+
+#funzione per generare in modo lazy gli slot liberi calcolati dal database
+#operators_availability sono le disponibilità caricate con i filtri della richiesta, usate per creare gli Slot senza ulteriori query
+def iter_availabile_slots_sql(session, operators_availability, filters, after = None, limit = None):
+
+    availability_by_id = {operator_availability.availability_id: operator_availability for operator_availability in operators_availability}
+
+    rows = session.execute(
+        availabile_slots_query(**filters, after=after, limit=limit).execution_options(yield_per=SLOTS_SQL_FETCH_SIZE)
+    )
+    for availability_id, slot_date, slot_start, slot_end in rows:
+        operator_availability = availability_by_id.get(availability_id)
+        # disponibilità creata dopo il caricamento della lista: verrà restituita dalla richiesta successiva
+        if operator_availability is None:
+            continue
+        yield Slot(operator_availability, slot_date, slot_start, slot_end)
@@ -0,0 +1,56 @@
+import os
+import logging
+import threading
+from dotenv import load_dotenv
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Calcolo degli hash delle password con concorrenza limitata
+# gli hash sono operazioni CPU-bound: limitarne la concorrenza evita che un picco di login rallenti tutte le altre route del worker
+# l'hash viene calcolato nel thread della richiesta, che dovrebbe comunque attenderne il risultato: un semaforo per worker
+# limita i calcoli contemporanei senza il passaggio a un pool di thread (scrypt e pbkdf2 di hashlib rilasciano il GIL)
+# se non si libera un posto entro PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS viene sollevata PasswordHashingBusy (503)
+
+load_dotenv()
+
+# metodo werkzeug per i nuovi hash, es. "scrypt" oppure "pbkdf2:sha256:600000"
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+# numero massimo di hash calcolati contemporaneamente per worker
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# attesa massima di un posto libero nel pool
+PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS", "2"))
+
+class PasswordHashingBusy(Exception):
+    pass
+
+password_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS)
+
+#funzione per eseguire un calcolo di hash, attendendo al massimo queue_timeout secondi un posto libero
+def run_hashing(function, *args, queue_timeout = PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS):
+    if not password_hash_slots.acquire(timeout=queue_timeout):
+        logging.warning("Hashing delle password saturo")
+        raise PasswordHashingBusy()
+    try:
+        return function(*args)
+    finally:
+        password_hash_slots.release()
+
+#funzione per calcolare l'hash di una nuova password con il metodo configurato
+def hash_password(password, queue_timeout = PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS):
+    return run_hashing(generate_password_hash, password, PASSWORD_HASH_METHOD, queue_timeout=queue_timeout)
+
+#funzione per verificare una password rispetto all'hash salvato
+def verify_password(password_hash, password):
+    return run_hashing(check_password_hash, password_hash, password)
+
+# parametri del metodo configurato come compaiono negli hash werkzeug (la parte prima del primo $), calcolati al primo uso
+current_method_parameters = []
+
+#funzione che restituisce i parametri del metodo configurato, l'hash di riferimento è calcolato con lo stesso limite di concorrenza degli altri
+def method_parameters():
+    if not current_method_parameters:
+        current_method_parameters.append(hash_password("").split("$", 1)[0])
+    return current_method_parameters[0]
+
+#funzione che verifica se un hash è stato calcolato con parametri diversi da quelli configurati e va quindi ricalcolato
+def needs_rehash(password_hash):
+    return password_hash.split("$", 1)[0] != method_parameters()
@@ -0,0 +1,174 @@
+import os
+import logging
+import threading
+import time as clock
+from datetime import datetime, time, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import select, delete, update, func, cast, or_, BigInteger, Text
+from sqlalchemy.orm import Session
+from database import get_engine, SlotChange, SlotChangesCompaction
+
+# Registro delle modifiche agli slot per gli aggiornamenti incrementali dei client (/slots_availability/changes)
+# le righe sono scritte dai trigger su prenotazioni, disponibilità, chiusure e assenze (database.upgrade_schema),
+# quindi anche dall'import massivo e dalle modifiche eseguite direttamente sul database
+# un client legge la versione corrente (since omesso), scarica gli slot e poi chiede le modifiche successive a quella versione:
+# le modifiche già comprese nella lista scaricata vengono riapplicate senza effetti (slot già occupato o già libero)
+# le righe più vecchie di SLOT_CHANGES_RETENTION_HOURS vengono compattate: chi chiede una versione rimossa deve riscaricare gli slot
+# la versione è un identificativo di transazione: la versione corrente V è lo xmin dell'istantanea del database
+# (tutte le transazioni precedenti sono concluse) e le modifiche successive a since sono quelle con since <= txid < V,
+# restituite in ordine di transazione; le transazioni ancora in corso restano per la richiesta seguente senza lock tra chi scrive
+# una transazione lunga (anche estranea al registro) ritarda la consegna delle modifiche successive fino alla sua conclusione
+
+load_dotenv()
+
+SLOT_CHANGES_RETENTION_HOURS = float(os.getenv("SLOT_CHANGES_RETENTION_HOURS", "24"))
+# intervallo tra due compattazioni eseguite in background da ciascun worker, 0 per compattare solo con manage.py compact-changes
+SLOT_CHANGES_COMPACT_INTERVAL_SECONDS = int(os.getenv("SLOT_CHANGES_COMPACT_INTERVAL_SECONDS", "3600"))
+# valori di default e massimi per il numero di modifiche restituite in una risposta
+SLOT_CHANGES_DEFAULT_LIMIT = 1000
+SLOT_CHANGES_MAX_LIMIT = 10000
+
+# la versione richiesta non è più nel registro (compattata o successiva all'ultima registrata): serve una nuova lettura completa
+class SlotChangesResyncRequired(Exception):
+    def __init__(self, version):
+        super().__init__(f"Resync required, current version {version}")
+        self.version = version
+
+# filtri che comprendono tutte le modifiche (distribuzione degli eventi ai client, sincronizzazione della cache degli slot)
+SLOT_CHANGES_NO_FILTERS = dict.fromkeys(("exam_type_id", "laboratory_id", "operator_id", "datetime_from_filter", "datetime_to_filter"))
+
+# il thread di compattazione parte alla prima richiesta del worker
+compaction_started = threading.Event()
+compaction_lock = threading.Lock()
+
+#funzione che restituisce l'espressione della versione corrente: le transazioni con identificativo inferiore sono concluse
+def visible_txid_limit():
+    return cast(cast(func.pg_snapshot_xmin(func.pg_current_snapshot()), Text), BigInteger)
+
+#funzione che restituisce l'espressione dell'ultima transazione rimossa dalla compattazione
+def compacted_txid():
+    return select(func.coalesce(func.max(SlotChangesCompaction.compacted_txid), 0)).scalar_subquery()
+
+#funzione che restituisce l'espressione dell'ultima transazione visibile nel registro, usata come versione dei dati delle tabelle registrate
+#cambia solo quando diventa visibile una nuova modifica (e non con la compattazione), a differenza della versione corrente
+def last_visible_txid():
+    return func.coalesce(
+        select(func.max(SlotChange.txid)).where(SlotChange.txid < visible_txid_limit()).scalar_subquery(),
+        compacted_txid()
+    )
+
+#funzione che restituisce la versione corrente e l'ultima transazione rimossa dalla compattazione
+def query_versions_range(session):
+    return tuple(session.execute(select(visible_txid_limit(), compacted_txid())).one())
+
+#funzione che restituisce la versione corrente del registro
+def query_current_version(session):
+    return query_versions_range(session)[0]
+
+#funzione per caricare le modifiche successive a since che riguardano i filtri degli slot
+#restituisce (versione raggiunta, modifiche, altre modifiche da leggere), solleva SlotChangesResyncRequired se since non è nel registro
+def query_slot_changes(session, since, filters, limit = SLOT_CHANGES_DEFAULT_LIMIT):
+    current_version, compacted_version = query_versions_range(session)
+
+    # since successiva alla versione corrente (non restituita dal registro) o con modifiche successive già compattate
+    if since > current_version or since <= compacted_version:
+        raise SlotChangesResyncRequired(current_version)
+
+    # le transazioni precedenti a current_version sono concluse: le righe lette non cambiano nelle richieste successive
+    changes_query = (
+        select(SlotChange)
+        .where(SlotChange.txid >= since)
+        .where(SlotChange.txid < current_version)
+        .order_by(SlotChange.txid, SlotChange.change_id)
+        .limit(limit + 1)
+    )
+
+    # le modifiche senza il campo filtrato riguardano tutti i valori (es. una chiusura vale per ogni tipo di esame del laboratorio)
+    for field in ("exam_type_id", "laboratory_id", "operator_id"):
+        if filters[field]:
+            column = getattr(SlotChange, field)
+            changes_query = changes_query.where(or_(column == None, column == filters[field]))
+    if filters["datetime_from_filter"]:
+        changes_query = changes_query.where(SlotChange.end_datetime > filters["datetime_from_filter"])
+    if filters["datetime_to_filter"]:
+        # come per gli slot, la data di fine filtro è compresa
+        changes_query = changes_query.where(SlotChange.start_datetime < datetime.combine(filters["datetime_to_filter"].date() + timedelta(days=1), time(0, 0)))
+
+    changes = session.execute(changes_query).scalars().all()
+    has_more = len(changes) > limit
+    if has_more:
+        # le modifiche di una transazione sono restituite insieme: la pagina termina prima della transazione della prima modifica esclusa
+        # e la richiesta successiva riparte da quella transazione
+        next_version = changes[-1].txid
+        changes = [change for change in changes if change.txid < next_version]
+        # una sola transazione con più modifiche del limite (es. import massivo): conviene riscaricare gli slot
+        if not changes:
+            raise SlotChangesResyncRequired(current_version)
+        current_version = next_version
+    return current_version, changes, has_more
+
+#funzione che indica se una modifica riguarda i filtri degli slot, con gli stessi criteri di query_slot_changes
+def slot_change_matches(change, filters):
+    for field in ("exam_type_id", "laboratory_id", "operator_id"):
+        value = getattr(change, field)
+        if filters[field] and value is not None and value != filters[field]:
+            return False
+    if filters["datetime_from_filter"] and change.end_datetime <= filters["datetime_from_filter"]:
+        return False
+    if filters["datetime_to_filter"] and change.start_datetime >= datetime.combine(filters["datetime_to_filter"].date() + timedelta(days=1), time(0, 0)):
+        return False
+    return True
+
+#funzione che restituisce una modifica come dizionario
+def slot_change_to_dict(change):
+    return {
+        "version": change.txid,
+        "change_type": change.change_type,
+        "availability_id": str(change.availability_id) if change.availability_id else None,
+        "exam_type_id": str(change.exam_type_id) if change.exam_type_id else None,
+        "laboratory_id": str(change.laboratory_id) if change.laboratory_id else None,
+        "operator_id": str(change.operator_id) if change.operator_id else None,
+        "start_datetime": change.start_datetime.isoformat(),
+        "end_datetime": change.end_datetime.isoformat()
+    }
+
+#funzione per eliminare le modifiche più vecchie del periodo di conservazione
+#l'ultima transazione rimossa viene registrata in slot_changes_compaction: le versioni fino a quella transazione richiedono una nuova lettura completa
+def compact_slot_changes():
+    # l'istante di registrazione è scritto dal database: anche il limite viene calcolato sul database
+    cutoff = func.localtimestamp() - timedelta(hours=SLOT_CHANGES_RETENTION_HOURS)
+    # solo righe di transazioni concluse: una transazione in corso non può essere rimossa in parte
+    deleted = (
+        delete(SlotChange)
+        .where(SlotChange.changed_at < cutoff)
+        .where(SlotChange.txid < visible_txid_limit())
+        .returning(SlotChange.txid)
+        .cte("deleted")
+    )
+    with Session(get_engine()) as session:
+        deleted_count = session.execute(
+            update(SlotChangesCompaction)
+            .values(compacted_txid=func.greatest(SlotChangesCompaction.compacted_txid, select(func.max(deleted.c.txid)).scalar_subquery()))
+            .returning(select(func.count()).select_from(deleted).scalar_subquery())
+        ).scalar()
+        session.commit()
+    logging.info("Rimosse %s modifiche agli slot dal registro", deleted_count)
+
+#funzione eseguita dal thread di compattazione: fuori dalle richieste, un errore viene registrato e ritentato all'intervallo successivo
+def run_compaction():
+    while True:
+        clock.sleep(SLOT_CHANGES_COMPACT_INTERVAL_SECONDS)
+        try:
+            compact_slot_changes()
+        except Exception:
+            logging.exception("Errore nella compattazione del registro delle modifiche agli slot")
+
+#funzione per avviare il thread di compattazione, una sola volta per worker
+def start_compaction():
+    if compaction_started.is_set() or SLOT_CHANGES_COMPACT_INTERVAL_SECONDS <= 0:
+        return
+    with compaction_lock:
+        if compaction_started.is_set():
+            return
+        threading.Thread(target=run_compaction, name="slot-changes-compaction", daemon=True).start()
+        compaction_started.set()
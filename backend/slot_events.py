@@ -0,0 +1,245 @@
+import os
+import json
+import queue
+import logging
+import threading
+import time as clock
+import select as io_select
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+from database import get_engine
+from slot_changes import SLOT_CHANGES_MAX_LIMIT, SLOT_CHANGES_NO_FILTERS, SlotChangesResyncRequired, query_current_version, query_slot_changes, slot_change_matches, slot_change_to_dict
+
+try:
+    from gevent import monkey as gevent_monkey
+except ImportError:
+    gevent_monkey = None
+
+GEVENT_AVAILABLE = gevent_monkey is not None
+
+# Notifiche in tempo reale delle modifiche agli slot con Server-Sent Events (/slots_availability/events)
+# la sorgente degli eventi è il registro slot_changes: un solo thread per worker legge le nuove modifiche
+# e le distribuisce ai client collegati i cui filtri corrispondono, quindi il database viene letto una volta per modifica
+# e non una volta per client; il testo di ciascun evento viene creato una volta e condiviso tra le code dei client
+# il thread viene risvegliato da LISTEN/NOTIFY (backend postgres, i trigger del registro notificano al commit di qualsiasi processo)
+# oltre a una lettura ogni SLOT_EVENTS_POLL_SECONDS; gli eventi sono serviti da un processo separato dall'applicazione,
+# quindi con il backend local, senza LISTEN, le scritture arrivano ai client solo con la lettura periodica
+# ogni client ha una coda limitata: se si riempie (client lento) gli eventi persi vengono riletti dal registro
+# l'id di ciascun evento è la versione della modifica (la transazione che l'ha scritta): alla riconnessione il browser invia
+# Last-Event-ID e riceve le modifiche perse a partire da quella transazione, comprese quelle già ricevute della stessa transazione
+# ogni client resta in attesa sulla propria coda per tutta la connessione: gli eventi sono serviti dal server con worker gevent
+# (gunicorn_events.conf.py), dove ogni client è un greenlet; con worker a thread ciascun client occuperebbe un thread
+# del server per tutta la sessione, per questo la route risponde 503 se il processo non usa gevent (SLOT_EVENTS_REQUIRE_ASYNC)
+
+load_dotenv()
+
+# postgres: LISTEN/NOTIFY sul database principale, local: solo lettura periodica (ritardo fino a SLOT_EVENTS_POLL_SECONDS)
+SLOT_EVENTS_BACKEND = os.getenv("SLOT_EVENTS_BACKEND", "postgres")
+SLOT_EVENTS_POLL_SECONDS = float(os.getenv("SLOT_EVENTS_POLL_SECONDS", "5"))
+# intervallo dei commenti inviati ai client senza eventi, tiene aperte le connessioni attraverso proxy e bilanciatori
+SLOT_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("SLOT_EVENTS_HEARTBEAT_SECONDS", "15"))
+# eventi in attesa per client e client collegati per worker
+SLOT_EVENTS_QUEUE_SIZE = int(os.getenv("SLOT_EVENTS_QUEUE_SIZE", "256"))
+SLOT_EVENTS_MAX_SUBSCRIBERS = int(os.getenv("SLOT_EVENTS_MAX_SUBSCRIBERS", "1000"))
+# attesa suggerita al browser prima della riconnessione, in millisecondi
+SLOT_EVENTS_RETRY_MS = int(os.getenv("SLOT_EVENTS_RETRY_MS", "3000"))
+# eventi serviti solo dai worker gevent, False per lo sviluppo con il server di Flask o con worker a thread
+SLOT_EVENTS_REQUIRE_ASYNC = bool(os.getenv("SLOT_EVENTS_REQUIRE_ASYNC", "True") == "True")
+
+# client collegato: filtri degli slot, coda di (versione, testo dell'evento), coda piena dall'ultima lettura
+class Subscriber:
+    __slots__ = ("filters", "events", "overflowed")
+
+    def __init__(self, filters):
+        self.filters = filters
+        self.events = queue.Queue(SLOT_EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+subscribers = set()
+subscribers_lock = threading.Lock()
+
+# il thread di distribuzione parte al primo client collegato, dispatched_version è l'ultima versione distribuita
+dispatcher_started = threading.Event()
+dispatcher_lock = threading.Lock()
+dispatcher_wake = threading.Event()
+dispatched_version = [0]
+
+#funzione che indica se il processo può servire gli eventi: worker gevent (socket sostituiti da gevent) o requisito disattivato
+def events_available():
+    return not SLOT_EVENTS_REQUIRE_ASYNC or (GEVENT_AVAILABLE and gevent_monkey.is_module_patched("socket"))
+
+#funzione per creare il testo di un evento
+def format_event(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, separators=(',', ':'), sort_keys=True)}\n\n"
+
+#funzione per creare l'evento di una modifica, il tipo dell'evento è il tipo di modifica (booked, freed, ...)
+def change_event(change):
+    return format_event(change.txid, change.change_type, slot_change_to_dict(change))
+
+#funzione per registrare un client, restituisce None se il worker ha già il numero massimo di client
+def subscribe(filters):
+    start_dispatcher()
+    with subscribers_lock:
+        if len(subscribers) >= SLOT_EVENTS_MAX_SUBSCRIBERS:
+            return None
+        subscriber = Subscriber(filters)
+        subscribers.add(subscriber)
+    return subscriber
+
+#funzione per rimuovere un client, può essere chiamata più volte
+def unsubscribe(subscriber):
+    with subscribers_lock:
+        subscribers.discard(subscriber)
+
+#funzione per distribuire ai client le modifiche successive all'ultima versione distribuita
+def dispatch_changes():
+    try:
+        with Session(get_engine()) as session:
+            version, changes, has_more = query_slot_changes(session, dispatched_version[0], SLOT_CHANGES_NO_FILTERS, SLOT_CHANGES_MAX_LIMIT)
+    except SlotChangesResyncRequired as e:
+        # modifiche non più leggibili dal registro: i client le rileggono dall'ultima versione inviata e ricevono l'evento resync
+        with subscribers_lock:
+            for subscriber in subscribers:
+                subscriber.overflowed = True
+        dispatched_version[0] = e.version
+        return
+
+    # i client sono letti dopo le modifiche: un client registrato dopo la lettura le riceve dalla versione iniziale o da Last-Event-ID
+    with subscribers_lock:
+        targets = list(subscribers)
+
+    for change in changes:
+        event = None
+        for subscriber in targets:
+            if not slot_change_matches(change, subscriber.filters):
+                continue
+            if event is None:
+                event = (change.txid, change_event(change))
+            try:
+                subscriber.events.put_nowait(event)
+            except queue.Full:
+                subscriber.overflowed = True
+    dispatched_version[0] = version
+
+    # altre modifiche oltre la pagina letta: il ciclo successivo riparte senza attendere
+    if has_more:
+        dispatcher_wake.set()
+
+#funzione per aprire la connessione dedicata a LISTEN, esclusa dal pool in modo da non occupare una connessione delle richieste
+def open_listen_connection():
+    pooled_connection = get_engine().raw_connection()
+    connection = pooled_connection.driver_connection
+    pooled_connection.detach()
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("LISTEN slot_changes")
+    return connection
+
+#funzione che attende una notifica, una pagina di modifiche ancora da leggere o il successivo intervallo di lettura
+def wait_for_changes(listen_connection):
+    if listen_connection is None:
+        dispatcher_wake.wait(SLOT_EVENTS_POLL_SECONDS)
+        dispatcher_wake.clear()
+        return
+    if dispatcher_wake.is_set():
+        dispatcher_wake.clear()
+        return
+    if io_select.select([listen_connection], [], [], SLOT_EVENTS_POLL_SECONDS) != ([], [], []):
+        listen_connection.poll()
+        listen_connection.notifies.clear()
+
+#funzione eseguita dal thread di distribuzione
+def run_dispatcher():
+    listen_connection = None
+    while True:
+        try:
+            if SLOT_EVENTS_BACKEND == "postgres" and listen_connection is None:
+                listen_connection = open_listen_connection()
+            wait_for_changes(listen_connection)
+            dispatch_changes()
+        except Exception:
+            logging.exception("Errore nella distribuzione delle modifiche agli slot")
+            if listen_connection is not None:
+                listen_connection.close()
+                listen_connection = None
+            clock.sleep(SLOT_EVENTS_POLL_SECONDS)
+
+#funzione per avviare il thread di distribuzione, una sola volta per worker
+def start_dispatcher():
+    if dispatcher_started.is_set():
+        return
+    with dispatcher_lock:
+        if dispatcher_started.is_set():
+            return
+        # le modifiche precedenti all'avvio vengono inviate solo ai client che le richiedono con Last-Event-ID
+        with Session(get_engine()) as session:
+            dispatched_version[0] = query_current_version(session)
+        threading.Thread(target=run_dispatcher, name="slot-events", daemon=True).start()
+        dispatcher_started.set()
+
+#funzione che restituisce le modifiche successive a since dal registro, come (versione, testo dell'evento)
+#l'ultima coppia ha la versione raggiunta e testo None se le modifiche che corrispondono ai filtri sono terminate prima
+#se since non è più nel registro restituisce l'evento resync con la versione corrente: il client deve riscaricare gli slot
+def iter_replay_events(since, filters):
+    while True:
+        # una sessione per pagina: la connessione non resta occupata mentre gli eventi vengono inviati
+        try:
+            with Session(get_engine()) as session:
+                version, changes, has_more = query_slot_changes(session, since, filters, SLOT_CHANGES_MAX_LIMIT)
+        except SlotChangesResyncRequired as e:
+            yield e.version, format_event(e.version, "resync", {"version": e.version})
+            return
+        for change in changes:
+            yield change.txid, change_event(change)
+        yield version, None
+        if not has_more:
+            return
+        since = version
+
+#funzione che genera il flusso di eventi di un client, last_event_id è la versione dell'ultimo evento ricevuto (None alla prima connessione)
+#il client deve essere già registrato: gli eventi distribuiti durante la lettura dal registro restano nella sua coda
+#sent_version è la versione da cui il client ha ricevuto tutte le modifiche precedenti: gli eventi in coda con versione inferiore
+#sono già stati inviati dalla lettura dal registro, più eventi della stessa transazione hanno la stessa versione
+def iter_subscriber_events(subscriber, last_event_id):
+    try:
+        yield f"retry: {SLOT_EVENTS_RETRY_MS}\n\n"
+
+        # prima connessione: la versione corrente, da cui ripartire alla riconnessione
+        if last_event_id is None:
+            with Session(get_engine()) as session:
+                sent_version = query_current_version(session)
+            yield format_event(sent_version, "version", {"version": sent_version})
+            replay_since = None
+        else:
+            sent_version = 0
+            replay_since = last_event_id
+
+        while True:
+            if replay_since is not None:
+                for version, event in iter_replay_events(replay_since, subscriber.filters):
+                    sent_version = max(sent_version, version)
+                    if event is not None:
+                        yield event
+                replay_since = None
+
+            # coda piena: gli eventi scartati sono riletti dal registro a partire dall'ultima versione inviata
+            # (gli eventi già inviati della stessa transazione vengono inviati di nuovo e riapplicati senza effetti)
+            if subscriber.overflowed:
+                subscriber.overflowed = False
+                while not subscriber.events.empty():
+                    subscriber.events.get_nowait()
+                replay_since = sent_version
+                continue
+
+            try:
+                event_id, event = subscriber.events.get(timeout=SLOT_EVENTS_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            # eventi già inviati con la lettura dal registro
+            if event_id < sent_version:
+                continue
+            sent_version = event_id
+            yield event
+    finally:
+        unsubscribe(subscriber)
@@ -0,0 +1,287 @@
+import os
+import sys
+import heapq
+import logging
+import threading
+import time as clock
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from dotenv import load_dotenv
+from operators_availability import Slot, iter_operator_availability_slots, index_booked_slots, index_periods, slot_sort_key
+from slot_changes import SLOT_CHANGES_MAX_LIMIT, SLOT_CHANGES_NO_FILTERS, SlotChangesResyncRequired, query_slot_changes
+from data_versions import get_data_versions
+from database import DATA_VERSIONED_TABLES, SLOT_CHANGES_TRIGGERS
+
+# Cache in-process degli slot liberi per (availability_id, settimana)
+# ogni voce contiene gli slot della settimana già filtrati da prenotazioni, chiusure e assenze
+# i filtri della richiesta (data/ora di inizio e fine) vengono applicati alla lettura
+# prima di ogni lettura la cache applica le modifiche registrate in slot_changes da qualsiasi worker (sync_slots_cache):
+# le versioni sono quelle degli ETag, se l'ultima transazione visibile del registro non è cambiata non serve nessuna query
+# gli slot in cache riportano i nomi di esame, laboratorio e operatore: una scrittura su quelle tabelle svuota la cache
+# in questo modo una risposta servita dalla cache non è mai precedente alle versioni usate per il suo ETag
+
+load_dotenv()
+
+SLOTS_CACHE_ENABLED = bool(os.getenv("SLOTS_CACHE_ENABLED", "True") == "True")
+# dimensione massima stimata della cache in byte, oltre viene eliminata la voce usata meno di recente
+SLOTS_CACHE_MAX_BYTES = int(os.getenv("SLOTS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# durata massima di una voce, ulteriore limite per le scritture non registrate in slot_changes (es. TRUNCATE)
+SLOTS_CACHE_TTL_SECONDS = int(os.getenv("SLOTS_CACHE_TTL_SECONDS", "60"))
+# precalcolo in background delle prime settimane, avviato alla prima richiesta del worker
+SLOTS_CACHE_WARMUP = bool(os.getenv("SLOTS_CACHE_WARMUP", "True") == "True")
+SLOTS_CACHE_WARMUP_WEEKS = int(os.getenv("SLOTS_CACHE_WARMUP_WEEKS", "8"))
+
+#funzione che restituisce il lunedì della settimana di una data
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+#funzione che restituisce i campi della disponibilità che determinano gli slot generati
+#se la disponibilità viene modificata la voce in cache non è più valida anche se non è stata invalidata esplicitamente
+def availability_fingerprint(operator_availability):
+    return (
+        operator_availability.available_from_date,
+        operator_availability.available_to_date,
+        operator_availability.available_from_time,
+        operator_availability.available_to_time,
+        operator_availability.available_weekday,
+        operator_availability.slot_duration_minutes,
+        operator_availability.pause_minutes,
+        operator_availability.exam_type_id,
+        operator_availability.laboratory_id,
+        operator_availability.operator_id
+    )
+
+# stima della memoria occupata da una voce: gli Slot e la tupla che li contiene, più un costo fisso per chiave,
+# impronta e nodo del dizionario (date, orari, stringhe ISO e disponibilità sono condivisi tra le voci e non sono contati)
+SLOT_BYTES = sys.getsizeof(Slot(None, None, None, None)) + 8
+ENTRY_BYTES = 512
+
+#funzione che restituisce la dimensione stimata in byte di una voce con gli slot indicati
+def entry_size(slots):
+    return ENTRY_BYTES + sys.getsizeof(slots) + len(slots) * SLOT_BYTES
+
+class SlotsCache:
+
+    def __init__(self, max_bytes, ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # versione del registro da cui applicare le modifiche, ultima transazione visibile già applicata
+        # e versioni delle tabelle dei nomi (esami, laboratori, operatori), None dopo clear
+        self.synced_versions = None
+        # incrementata da ogni invalidazione del registro: le voci generate prima non vengono inserite
+        self.generation = 0
+        self.sync_lock = threading.Lock()
+
+    def get(self, operator_availability, week):
+        key = (operator_availability.availability_id, week)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            fingerprint, laboratory_id, operator_id, created_at, slots = entry
+            if fingerprint != availability_fingerprint(operator_availability) or clock.monotonic() - created_at > self.ttl_seconds:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return slots
+
+    #generation è il valore letto prima di caricare i dati da cui sono stati generati gli slot
+    def put(self, operator_availability, week, slots, generation):
+        key = (operator_availability.availability_id, week)
+        with self.lock:
+            if generation != self.generation:
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (
+                availability_fingerprint(operator_availability),
+                operator_availability.laboratory_id,
+                operator_availability.operator_id,
+                clock.monotonic(),
+                slots
+            )
+            self.size_bytes += entry_size(slots)
+            while self.size_bytes > self.max_bytes and self.entries:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size_bytes -= entry_size(entry[4])
+
+    #invalida una sola voce (availability_id, settimana) senza scorrere la cache, restituisce il numero di voci rimosse
+    def pop(self, key):
+        with self.lock:
+            removed = key in self.entries
+            if removed:
+                self._remove(key)
+            self.generation += 1
+        return int(removed)
+
+    #invalida le voci che soddisfano la condizione sulla chiave (availability_id, settimana) e sulla voce, scorrendo tutta la cache
+    #usata per le invalidazioni su intervalli (disponibilità, chiusure, assenze), per una singola settimana c'è pop
+    def invalidate(self, predicate):
+        with self.lock:
+            keys = [key for key, entry in self.entries.items() if predicate(key, entry)]
+            for key in keys:
+                self._remove(key)
+            self.generation += 1
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size_bytes = 0
+            self.synced_versions = None
+            self.generation += 1
+
+slots_cache = SlotsCache(SLOTS_CACHE_MAX_BYTES, SLOTS_CACHE_TTL_SECONDS)
+
+#funzione che restituisce le settimane comprese tra due date
+def weeks_between(from_date, to_date):
+    week = week_start(from_date)
+    while week <= to_date:
+        yield week
+        week += timedelta(days=7)
+
+#invalida la settimana di una disponibilità, da chiamare quando uno slot viene prenotato o liberato
+def invalidate_booking(availability_id, appointment_date):
+    return slots_cache.pop((availability_id, week_start(appointment_date)))
+
+#invalida tutte le settimane di una disponibilità, da chiamare quando la disponibilità viene modificata
+def invalidate_availability(availability_id):
+    return slots_cache.invalidate(lambda key, entry: key[0] == availability_id)
+
+#invalida le settimane delle disponibilità di un laboratorio coinvolte da una chiusura
+def invalidate_laboratory_closure(laboratory_id, start_datetime, end_datetime):
+    first_week, last_week = week_start(start_datetime.date()), week_start(end_datetime.date())
+    return slots_cache.invalidate(lambda key, entry: entry[1] == laboratory_id and first_week <= key[1] <= last_week)
+
+#invalida le settimane delle disponibilità di un operatore coinvolte da un'assenza
+def invalidate_operator_absence(operator_id, start_datetime, end_datetime):
+    first_week, last_week = week_start(start_datetime.date()), week_start(end_datetime.date())
+    return slots_cache.invalidate(lambda key, entry: entry[2] == operator_id and first_week <= key[1] <= last_week)
+
+#invalida le voci interessate da una modifica del registro slot_changes
+def invalidate_slot_change(change):
+    if change.change_type in ("booked", "freed"):
+        return invalidate_booking(change.availability_id, change.start_datetime.date())
+    if change.change_type.startswith("availability_"):
+        return invalidate_availability(change.availability_id)
+    if change.change_type.startswith("closure_"):
+        return invalidate_laboratory_closure(change.laboratory_id, change.start_datetime, change.end_datetime)
+    if change.change_type.startswith("absence_"):
+        return invalidate_operator_absence(change.operator_id, change.start_datetime, change.end_datetime)
+    return 0
+
+#funzione per applicare alla cache le modifiche registrate in slot_changes dopo l'ultima sincronizzazione, anche da altri worker
+#da chiamare prima di leggere gli slot dalla cache: legge il registro solo se l'ultima transazione visibile è cambiata
+def sync_slots_cache(session):
+    versions = get_data_versions()
+    with slots_cache.sync_lock:
+        # senza versioni le voci non possono essere verificate
+        if versions is None:
+            slots_cache.clear()
+            return
+        current_version, changes_version = versions["slot_changes"], versions["slot_bookings"]
+        names_versions = tuple(versions[table_name] for table_name in DATA_VERSIONED_TABLES if table_name not in SLOT_CHANGES_TRIGGERS)
+        synced_versions = slots_cache.synced_versions
+        # nomi modificati: tutte le voci riportano i nomi precedenti
+        if synced_versions is not None and synced_versions[2] != names_versions:
+            slots_cache.clear()
+            synced_versions = None
+        # cache vuota: le voci generate da qui in poi comprendono le modifiche precedenti alla versione corrente
+        if synced_versions is None:
+            slots_cache.synced_versions = (current_version, changes_version, names_versions)
+            return
+        if synced_versions[1] == changes_version:
+            return
+
+        try:
+            version, changes, has_more = query_slot_changes(session, synced_versions[0], SLOT_CHANGES_NO_FILTERS, SLOT_CHANGES_MAX_LIMIT)
+        except SlotChangesResyncRequired as e:
+            version, changes, has_more = e.version, None, True
+        # modifiche compattate o troppe da applicare singolarmente: conviene ripartire da una cache vuota
+        if has_more:
+            slots_cache.clear()
+            slots_cache.synced_versions = (version, changes_version, names_versions)
+            return
+        for change in changes:
+            invalidate_slot_change(change)
+        slots_cache.synced_versions = (version, changes_version, names_versions)
+
+#funzione per generare gli slot liberi di una disponibilità in una settimana
+def generate_week_slots(operator_availability, week, laboratory_closures_index, operator_absences_index, booked_slots_index):
+    return tuple(iter_operator_availability_slots(
+        operator_availability,
+        datetime.combine(week, time(0, 0)),
+        datetime.combine(week + timedelta(days=6), time(0, 0)),
+        laboratory_closures_index,
+        operator_absences_index,
+        booked_slots_index
+    ))
+
+#funzione per generare in modo lazy gli slot liberi usando la cache, con lo stesso ordinamento di iter_availabile_slots
+#load_conflicts(datetime_from) restituisce (chiusure, assenze, prenotazioni) e viene chiamata solo alla prima voce mancante
+def iter_cached_slots(operators_availability, datetime_from_filter, datetime_to_filter, load_conflicts):
+
+    first_week = week_start(datetime_from_filter.date())
+    from_key = (datetime_from_filter.date(), datetime_from_filter.time())
+    to_date = datetime_to_filter.date()
+    conflicts_indexes = []
+    # letta prima dei dati: se nel frattempo la cache applica modifiche le voci generate non vengono inserite
+    generation = slots_cache.generation
+
+    def get_conflicts_indexes():
+        if not conflicts_indexes:
+            laboratory_closures, operator_absences, booked_slots = load_conflicts(datetime.combine(first_week, time(0, 0)))
+            conflicts_indexes.extend((
+                index_periods(laboratory_closures, "laboratory_id"),
+                index_periods(operator_absences, "operator_id"),
+                index_booked_slots(booked_slots)
+            ))
+        return conflicts_indexes
+
+    def iter_availability(operator_availability):
+        maxdate = min(datetime_to_filter.date(), operator_availability.available_to_date)
+        for week in weeks_between(max(datetime_from_filter.date(), operator_availability.available_from_date), maxdate):
+            slots = slots_cache.get(operator_availability, week)
+            if slots is None:
+                slots = generate_week_slots(operator_availability, week, *get_conflicts_indexes())
+                slots_cache.put(operator_availability, week, slots, generation)
+            for slot in slots:
+                if (slot.operator_availability_date, slot.operator_availability_slot_start) >= from_key and slot.operator_availability_date <= to_date:
+                    yield slot
+
+    return heapq.merge(*(iter_availability(operator_availability) for operator_availability in operators_availability), key=slot_sort_key)
+
+#funzione per precalcolare in background le prime settimane di tutte le disponibilità
+#load_availability(session, datetime_from) restituisce le disponibilità abilitate, load_conflicts(session, datetime_from) chiusure, assenze e prenotazioni
+def warm_up(session_factory, load_availability, load_conflicts):
+
+    def run():
+        try:
+            with session_factory() as session:
+                sync_slots_cache(session)
+                datetime_from = datetime.combine(date.today(), time(0, 0))
+                datetime_to = datetime_from + timedelta(weeks=SLOTS_CACHE_WARMUP_WEEKS)
+                slots_count = sum(1 for slot in iter_cached_slots(
+                    load_availability(session, datetime_from),
+                    datetime_from,
+                    datetime_to,
+                    lambda datetime_from: load_conflicts(session, datetime_from)
+                ))
+                logging.info("Cache slot inizializzata: %s slot, %s voci", slots_count, len(slots_cache.entries))
+        except Exception:
+            logging.exception("Errore durante l'inizializzazione della cache slot")
+
+    thread = threading.Thread(target=run, name="slots-cache-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,123 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from operators_availability import index_periods
+
+# Conteggio degli slot liberi per giorno senza generare i singoli slot
+# gli slot di un giorno sono la progressione inizio + k * (durata + pausa), con k da 0 all'ultimo slot che termina entro l'orario di fine
+# chiusure, assenze e filtro di inizio escludono intervalli contigui di k, le prenotazioni singoli k:
+# il conteggio è quindi aritmetico e il costo per giorno dipende solo dal numero di periodi e prenotazioni di quel giorno
+
+# raggruppamenti disponibili oltre alla data, con il relativo attributo della disponibilità
+SUMMARY_GROUP_BY = {
+    "laboratory": "laboratory_id",
+    "exam_type": "exam_type_id",
+    "operator": "operator_id"
+}
+
+#funzione per la divisione intera arrotondata per eccesso tra timedelta
+def ceil_div(dividend, divisor):
+    return -((-dividend) // divisor)
+
+#funzione che restituisce gli intervalli di indici [primo, ultimo] degli slot che si sovrappongono ai periodi indicizzati per la chiave
+#first_slot_start è l'inizio dello slot 0, i periodi considerati sono quelli che intersecano [window_start, window_end]
+def overlapping_slot_ranges(key, periods_index, first_slot_start, window_start, window_end, step, duration):
+    intervals = periods_index.get(key)
+    if not intervals:
+        return []
+    starts, ends = intervals
+    ranges = []
+    # intervalli già uniti e ordinati: quelli che terminano dopo l'inizio e iniziano prima della fine della finestra
+    for position in range(bisect_right(ends, window_start), bisect_left(starts, window_end)):
+        # lo slot k si sovrappone se inizio_k < fine periodo e fine_k > inizio periodo
+        first_index = (starts[position] - first_slot_start - duration) // step + 1
+        last_index = ceil_div(ends[position] - first_slot_start, step) - 1
+        ranges.append((first_index, last_index))
+    return ranges
+
+#funzione per contare gli slot liberi di una singola disponibilità, restituisce le coppie (data, numero di slot liberi) dei giorni con almeno uno slot
+#booked_starts contiene per (availability_id, data) gli orari di inizio delle prenotazioni attive
+def iter_operator_availability_counts(operator_availability, datetime_from_filter = None, datetime_to_filter = None, laboratory_closures_index = None, operator_absences_index = None, booked_starts = None):
+
+    # stesso intervallo di date del motore python
+    if isinstance(datetime_from_filter, datetime):
+        current_date = max(operator_availability.available_from_date, datetime_from_filter.date())
+    else:
+        current_date = operator_availability.available_from_date
+    if isinstance(datetime_to_filter, datetime):
+        last_date = min(datetime_to_filter.date(), operator_availability.available_to_date)
+    else:
+        last_date = operator_availability.available_from_date
+    current_date += timedelta(days=((operator_availability.available_weekday - current_date.weekday()) % 7))
+
+    duration = timedelta(minutes=operator_availability.slot_duration_minutes)
+    step = timedelta(minutes=operator_availability.slot_duration_minutes + operator_availability.pause_minutes)
+    if duration <= timedelta(0):
+        return
+
+    while current_date <= last_date:
+        first_slot_start = datetime.combine(current_date, operator_availability.available_from_time)
+        day_end = datetime.combine(current_date, operator_availability.available_to_time)
+
+        # ultimo slot che termina entro l'orario di fine
+        last_index = (day_end - first_slot_start - duration) // step
+        first_index = 0
+        if isinstance(datetime_from_filter, datetime) and datetime_from_filter > first_slot_start:
+            first_index = ceil_div(datetime_from_filter - first_slot_start, step)
+
+        if first_index <= last_index:
+            window_start = first_slot_start + step * first_index
+            window_end = first_slot_start + step * last_index + duration
+
+            excluded_ranges = []
+            if laboratory_closures_index:
+                excluded_ranges += overlapping_slot_ranges(operator_availability.laboratory_id, laboratory_closures_index, first_slot_start, window_start, window_end, step, duration)
+            if operator_absences_index:
+                excluded_ranges += overlapping_slot_ranges(operator_availability.operator_id, operator_absences_index, first_slot_start, window_start, window_end, step, duration)
+
+            # unione degli intervalli di indici esclusi, limitati agli slot del giorno
+            merged_ranges = []
+            for range_first, range_last in sorted(excluded_ranges):
+                range_first, range_last = max(range_first, first_index), min(range_last, last_index)
+                if range_first > range_last:
+                    continue
+                if merged_ranges and range_first <= merged_ranges[-1][1] + 1:
+                    merged_ranges[-1][1] = max(merged_ranges[-1][1], range_last)
+                else:
+                    merged_ranges.append([range_first, range_last])
+
+            free_slots = last_index - first_index + 1 - sum(range_last - range_first + 1 for range_first, range_last in merged_ranges)
+
+            # le prenotazioni riducono il conteggio solo se cadono su uno slot del giorno non già escluso
+            for booked_start in (booked_starts or {}).get((operator_availability.availability_id, current_date), ()):
+                offset = datetime.combine(current_date, booked_start) - first_slot_start
+                if offset % step:
+                    continue
+                slot_index = offset // step
+                if first_index <= slot_index <= last_index and not any(range_first <= slot_index <= range_last for range_first, range_last in merged_ranges):
+                    free_slots -= 1
+
+            if free_slots > 0:
+                yield current_date, free_slots
+
+        current_date += timedelta(days=7)
+
+#funzione che restituisce il numero di slot liberi per giorno (e per laboratorio, tipo di esame o operatore se indicato in group_by)
+#stessi parametri di iter_availabile_slots, il risultato è un dizionario {(data, chiave del gruppo o None): numero di slot}
+def summarize_availabile_slots(operators_availability, datetime_from_filter = None, datetime_to_filter = None, laboratory_closures = None, operator_absences = None, booked_slots = None, group_by = None):
+
+    laboratory_closures_index = index_periods(laboratory_closures, "laboratory_id") if laboratory_closures != None else None
+    operator_absences_index = index_periods(operator_absences, "operator_id") if operator_absences != None else None
+    booked_starts = {}
+    for booked_slot in booked_slots or ():
+        booked_starts.setdefault((booked_slot.availability_id, booked_slot.appointment_date), set()).add(booked_slot.appointment_time_start)
+
+    group_attribute = SUMMARY_GROUP_BY[group_by] if group_by else None
+    counts = {}
+    for operator_availability in operators_availability:
+        group_key = getattr(operator_availability, group_attribute) if group_attribute else None
+        for slot_date, free_slots in iter_operator_availability_counts(
+            operator_availability, datetime_from_filter, datetime_to_filter,
+            laboratory_closures_index, operator_absences_index, booked_starts
+        ):
+            counts[(slot_date, group_key)] = counts.get((slot_date, group_key), 0) + free_slots
+    return counts
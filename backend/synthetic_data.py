@@ -0,0 +1,183 @@
+import random
+import uuid
+from datetime import date, datetime, time, timedelta
+from werkzeug.security import generate_password_hash
+from database import Account, Laboratory, LaboratoryClosure, ExamType, Operator, OperatorAbsence, OperatorsAvailability, SlotBooking
+
+# Generatore di dati sintetici per i benchmark
+# crea oggetti ORM già collegati tra loro tramite le relazioni: possono essere passati direttamente
+# a generate_availabile_slots oppure inseriti nel database con insert_synthetic_data
+
+# password di tutti gli account sintetici, usata dai benchmark per il login
+SYNTHETIC_PASSWORD = "Password1!"
+
+SLOT_DURATIONS = (10, 15, 20, 30, 45)
+PAUSES = (0, 5, 10)
+
+#funzione per generare un insieme di dati sintetici riproducibile a partire dal seed
+def generate_synthetic_data(
+    laboratories = 10,
+    operators = 50,
+    exam_types = 20,
+    availabilities = 500,
+    closures = 100,
+    absences = 200,
+    bookings = 20000,
+    horizon_days = 365,
+    start_date = None,
+    seed = 1
+):
+    rnd = random.Random(seed)
+    start_date = start_date or date.today() + timedelta(days=1)
+    end_date = start_date + timedelta(days=horizon_days)
+    password_hash = generate_password_hash(SYNTHETIC_PASSWORD)
+
+    def new_uuid():
+        return uuid.UUID(int=rnd.getrandbits(128), version=4)
+
+    def new_account(prefix, index, is_operator = False):
+        return Account(
+            account_id=new_uuid(),
+            username=f"{prefix}{index:08d}",
+            password_hash=password_hash,
+            email=f"{prefix}{index:08d}@example.com",
+            first_name=prefix.capitalize(),
+            last_name=f"{index:08d}",
+            tel_number="+390000000000",
+            enabled=True,
+            failed_login_count=0,
+            is_operator=is_operator,
+            is_admin=False
+        )
+
+    laboratories_list = [
+        Laboratory(laboratory_id=new_uuid(), name=f"Laboratorio {index}", address=f"Via {index}", contact_info=f"lab{index}@example.com")
+        for index in range(laboratories)
+    ]
+    exam_types_list = [
+        ExamType(exam_type_id=new_uuid(), name=f"Esame {index}", description=f"Esame sintetico {index}")
+        for index in range(exam_types)
+    ]
+    operator_accounts = [new_account("operator", index, True) for index in range(operators)]
+    operators_list = [
+        Operator(operator_id=new_uuid(), name=f"Operatore {index}", account_id=account.account_id, account=account)
+        for index, account in enumerate(operator_accounts)
+    ]
+
+    # le disponibilità coprono tutti i tipi di esame in modo che ogni esame sia prenotabile
+    availabilities_list = []
+    for index in range(availabilities):
+        laboratory = rnd.choice(laboratories_list)
+        operator = rnd.choice(operators_list)
+        exam_type = exam_types_list[index % exam_types]
+        from_hour = rnd.randint(7, 12)
+        to_hour = rnd.randint(from_hour + 2, 19)
+        available_from_date = start_date + timedelta(days=rnd.randint(0, horizon_days // 6))
+        available_to_date = end_date - timedelta(days=rnd.randint(0, horizon_days // 6))
+        availabilities_list.append(OperatorsAvailability(
+            availability_id=new_uuid(),
+            exam_type_id=exam_type.exam_type_id,
+            laboratory_id=laboratory.laboratory_id,
+            operator_id=operator.operator_id,
+            exam_type=exam_type,
+            laboratory=laboratory,
+            operator=operator,
+            available_from_date=available_from_date,
+            available_to_date=available_to_date,
+            available_from_time=time(from_hour, rnd.choice((0, 15, 30))),
+            available_to_time=time(to_hour, 0),
+            available_weekday=rnd.randint(0, 6),
+            slot_duration_minutes=rnd.choice(SLOT_DURATIONS),
+            pause_minutes=rnd.choice(PAUSES),
+            enabled=True
+        ))
+
+    def random_period():
+        start_datetime = datetime.combine(start_date, time(0, 0)) + timedelta(minutes=rnd.randint(0, horizon_days * 24 * 60))
+        return start_datetime, start_datetime + timedelta(minutes=rnd.randint(60, 3 * 24 * 60))
+
+    closures_list = []
+    for index in range(closures):
+        start_datetime, end_datetime = random_period()
+        closures_list.append(LaboratoryClosure(
+            closure_id=new_uuid(),
+            laboratory_id=rnd.choice(laboratories_list).laboratory_id,
+            start_datetime=start_datetime,
+            end_datetime=end_datetime
+        ))
+
+    absences_list = []
+    for index in range(absences):
+        start_datetime, end_datetime = random_period()
+        absences_list.append(OperatorAbsence(
+            absence_id=new_uuid(),
+            operator_id=rnd.choice(operators_list).operator_id,
+            start_datetime=start_datetime,
+            end_datetime=end_datetime
+        ))
+
+    # ogni paziente prenota al massimo un esame per tipo: la prenotazione i va al paziente i // exam_types per l'esame i % exam_types
+    availabilities_by_exam_type = {}
+    for operator_availability in availabilities_list:
+        availabilities_by_exam_type.setdefault(operator_availability.exam_type_id, []).append(operator_availability)
+
+    patient_accounts = [new_account("patient", index) for index in range(max(1, -(-bookings // exam_types)))]
+    bookings_list = []
+    booked_keys = set()
+    for index in range(bookings):
+        candidates = availabilities_by_exam_type.get(exam_types_list[index % exam_types].exam_type_id)
+        if not candidates:
+            continue
+        # alcuni tentativi per trovare uno slot valido e non ancora prenotato
+        for attempt in range(10):
+            operator_availability = rnd.choice(candidates)
+            first_day = operator_availability.available_from_date + timedelta(
+                days=(operator_availability.available_weekday - operator_availability.available_from_date.weekday()) % 7
+            )
+            weeks = (operator_availability.available_to_date - first_day).days // 7
+            if weeks < 0:
+                continue
+            appointment_date = first_day + timedelta(weeks=rnd.randint(0, weeks))
+            step = operator_availability.slot_duration_minutes + operator_availability.pause_minutes
+            day_minutes = (
+                (operator_availability.available_to_time.hour * 60 + operator_availability.available_to_time.minute)
+                - (operator_availability.available_from_time.hour * 60 + operator_availability.available_from_time.minute)
+            )
+            slots_per_day = (day_minutes - operator_availability.slot_duration_minutes) // step + 1
+            if slots_per_day < 1:
+                continue
+            slot_start = datetime.combine(appointment_date, operator_availability.available_from_time) + timedelta(minutes=step * rnd.randrange(slots_per_day))
+            key = (operator_availability.availability_id, appointment_date, slot_start.time())
+            if key in booked_keys:
+                continue
+            booked_keys.add(key)
+            bookings_list.append(SlotBooking(
+                appointment_id=new_uuid(),
+                account_id=patient_accounts[index // exam_types].account_id,
+                availability_id=operator_availability.availability_id,
+                exam_type_id=operator_availability.exam_type_id,
+                operators_availability=operator_availability,
+                appointment_date=appointment_date,
+                appointment_time_start=slot_start.time(),
+                appointment_time_end=(slot_start + timedelta(minutes=operator_availability.slot_duration_minutes)).time(),
+                rejected=False
+            ))
+            break
+
+    return {
+        "accounts": operator_accounts + patient_accounts,
+        "laboratories": laboratories_list,
+        "exam_types": exam_types_list,
+        "operators": operators_list,
+        "availabilities": availabilities_list,
+        "closures": closures_list,
+        "absences": absences_list,
+        "bookings": bookings_list
+    }
+
+#funzione per inserire nel database i dati generati da generate_synthetic_data, nell'ordine richiesto dalle chiavi esterne
+def insert_synthetic_data(session, data):
+    for key in ("accounts", "laboratories", "exam_types", "operators", "availabilities", "closures", "absences", "bookings"):
+        session.add_all(data[key])
+        session.flush()
+    session.commit()
@@ -0,0 +1,90 @@
+import os
+import sys
+import logging
+import pytest
+
+# Test con i dati sintetici di synthetic_data.py
+# l'equivalenza dei motori di generazione degli slot usa i dati in memoria e viene sempre eseguita, gli altri test usano
+# il database Postgres configurato nel .env (POSTGRES_*): senza un database raggiungibile vengono saltati
+#
+#   cd backend && pip install -r requirements-dev.txt && python -m pytest -q tests
+#
+# ATTENZIONE: i test cancellano e ripopolano il database configurato nel .env
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# configurazione letta all'import dei moduli: il precalcolo in background della cache, la compattazione del registro
+# e la blocklist su database eseguirebbero query non legate alla richiesta misurata
+os.environ.setdefault("SLOTS_CACHE_WARMUP", "False")
+os.environ.setdefault("SLOT_CHANGES_COMPACT_INTERVAL_SECONDS", "0")
+os.environ.setdefault("TOKEN_BLOCKLIST_BACKEND", "memory")
+
+# dimensioni ridotte rispetto ai benchmark, sufficienti a coprire chiusure, assenze e prenotazioni su ogni filtro
+TEST_DATA_PARAMETERS = {
+    "laboratories": 4,
+    "operators": 12,
+    "exam_types": 6,
+    "availabilities": 60,
+    "closures": 20,
+    "absences": 30,
+    "bookings": 1500,
+    "horizon_days": 120,
+    "seed": 1
+}
+
+@pytest.fixture(scope="session")
+def database():
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+    from database import get_engine, migrate_schema
+
+    try:
+        with get_engine().connect() as connection:
+            connection.execute(text("SELECT 1"))
+    except OperationalError:
+        pytest.skip("Database Postgres non raggiungibile")
+    logging.disable(logging.INFO)
+    migrate_schema()
+    return get_engine()
+
+#dati sintetici in memoria, senza database: oggetti ORM collegati dalle relazioni, non associati a una sessione
+@pytest.fixture(scope="session")
+def generated_data():
+    from synthetic_data import generate_synthetic_data
+    return generate_synthetic_data(**TEST_DATA_PARAMETERS)
+
+#dati sintetici inseriti nel database, una volta per sessione di test
+@pytest.fixture(scope="session")
+def synthetic_data(database):
+    from sqlalchemy import text
+    from sqlalchemy.orm import Session
+    from database import clear_existing_data
+    from synthetic_data import generate_synthetic_data, insert_synthetic_data
+    from slots_cache import slots_cache
+
+    clear_existing_data()
+    data = generate_synthetic_data(**TEST_DATA_PARAMETERS)
+    with Session(database, expire_on_commit=False) as session:
+        insert_synthetic_data(session, data)
+    with database.begin() as connection:
+        connection.execute(text("ANALYZE"))
+    slots_cache.clear()
+    return data
+
+#l'import del modulo non accede al database
+@pytest.fixture(scope="session")
+def application():
+    import app as application
+    application.app.config["JWT_COOKIE_CSRF_PROTECT"] = False
+    return application
+
+#test client autenticato come il primo paziente sintetico (con prenotazioni)
+@pytest.fixture(scope="session")
+def client(application, synthetic_data):
+    from synthetic_data import SYNTHETIC_PASSWORD
+
+    client = application.app.test_client()
+    patient = next(account for account in synthetic_data["accounts"] if not account.is_operator)
+    login = client.post("/login", json={"username": patient.username, "password": SYNTHETIC_PASSWORD})
+    assert login.status_code == 200, login.get_data(as_text=True)
+    return client
@@ -0,0 +1,58 @@
+import io
+from datetime import datetime, timedelta
+
+# Resoconto dell'import massivo con righe parzialmente errate: le righe valide vengono importate e ciascuna riga scartata
+# è riportata con il proprio numero, sia per gli errori di validazione sia per quelli rifiutati dal database
+
+def account_row(username, password = "Passw0rd!", email = None):
+    return f"{username},{password},{email or username + '@example.com'},Mario,Rossi,+393331234567\n"
+
+def test_accounts_partial_failure(synthetic_data, monkeypatch):
+    import bulk_import
+    from password_hashing import PasswordHashingBusy, hash_password
+
+    # il pool di hashing saturo per una sola password: la riga viene scartata senza interrompere l'import
+    def busy_hash_password(password, queue_timeout):
+        if password == "Busy0000!":
+            raise PasswordHashingBusy()
+        return hash_password(password, queue_timeout)
+    monkeypatch.setattr(bulk_import, "hash_password", busy_hash_password)
+
+    body = (
+        "username,password,email,first_name,last_name,tel_number\n"
+        + account_row("importok01")
+        + account_row("importok02", email="not-an-email")
+        + account_row("importok03", password="Busy0000!")
+        + account_row("importok04")
+        # username già importato nello stesso blocco: rifiutato dal database, il resto del blocco viene comunque inserito
+        + account_row("importok01", email="importok01bis@example.com")
+        + account_row("importok05")
+    )
+    report = bulk_import.import_rows("accounts", bulk_import.read_rows(io.StringIO(body), "csv"), chunk_size=10)
+
+    assert (report["rows_total"], report["rows_imported"], report["rows_failed"]) == (6, 3, 3)
+    errors = {error["row"]: error["error"] for error in report["errors"]}
+    assert sorted(errors) == [2, 3, 5]
+    assert errors[2] == "invalid email"
+    assert errors[3] == "password hashing busy, retry the row"
+    assert "duplicate key" in errors[5]
+
+def test_closures_partial_failure(synthetic_data):
+    import bulk_import
+
+    laboratory_id = synthetic_data["laboratories"][0].laboratory_id
+    start = datetime.combine(synthetic_data["availabilities"][0].available_from_date, datetime.min.time()) + timedelta(days=400)
+    rows = [
+        {"laboratory_id": str(laboratory_id), "start_datetime": start.isoformat(), "end_datetime": (start + timedelta(hours=2)).isoformat()},
+        {"laboratory_id": str(laboratory_id), "start_datetime": start.isoformat(), "end_datetime": (start - timedelta(hours=2)).isoformat()},
+        ValueError("invalid JSON: Expecting value"),
+        {"laboratory_id": "00000000-0000-4000-8000-000000000000", "start_datetime": start.isoformat(), "end_datetime": start.isoformat()}
+    ]
+    report = bulk_import.import_rows("closures", iter(rows), chunk_size=10)
+
+    assert (report["rows_total"], report["rows_imported"], report["rows_failed"]) == (4, 1, 3)
+    errors = {error["row"]: error["error"] for error in report["errors"]}
+    assert errors[2] == "start_datetime after end_datetime"
+    assert errors[3].startswith("invalid JSON")
+    # laboratorio inesistente: violazione della chiave esterna
+    assert "foreign key" in errors[4]
@@ -0,0 +1,75 @@
+import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Numero di statement SQL eseguiti dalle route degli slot e delle prenotazioni
+# i dati serializzati (nomi di esame, laboratorio e operatore) devono arrivare dalle query della route e non da
+# caricamenti lazy delle relazioni, uno per slot o per prenotazione: il numero di statement non dipende dai dati
+
+#context manager che conta gli statement eseguiti su qualsiasi engine, compresi i thread delle query concorrenti
+@contextmanager
+def count_statements():
+    statements = []
+    def record_statement(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(Engine, "before_cursor_execute", record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", record_statement)
+
+#funzione per eseguire una richiesta partendo sempre dallo stesso stato delle cache del worker
+#(versioni dei dati da rileggere, cache degli slot vuota o popolata)
+def request_statements(client, method, path, warm_cache = False, **kwargs):
+    from data_versions import invalidate_data_versions
+    from slots_cache import slots_cache
+
+    slots_cache.clear()
+    if warm_cache:
+        assert client.get(path).status_code == 200
+    invalidate_data_versions()
+    with count_statements() as statements:
+        response = client.open(path, method=method, **kwargs)
+    return response, len(statements)
+
+@pytest.mark.parametrize("path, warm_cache, expected_statements", [
+    # versioni dei dati per l'ETag, disponibilità, chiusure, assenze e prenotazioni (queste ultime solo a cache vuota)
+    ("/slots_availability", False, 5),
+    ("/slots_availability", True, 2),
+    ("/slots_availability?format=compact", False, 5),
+    ("/slots_availability?limit=20", False, 5),
+    ("/slots_availability?engine=numpy", False, 5),
+    ("/slots_availability?engine=parallel", False, 5),
+    # disponibilità e query degli slot sul database
+    ("/slots_availability?engine=sql&limit=20", False, 3),
+    ("/slots_availability/next?count=5", False, 5),
+    ("/slots_availability/summary", False, 5),
+    ("/slot_bookings", False, 1),
+])
+def test_slots_statements(client, path, warm_cache, expected_statements):
+    response, statements = request_statements(client, "GET", path, warm_cache)
+    assert response.status_code == 200
+    assert statements == expected_statements
+
+def test_booking_statements(application, synthetic_data):
+    client = application.app.test_client()
+    account = {"username": "querycount01", "password": "Passw0rd!", "email": "querycount01@example.com", "tel_number": "+393331234567", "first_name": "Query", "last_name": "Count"}
+    assert client.post("/register", json=account).status_code in (200, 409)
+    assert client.post("/login", json={"username": account["username"], "password": account["password"]}).status_code == 200
+
+    exam_type_id = synthetic_data["exam_types"][0].exam_type_id
+    slot = client.get(f"/slots_availability/next?exam_type_id={exam_type_id}").get_json()[0]
+    slot["availability_id"] = slot["operator_availability_id"]
+
+    # INSERT ... SELECT della prenotazione
+    response, statements = request_statements(client, "POST", "/book_slot", json=slot)
+    assert response.status_code == 200
+    assert statements == 1
+
+    appointment_id = next(booking["appointment_id"] for booking in client.get("/slot_bookings").get_json() if not booking["rejected"])
+
+    # lettura della prenotazione e UPDATE del rifiuto
+    response, statements = request_statements(client, "PUT", f"/book_slot/{appointment_id}/reject")
+    assert response.status_code == 200
+    assert statements == 2
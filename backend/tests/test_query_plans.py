@@ -0,0 +1,110 @@
+import pytest
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Piani di esecuzione delle query eseguite dagli endpoint, rieseguite con EXPLAIN e le scansioni sequenziali disattivate:
+# con enable_seqscan = off postgres sceglie una scansione sequenziale solo se nessun indice è utilizzabile per la query,
+# il test fallisce se una tabella viene letta per intero, escluse quelle che l'endpoint legge completamente per costruzione
+
+#context manager che registra le SELECT eseguite con i relativi parametri
+@contextmanager
+def record_selects():
+    statements = []
+    def record_statement(connection, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            statements.append((statement, parameters))
+    event.listen(Engine, "before_cursor_execute", record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", record_statement)
+
+#funzione che restituisce i nodi del piano come lista piatta
+def plan_nodes(plan):
+    nodes = [plan]
+    for child in plan.get("Plans", ()):
+        nodes += plan_nodes(child)
+    return nodes
+
+#funzione che restituisce i piani delle query registrate, con le scansioni sequenziali disattivate
+def explain(database, statements):
+    with database.begin() as connection:
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        return [connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()[0]["Plan"] for statement, parameters in statements]
+
+#endpoint e tabelle che possono essere lette per intero
+def endpoint_cases(database, data):
+    exam_type_id = data["exam_types"][0].exam_type_id
+    operator_id = data["operators"][0].operator_id
+    laboratory_id = data["laboratories"][0].laboratory_id
+    with database.connect() as connection:
+        # prima versione successiva alla compattazione del registro delle modifiche: tutte le modifiche conservate sono restituite
+        changes_since = connection.execute(text("SELECT compacted_txid + 1 FROM slot_changes_compaction")).scalar()
+    return {
+        "slots_availability": ("/slots_availability", ()),
+        "slots_availability_exam_type": (f"/slots_availability?exam_type_id={exam_type_id}", ()),
+        "slots_availability_operator": (f"/slots_availability?operator_id={operator_id}", ()),
+        "slots_availability_laboratory": (f"/slots_availability?laboratory_id={laboratory_id}", ()),
+        "slots_availability_sql": (f"/slots_availability?engine=sql&exam_type_id={exam_type_id}&limit=100", ()),
+        "slots_availability_summary": (f"/slots_availability/summary?laboratory_id={laboratory_id}", ()),
+        "slots_availability_next": (f"/slots_availability/next?operator_id={operator_id}", ()),
+        "slots_availability_changes": (f"/slots_availability/changes?since={changes_since}&exam_type_id={exam_type_id}", ()),
+        "slot_bookings": ("/slot_bookings", ()),
+        "operators": (f"/operators?exam_id={exam_type_id}", ()),
+        "laboratories": (f"/laboratories?operator_id={operator_id}", ()),
+        "exam_types": ("/exam_types", ("exam_types",)),
+        "mylogin": ("/mylogin", ())
+    }
+
+ENDPOINT_CASES = (
+    "slots_availability", "slots_availability_exam_type", "slots_availability_operator", "slots_availability_laboratory",
+    "slots_availability_sql", "slots_availability_summary", "slots_availability_next", "slots_availability_changes",
+    "slot_bookings", "operators", "laboratories", "exam_types", "mylogin"
+)
+
+@pytest.mark.parametrize("case", ENDPOINT_CASES)
+def test_endpoint_queries_use_indexes(database, synthetic_data, client, case):
+    from slots_cache import slots_cache
+
+    path, full_scan_tables = endpoint_cases(database, synthetic_data)[case]
+    # senza cache l'endpoint esegue anche le query di chiusure, assenze e prenotazioni
+    slots_cache.clear()
+    with record_selects() as statements:
+        assert client.get(path).status_code == 200
+    assert statements
+
+    scanned_tables = {node["Relation Name"] for plan in explain(database, statements) for node in plan_nodes(plan) if node["Node Type"] == "Seq Scan"}
+    assert scanned_tables - set(full_scan_tables) - {"data_versions", "slot_changes_compaction"} == set()
+
+# Piano registrato della query delle disponibilità (query_availability) per ciascun filtro
+# al posto di un solo indice composto (enabled, exam_type_id, laboratory_id, operator_id, available_to_date), utilizzabile
+# solo dai filtri che ne comprendono le prime colonne, c'è un indice (identificativo, available_to_date) per ciascun filtro:
+# ogni filtro viene letto con l'indice della propria colonna e la condizione dell'indice comprende sia l'identificativo
+# sia la data di fine (le disponibilità già terminate non vengono lette); con due filtri postgres usa l'indice del più selettivo
+AVAILABILITY_INDEXES = {
+    "exam_type_id": "ix_operators_availability_exam_type_to_date",
+    "operator_id": "ix_operators_availability_operator_to_date",
+    "laboratory_id": "ix_operators_availability_laboratory_to_date"
+}
+AVAILABILITY_PLANS = (("exam_type_id",), ("operator_id",), ("laboratory_id",), ("exam_type_id", "laboratory_id"), ("operator_id", "laboratory_id"))
+
+@pytest.mark.parametrize("fields", AVAILABILITY_PLANS, ids="+".join)
+def test_availability_plan(application, database, synthetic_data, fields):
+    values = {
+        "exam_type_id": synthetic_data["exam_types"][0].exam_type_id,
+        "operator_id": synthetic_data["operators"][0].operator_id,
+        "laboratory_id": synthetic_data["laboratories"][0].laboratory_id
+    }
+    filters = application.slots_filters(datetime.combine(date.today() + timedelta(days=1), time(0, 0)), None, **{field: values[field] for field in fields})
+
+    with record_selects() as statements:
+        with Session(application.get_read_engine()) as session:
+            application.query_availability(session, filters)
+    [plan] = explain(database, statements)
+
+    [scan] = [node for node in plan_nodes(plan) if node.get("Index Name", "").startswith("ix_operators_availability_")]
+    [field] = [field for field in fields if AVAILABILITY_INDEXES[field] == scan["Index Name"]]
+    assert field in scan["Index Cond"] and "available_to_date" in scan["Index Cond"]
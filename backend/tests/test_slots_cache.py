@@ -0,0 +1,94 @@
+import uuid
+from sqlalchemy import text
+
+# Allineamento della cache degli slot con le scritture degli altri worker
+# le scritture sono eseguite direttamente sul database, senza le invalidazioni locali del worker che le esegue:
+# la cache deve applicarle dal registro slot_changes quando le versioni dei dati vengono rilette
+
+#funzione che restituisce le chiavi (disponibilità, data, inizio) degli slot restituiti dalla route
+def slot_keys(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    return [(slot["operator_availability_id"], slot["operator_availability_date"], slot["operator_availability_slot_start"]) for slot in response.json]
+
+#funzione che simula la scadenza della copia locale delle versioni dei dati (DATA_VERSIONS_TTL_SECONDS)
+def expire_data_versions():
+    from data_versions import invalidate_data_versions
+    invalidate_data_versions()
+
+def test_cache_applies_booking_from_other_worker(database, synthetic_data, client):
+    from slots_cache import slots_cache
+
+    exam_type_id = synthetic_data["exam_types"][1].exam_type_id
+    path = f"/slots_availability?exam_type_id={exam_type_id}"
+    slots_cache.clear()
+    availability_id, slot_date, slot_start = slot_keys(client, path)[0]
+    assert slots_cache.entries
+
+    appointment_id = uuid.uuid4()
+    with database.begin() as connection:
+        account_id = connection.execute(text(
+            "SELECT account_id FROM account WHERE account_id NOT IN "
+            "(SELECT account_id FROM slot_bookings WHERE NOT rejected AND exam_type_id = :exam_type_id) LIMIT 1"
+        ), {"exam_type_id": exam_type_id}).scalar()
+        connection.execute(text(
+            "INSERT INTO slot_bookings (appointment_id, account_id, availability_id, exam_type_id, appointment_date, appointment_time_start, appointment_time_end, rejected) "
+            "SELECT :appointment_id, :account_id, availability_id, exam_type_id, :slot_date, :slot_start, CAST(:slot_start AS time) + slot_duration_minutes * interval '1 minute', false "
+            "FROM operators_availability WHERE availability_id = :availability_id"
+        ), {"appointment_id": appointment_id, "account_id": account_id, "availability_id": availability_id, "slot_date": slot_date, "slot_start": slot_start})
+    try:
+        expire_data_versions()
+        assert (availability_id, slot_date, slot_start) not in slot_keys(client, path)
+    finally:
+        with database.begin() as connection:
+            connection.execute(text("DELETE FROM slot_bookings WHERE appointment_id = :appointment_id"), {"appointment_id": appointment_id})
+
+    expire_data_versions()
+    assert (availability_id, slot_date, slot_start) in slot_keys(client, path)
+
+def test_cache_applies_closure_from_other_worker(database, synthetic_data, client):
+    from slots_cache import slots_cache
+
+    laboratory_id = synthetic_data["laboratories"][1].laboratory_id
+    path = f"/slots_availability?laboratory_id={laboratory_id}"
+    slots_cache.clear()
+    availability_id, slot_date, slot_start = slot_keys(client, path)[0]
+
+    closure_id = uuid.uuid4()
+    with database.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO laboratory_closures (closure_id, laboratory_id, start_datetime, end_datetime) "
+            "VALUES (:closure_id, :laboratory_id, CAST(:slot_date AS date) + CAST(:slot_start AS time), CAST(:slot_date AS date) + CAST(:slot_start AS time) + interval '1 minute')"
+        ), {"closure_id": closure_id, "laboratory_id": laboratory_id, "slot_date": slot_date, "slot_start": slot_start})
+    try:
+        expire_data_versions()
+        assert (availability_id, slot_date, slot_start) not in slot_keys(client, path)
+    finally:
+        with database.begin() as connection:
+            connection.execute(text("DELETE FROM laboratory_closures WHERE closure_id = :closure_id"), {"closure_id": closure_id})
+
+    expire_data_versions()
+    assert (availability_id, slot_date, slot_start) in slot_keys(client, path)
+
+def test_cache_follows_renamed_exam_type(database, synthetic_data, client):
+    from slots_cache import slots_cache
+
+    exam_type = synthetic_data["exam_types"][2]
+    path = f"/slots_availability?exam_type_id={exam_type.exam_type_id}"
+    slots_cache.clear()
+    first = client.get(path)
+    assert {slot["exam_type_name"] for slot in first.json} == {exam_type.name}
+
+    with database.begin() as connection:
+        connection.execute(text("UPDATE exam_types SET name = name || ' (rinominato)' WHERE exam_type_id = :exam_type_id"), {"exam_type_id": exam_type.exam_type_id})
+    try:
+        expire_data_versions()
+        # nuovo ETag e contenuto aggiornato, anche se le settimane erano in cache
+        second = client.get(path, headers={"If-None-Match": first.headers["ETag"]})
+        assert second.status_code == 200
+        assert second.headers["ETag"] != first.headers["ETag"]
+        assert {slot["exam_type_name"] for slot in second.json} == {exam_type.name + " (rinominato)"}
+    finally:
+        with database.begin() as connection:
+            connection.execute(text("UPDATE exam_types SET name = :name WHERE exam_type_id = :exam_type_id"), {"name": exam_type.name, "exam_type_id": exam_type.exam_type_id})
+        expire_data_versions()
@@ -0,0 +1,138 @@
+import pytest
+from datetime import date, datetime, time, timedelta
+from sqlalchemy.orm import Session
+
+# Equivalenza dei motori di generazione degli slot (python, numpy, parallel, cache, sql e sql paginato) e del riepilogo per giorno
+# con generate_availabile_slots, l'implementazione di riferimento, su diverse combinazioni di filtri
+# i motori in memoria ricevono i dati sintetici filtrati come le query di app.py e non richiedono il database,
+# il motore sql calcola gli slot con una query e viene confrontato sui dati caricati dal database
+
+# dimensione delle pagine del motore sql concatenate tramite il cursore
+SQL_PAGE_SIZE = 499
+
+#funzione che restituisce i filtri dei casi verificati
+def slots_cases(application, data):
+    datetime_from = datetime.combine(date.today() + timedelta(days=1), time(0, 0))
+    datetime_to = datetime_from + timedelta(days=90)
+    return {
+        "default": application.slots_filters(datetime_from, datetime_to),
+        "from_mid_day": application.slots_filters(datetime_from + timedelta(days=3, hours=10, minutes=17), datetime_to),
+        "two_weeks": application.slots_filters(datetime_from, datetime_from + timedelta(days=14)),
+        "exam_type": application.slots_filters(datetime_from, datetime_to, exam_type_id=data["exam_types"][0].exam_type_id),
+        "operator": application.slots_filters(datetime_from, datetime_to, operator_id=data["operators"][0].operator_id),
+        "laboratory": application.slots_filters(datetime_from, datetime_to, laboratory_id=data["laboratories"][0].laboratory_id)
+    }
+
+CASES = ("default", "from_mid_day", "two_weeks", "exam_type", "operator", "laboratory")
+
+def slot_key(slot):
+    from operators_availability import slot_sort_key
+    return (*slot_sort_key(slot), slot.operator_availability_slot_end)
+
+#funzione che indica se una disponibilità soddisfa i filtri su tipo di esame, operatore e laboratorio
+def availability_matches(operator_availability, filters):
+    return all(
+        not filters[field] or getattr(operator_availability, field) == filters[field]
+        for field in ("exam_type_id", "operator_id", "laboratory_id")
+    )
+
+#disponibilità dei dati in memoria, con gli stessi criteri di app.query_availability
+def memory_availability(data, filters):
+    return [
+        operator_availability for operator_availability in data["availabilities"]
+        if operator_availability.enabled
+        and operator_availability.available_to_date >= filters["datetime_from_filter"].date()
+        and availability_matches(operator_availability, filters)
+    ]
+
+#chiusure, assenze e prenotazioni dei dati in memoria, con gli stessi criteri di app.query_slots_conflicts
+def memory_conflicts(data, filters):
+    datetime_from = filters["datetime_from_filter"]
+    return (
+        [
+            closure for closure in data["closures"]
+            if closure.end_datetime >= datetime_from
+            and (not filters["laboratory_id"] or closure.laboratory_id == filters["laboratory_id"])
+        ],
+        [
+            absence for absence in data["absences"]
+            if absence.end_datetime >= datetime_from
+            and (not filters["operator_id"] or absence.operator_id == filters["operator_id"])
+        ],
+        [
+            booking for booking in data["bookings"]
+            if not booking.rejected
+            and booking.appointment_date >= datetime_from.date()
+            and availability_matches(booking.operators_availability, filters)
+        ]
+    )
+
+#slot di riferimento calcolati sui dati in ingresso di un caso
+def reference_slots(filters, availability, conflicts):
+    from operators_availability import generate_availabile_slots
+    return [slot_key(slot) for slot in generate_availabile_slots(availability, filters["datetime_from_filter"], filters["datetime_to_filter"], *conflicts)]
+
+@pytest.mark.parametrize("case", CASES)
+def test_engines_match_reference(application, generated_data, case, monkeypatch):
+    import operators_availability_parallel
+    from slots_cache import slots_cache, iter_cached_slots
+
+    # il motore parallel usa il pool di processi anche sulle finestre piccole dei dati di test
+    monkeypatch.setattr(operators_availability_parallel, "SLOTS_PARALLEL_WORKERS", 2)
+    monkeypatch.setattr(operators_availability_parallel, "SLOTS_PARALLEL_MIN_SLOTS", 0)
+
+    filters = slots_cases(application, generated_data)[case]
+    availability = memory_availability(generated_data, filters)
+    conflicts = memory_conflicts(generated_data, filters)
+    reference = reference_slots(filters, availability, conflicts)
+    assert reference, "il caso non genera slot: i dati sintetici non coprono i filtri"
+
+    for slots_engine, iter_engine_slots in application.SLOTS_ENGINES.items():
+        slots = iter_engine_slots(availability, filters["datetime_from_filter"], filters["datetime_to_filter"], *conflicts)
+        assert [slot_key(slot) for slot in slots] == reference, slots_engine
+
+    # cache degli slot: la prima lettura la popola con le settimane mancanti, la seconda la usa
+    slots_cache.clear()
+    for _ in range(2):
+        slots = iter_cached_slots(
+            availability,
+            filters["datetime_from_filter"],
+            filters["datetime_to_filter"],
+            lambda datetime_from: memory_conflicts(generated_data, {**filters, "datetime_from_filter": datetime_from})
+        )
+        assert [slot_key(slot) for slot in slots] == reference
+    slots_cache.clear()
+
+@pytest.mark.parametrize("case", CASES)
+def test_summary_matches_reference(application, generated_data, case):
+    from slots_summary import summarize_availabile_slots
+
+    filters = slots_cases(application, generated_data)[case]
+    availability = memory_availability(generated_data, filters)
+    conflicts = memory_conflicts(generated_data, filters)
+
+    reference_counts = {}
+    for slot_date, slot_start, availability_id, slot_end in reference_slots(filters, availability, conflicts):
+        reference_counts[(slot_date, None)] = reference_counts.get((slot_date, None), 0) + 1
+    assert summarize_availabile_slots(availability, filters["datetime_from_filter"], filters["datetime_to_filter"], *conflicts) == reference_counts
+
+@pytest.mark.parametrize("case", CASES)
+def test_sql_engine_matches_reference(application, synthetic_data, case):
+    filters = slots_cases(application, synthetic_data)[case]
+    with Session(application.get_read_engine()) as session:
+        availability = application.query_availability(session, filters)
+        reference = reference_slots(filters, availability, application.query_slots_conflicts(session, filters))
+        assert reference, "il caso non genera slot: i dati sintetici non coprono i filtri"
+
+        assert [slot_key(slot) for slot in application.iter_slots(session, filters, "sql")] == reference
+
+        # pagine del motore sql concatenate tramite il cursore
+        pages = []
+        after = None
+        while True:
+            page = [slot_key(slot) for slot in application.iter_slots(session, filters, "sql", after, SQL_PAGE_SIZE)]
+            pages.extend(page)
+            if len(page) < SQL_PAGE_SIZE:
+                break
+            after = page[-1][:3]
+        assert pages == reference
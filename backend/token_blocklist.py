@@ -0,0 +1,116 @@
+import os
+import logging
+import threading
+import time as clock
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from database import get_engine, TokenBlocklist
+
+# Blocklist dei token JWT revocati con il /logout
+# i jti sono salvati nella tabella token_blocklist (condivisa tra i worker) fino alla scadenza del token
+# davanti alla tabella c'è una cache in-process limitata dei jti revocati, fino alla loro scadenza
+# i jti verificati come validi vengono ricontrollati sul database ad ogni richiesta: un worker che li mantenesse in cache
+# continuerebbe ad accettare un token revocato con il /logout su un altro worker fino alla scadenza della voce
+
+load_dotenv()
+
+# database: tabella condivisa tra i worker, memory: solo in-process (sviluppo o worker singolo)
+TOKEN_BLOCKLIST_BACKEND = os.getenv("TOKEN_BLOCKLIST_BACKEND", "database")
+# numero massimo di jti mantenuti nella cache in-process
+TOKEN_BLOCKLIST_CACHE_SIZE = int(os.getenv("TOKEN_BLOCKLIST_CACHE_SIZE", "10000"))
+# per quanti secondi un jti verificato come non revocato non viene ricontrollato sul database, 0 per non mantenerlo in cache
+# con un valore positivo un token revocato su un altro worker resta accettato per al massimo questo intervallo:
+# compromesso da scegliere esplicitamente quando la query per richiesta pesa più di questa finestra dopo il logout
+TOKEN_BLOCKLIST_NEGATIVE_TTL_SECONDS = int(os.getenv("TOKEN_BLOCKLIST_NEGATIVE_TTL_SECONDS", "0"))
+# intervallo minimo tra due pulizie dei jti scaduti
+TOKEN_BLOCKLIST_PURGE_INTERVAL_SECONDS = int(os.getenv("TOKEN_BLOCKLIST_PURGE_INTERVAL_SECONDS", "3600"))
+
+#funzione che restituisce l'istante attuale in UTC senza timezone, come salvato sul database
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+#funzione per convertire il claim exp del token (secondi epoch) in datetime UTC senza timezone
+def expiration_to_datetime(exp):
+    return datetime.fromtimestamp(exp, timezone.utc).replace(tzinfo=None)
+
+class BlocklistCache:
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        # jti -> (revocato, scadenza della voce)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, jti, now):
+        with self.lock:
+            entry = self.entries.get(jti)
+            if entry is None:
+                return None
+            revoked, valid_until = entry
+            if valid_until <= now:
+                del self.entries[jti]
+                return None
+            self.entries.move_to_end(jti)
+            return revoked
+
+    def put(self, jti, revoked, valid_until):
+        with self.lock:
+            self.entries[jti] = (revoked, valid_until)
+            self.entries.move_to_end(jti)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def purge(self, now):
+        with self.lock:
+            for jti in [jti for jti, (revoked, valid_until) in self.entries.items() if valid_until <= now]:
+                del self.entries[jti]
+
+blocklist_cache = BlocklistCache(TOKEN_BLOCKLIST_CACHE_SIZE)
+last_purge = [0.0]
+
+#funzione per eliminare i jti scaduti, eseguita al massimo una volta ogni TOKEN_BLOCKLIST_PURGE_INTERVAL_SECONDS
+def purge_expired_tokens(force = False):
+    if not force and clock.monotonic() - last_purge[0] < TOKEN_BLOCKLIST_PURGE_INTERVAL_SECONDS:
+        return
+    last_purge[0] = clock.monotonic()
+    now = utc_now()
+    blocklist_cache.purge(now)
+    if TOKEN_BLOCKLIST_BACKEND == "database":
+        with Session(get_engine()) as session:
+            deleted = session.execute(delete(TokenBlocklist).where(TokenBlocklist.expires_at <= now)).rowcount
+            session.commit()
+        logging.info("Rimossi %s token scaduti dalla blocklist", deleted)
+
+#funzione per revocare un token fino alla sua scadenza
+def revoke_token(jti, exp):
+    expires_at = expiration_to_datetime(exp)
+    if TOKEN_BLOCKLIST_BACKEND == "database":
+        with Session(get_engine()) as session:
+            session.execute(insert(TokenBlocklist).values(jti=jti, expires_at=expires_at).on_conflict_do_nothing())
+            session.commit()
+    # la memoria in-process scade con il token: oltre la scadenza il token viene comunque rifiutato
+    blocklist_cache.put(jti, True, expires_at)
+    purge_expired_tokens()
+
+#funzione per verificare se un token è stato revocato
+def is_token_revoked(jti, exp):
+    now = utc_now()
+    revoked = blocklist_cache.get(jti, now)
+    if revoked is not None:
+        return revoked
+
+    if TOKEN_BLOCKLIST_BACKEND != "database":
+        return False
+
+    with Session(get_engine()) as session:
+        revoked = session.execute(select(TokenBlocklist.jti).where(TokenBlocklist.jti == jti)).first() is not None
+
+    if revoked:
+        blocklist_cache.put(jti, True, expiration_to_datetime(exp))
+    elif TOKEN_BLOCKLIST_NEGATIVE_TTL_SECONDS > 0:
+        blocklist_cache.put(jti, False, min(expiration_to_datetime(exp), now + timedelta(seconds=TOKEN_BLOCKLIST_NEGATIVE_TTL_SECONDS)))
+    return revoked
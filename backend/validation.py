@@ -0,0 +1,10 @@
+# Regole di validazione dei dati degli account, condivise da /register e dall'import massivo
+
+#Caratteri e numeri da 6 a 30 caratteri
+USERNAME_REGEX = r'^[0-9A-Za-z]{6,30}$'
+#Almeno una lettera maiuscola, una minuscola, un numero e un simbolo lunghezza da 8 a 32 caratteri
+PASSWORD_REGEX = r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[^a-zA-Z0-9]).{8,32}$'
+#Email valida
+EMAIL_REGEX    = r'^[a-zA-Z0-9._%+\-]+@[a-zA-Z0-9.\-]+\.[a-zA-Z]{2,}$'
+#Numero di telefono internazionale
+TEL_NUMBER_REGEX = r'^\+?\d{10,13}$'